@@ -11,9 +11,18 @@ import logging
 import argparse
 import locale
 import concurrent.futures
+import contextlib
+import subprocess
+import pickle
+import queue
+import io
+from collections import OrderedDict
 from urllib.parse import quote, unquote, urlparse, parse_qs
 import hashlib
 import uuid
+import json
+import base64
+import gzip
 import signal
 from datetime import timedelta
 
@@ -38,6 +47,8 @@ try:
     from watchdog.events import FileSystemEventHandler
     from werkzeug.middleware.proxy_fix import ProxyFix
     import mod
+    from mod.ttscn import t2s
+    from scan_worker import read_audio_tags, compute_fingerprint, parse_batch
 except ImportError as e:
     print(f"错误：无法导入依赖库。\n详情: {e}")
     # 额外写入当前目录 error_import.log
@@ -49,6 +60,25 @@ except ImportError as e:
     
     sys.exit(1)
 
+# 可选依赖：brotli 仅用于曲库快照的额外压缩编码
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# msgpack 仅用于列表接口的 format=msgpack 输出；lib 中附带纯 Python 版本，另行安装带 C 扩展的版本时更快
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# 可选依赖：Pillow 用于生成封面缩略图与占位色块，未安装时封面按原图返回
+try:
+    from PIL import Image, features as pil_features
+except ImportError:
+    Image = None
+    pil_features = None
+
 # 计算 www 的绝对路径
 TEMPLATE_DIR = os.path.abspath(os.path.join(BASE_DIR, '../www/templates'))
 STATIC_DIR = os.path.abspath(os.path.join(BASE_DIR, '../www/static'))
@@ -73,6 +103,19 @@ parser.add_argument('--log-path', type=str, default=os.environ.get('LOG_PATH'),
 parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 23237)), help='Server port')
 parser.add_argument('--password', type=str, default=os.environ.get('APP_AUTH_PASSWORD') or os.environ.get('APP_PASSWORD'),
                     help='Optional password for web access; leave empty to disable auth')
+parser.add_argument('--db-cache-size', type=int, default=int(os.environ.get('DB_CACHE_SIZE_KB', 65536)),
+                    help='SQLite page cache size per connection in KiB')
+parser.add_argument('--db-mmap-size', type=int, default=int(os.environ.get('DB_MMAP_SIZE_MB', 256)),
+                    help='SQLite memory-mapped I/O size in MiB; 0 disables mmap')
+parser.add_argument('--scan-workers', type=int, default=int(os.environ.get('SCAN_WORKERS', 0)),
+                    help='Metadata extraction workers during scans; 0 uses the CPU count')
+parser.add_argument('--scan-mode', type=str, choices=('thread', 'process'), default=os.environ.get('SCAN_MODE', 'thread'),
+                    help='Run metadata extraction in threads or in long-lived worker processes')
+parser.add_argument('--cover-cache-size', type=int, default=int(os.environ.get('COVER_CACHE_MB', 512)),
+                    help='Disk budget in MiB for embedded covers extracted on demand')
+parser.add_argument('--mount-index', action='store_true',
+                    default=os.environ.get('MOUNT_INDEX', '').lower() in ('1', 'true', 'yes'),
+                    help='After scans, copy each mount\'s songs to a portable export file that is re-imported when the drive is added elsewhere (a copy, not a separate database)')
 args = parser.parse_args()
 
 # --- 路径初始化 ---
@@ -107,6 +150,15 @@ logging.getLogger('werkzeug').addFilter(AccessLogFilter())
 
 logger.info(f"Music Library Path: {MUSIC_LIBRARY_PATH}")
 
+# 可选依赖含编译扩展，没有随 lib 附带，需手动安装；未安装时对应功能关闭，状态见 /api/system/status
+OPTIONAL_FEATURES = {
+    'cover_thumbnails': Image is not None,  # Pillow：封面缩略图、WebP 与加载占位色块
+    'cover_palette': Image is not None,     # Pillow：列表中的 cover_palette 封面配色
+    'brotli': brotli is not None,           # brotli：曲库快照的 br 压缩
+}
+if not all(OPTIONAL_FEATURES.values()):
+    logger.info(f"未安装可选依赖，以下功能已关闭: {', '.join(k for k, v in OPTIONAL_FEATURES.items() if not v)}")
+
 # --- 全局状态变量 ---
 SCAN_STATUS = {
     'scanning': False,
@@ -124,6 +176,12 @@ scan_status_lock = threading.Lock()
 # 库版本戳，用于前端检测变更
 LIBRARY_VERSION = time.time()
 
+def bump_library_version():
+    """更新库版本戳，并在后台重建曲库列表快照。"""
+    global LIBRARY_VERSION
+    LIBRARY_VERSION = time.time()
+    LIBRARY_SNAPSHOT.schedule_rebuild()
+
 # 辅助: 生成ID
 def generate_song_id(path):
     return hashlib.md5(path.encode('utf-8')).hexdigest()
@@ -135,59 +193,175 @@ class MusicFileEventHandler(FileSystemEventHandler):
         if event.is_directory: return
         self._process(event.src_path, 'created')
 
-    def on_deleted(self, event):
+    def on_modified(self, event):
+        # 复制大文件或外部改写标签时会持续触发，交给防抖队列合并
         if event.is_directory: return
-        self._process(event.src_path, 'deleted')
+        self._process(event.src_path, 'created')
 
-    def on_moved(self, event):
-        if event.is_directory: return
-        # 视为删除旧文件，添加新文件
+    def on_deleted(self, event):
+        if event.is_directory:
+            self._delete_dir(event.src_path)
+            return
         self._process(event.src_path, 'deleted')
-        self._process(event.dest_path, 'created')
 
-    def _process(self, path, action):
-        global LIBRARY_VERSION
-        filename = os.path.basename(path)
-        ext = os.path.splitext(filename)[1].lower()
-        
-        is_audio = ext in AUDIO_EXTS
-        is_misc = ext in ('.lrc', '.jpg', '.jpeg', '.png')
-        
-        if not is_audio and not is_misc:
+    def on_moved(self, event):
+        src, dest = event.src_path, event.dest_path
+        if event.is_directory:
+            self._move_dir(src, dest)
             return
+        if os.path.splitext(src)[1].lower() in AUDIO_EXTS and os.path.splitext(dest)[1].lower() in AUDIO_EXTS:
+            self._move_file(src, dest)
+            return
+        # 扩展名变化（如改为 .bak）视为删除旧文件，添加新文件
+        self._process(src, 'deleted')
+        self._process(dest, 'created')
 
-        logger.info(f"检测到文件变更 [{action}]: {filename}")
-        
+    def _move_file(self, src, dest):
+        logger.info(f"检测到文件移动: {src} -> {dest}")
+        FILE_EVENTS.rename(src, dest)
         try:
-            if action == 'created':
-                time.sleep(0.5)
-                if is_audio:
-                    index_single_file(path)
-                elif is_misc:
-                    # 如果是附件，尝试重新索引同名音频文件以更新状态
-                    base = os.path.splitext(path)[0]
-                    for aud in AUDIO_EXTS:
-                        aud_path = base + aud
-                        if os.path.exists(aud_path):
-                            index_single_file(aud_path)
-                            
-            elif action == 'deleted':
-                if is_audio:
-                    with get_db() as conn:
-                        conn.execute("DELETE FROM songs WHERE path=?", (path,))
-                        conn.commit()
-                elif is_misc:
-                    # 附件删除，同样反向更新音频状态
-                    base = os.path.splitext(path)[0]
-                    for aud in AUDIO_EXTS:
-                        aud_path = base + aud
-                        if os.path.exists(aud_path):
-                            index_single_file(aud_path)
-            
-            LIBRARY_VERSION = time.time()
-            
+            with get_db() as conn:
+                moved = move_song_file(conn, src, dest)
+                if moved:
+                    move_song_sidecars(conn, src, dest)
+                    refresh_song_cover(conn, dest)
+            if moved:
+                bump_library_version()
+            else:
+                # 旧路径未入库（或目录移动时已处理），按新文件排队索引；未变化时不会重新解析
+                FILE_EVENTS.push(dest, 'created')
         except Exception as e:
-            logger.error(f"处理文件变更失败: {e}")
+            logger.error(f"处理文件移动失败: {e}")
+
+    def _move_dir(self, src, dest):
+        FILE_EVENTS.rename(src, dest, is_directory=True)
+        try:
+            with get_db() as conn:
+                count = move_song_dir(conn, src, dest)
+            if count:
+                logger.info(f"检测到目录移动: {src} -> {dest}，更新 {count} 首歌曲路径")
+                bump_library_version()
+        except Exception as e:
+            logger.error(f"处理目录移动失败: {e}")
+
+    def _delete_dir(self, path):
+        root = library_root_for(path)
+        if root and not mount_available(root):
+            # 挂载目录被拔出或卸载，交给调度器标记离线而不是删除
+            SCAN_SCHEDULER.submit_scan(root, scrape=False)
+            return
+        try:
+            with get_db() as conn:
+                delete_songs_where(conn, "path >= ? AND path < ?", path_prefix_range(path))
+            bump_library_version()
+        except Exception as e:
+            logger.error(f"处理目录删除失败: {e}")
+
+    def _process(self, path, action):
+        ext = os.path.splitext(path)[1].lower()
+        if ext in AUDIO_EXTS or ext in SIDECAR_EXTS:
+            FILE_EVENTS.push(path, action)
+
+SIDECAR_EXTS = ('.lrc', '.jpg', '.jpeg', '.png')
+FILE_EVENT_DEBOUNCE = 1.0   # 同一路径最后一次事件后的静默时间（秒）
+FILE_EVENT_BATCH = 500      # 每批最多处理的路径数
+
+class FileEventQueue:
+    """按路径合并的防抖文件事件队列。
+
+    同一路径的多次事件只保留最后一次；静默期过后再确认文件大小不再变化，
+    仍在写入的文件顺延处理。到期的事件按批索引，每批一次提交、一次库版本更新。
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending = {}  # path -> [action, due, size]
+        self._worker = None
+
+    def push(self, path, action):
+        with self._cond:
+            self._pending[path] = [action, time.time() + FILE_EVENT_DEBOUNCE, self._size(path)]
+            if not self._worker or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+            self._cond.notify()
+
+    def rename(self, src, dest, is_directory=False):
+        """文件移动时把尚未处理的事件一并改到新路径下。"""
+        with self._cond:
+            if is_directory:
+                prefix = src.rstrip(os.sep) + os.sep
+                moved = [p for p in self._pending if p.startswith(prefix)]
+                for p in moved:
+                    self._pending[dest.rstrip(os.sep) + os.sep + p[len(prefix):]] = self._pending.pop(p)
+            elif src in self._pending:
+                self._pending[dest] = self._pending.pop(src)
+
+    @staticmethod
+    def _size(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return None
+
+    def _take_due(self):
+        """取出到期且大小已稳定的事件；返回 {path: action}，队列为空时返回 None。"""
+        with self._cond:
+            while True:
+                if not self._pending:
+                    self._worker = None
+                    return None
+                now = time.time()
+                due = {p: item for p, item in self._pending.items() if item[1] <= now}
+                if due:
+                    break
+                self._cond.wait(min(item[1] for item in self._pending.values()) - now)
+            ready = {}
+            for path, item in due.items():
+                if len(ready) >= FILE_EVENT_BATCH:
+                    break
+                size = self._size(path)
+                if item[0] != 'deleted' and size is not None and size != item[2]:
+                    # 仍在写入，顺延一个静默期
+                    item[1], item[2] = now + FILE_EVENT_DEBOUNCE, size
+                    continue
+                ready[path] = item[0]
+                del self._pending[path]
+            return ready
+
+    def _run(self):
+        while True:
+            ready = self._take_due()
+            if ready is None:
+                return
+            if ready:
+                try:
+                    self._process_batch(ready)
+                except Exception as e:
+                    logger.error(f"处理文件变更失败: {e}")
+
+    def _process_batch(self, events):
+        deleted, to_index = [], set()
+        for path, action in events.items():
+            ext = os.path.splitext(path)[1].lower()
+            if ext in AUDIO_EXTS:
+                if action == 'deleted' or not os.path.exists(path):
+                    deleted.append(path)
+                else:
+                    to_index.add(path)
+            else:
+                # 附件变化，重新索引同名音频文件以更新封面状态
+                base = os.path.splitext(path)[0]
+                to_index.update(base + aud for aud in AUDIO_EXTS if os.path.exists(base + aud))
+        offline_roots = {r for r in map(library_root_for, deleted) if r and not mount_available(r)}
+        if offline_roots:
+            deleted = [p for p in deleted if library_root_for(p) not in offline_roots]
+            for root in offline_roots:
+                SCAN_SCHEDULER.submit_scan(root, scrape=False)
+        logger.info(f"处理文件变更: 索引 {len(to_index)} 个, 删除 {len(deleted)} 个")
+        if index_files(to_index, deleted):
+            bump_library_version()
+
+FILE_EVENTS = FileEventQueue()
 
 # 全局 Observer 实例
 global_observer = None
@@ -201,8 +375,9 @@ def init_watchdog():
         global_observer.join()
         
     global_observer = Observer()
-    refresh_watchdog_paths()
     global_observer.start()
+    # 监听在后台逐个根目录注册，不阻塞启动
+    refresh_watchdog_paths()
     logger.info("文件监听服务已启动")
     try:
         while True:
@@ -227,43 +402,219 @@ signal.signal(signal.SIGTERM, shutdown_handler)
 signal.signal(signal.SIGINT, shutdown_handler)
 
 def refresh_watchdog_paths():
-    """根据数据库刷新监听目录"""
-    global global_observer
-    if not global_observer: return
-    
-    # 1. 移除现有所有 schedule
-    global_observer.unschedule_all()
-    
-    # 2. 获取目标路径
-    # 2. 获取目标路径并去重
+    """根据数据库刷新监听目录（后台增量执行）。"""
+    WATCHERS.refresh()
+
+# --- 监听后端 ---
+# 每个根目录单独选择后端：本地存储用 inotify（watchdog Observer），网络存储或超出 inotify 预算时
+# 改为轮询目录 mtime（只 stat 上次扫描记录的目录，不列目录、不 stat 文件），发现变化后排队扫描该目录
+WATCH_BACKENDS = ('inotify', 'poll', 'off')
+WATCH_POLL_INTERVAL = 60        # 轮询间隔（秒）
+WATCH_POLL_MAX_DIRS = 64        # 一轮中变化的目录超过该数量时直接扫描整个根目录
+WATCH_BUDGET_RATIO = 0.8        # 最多使用 inotify 上限的比例，给系统其他程序留余量
+
+def inotify_watch_limit():
+    """读取 fs.inotify.max_user_watches，无法读取时返回 None。"""
     try:
-        raw_paths = {os.path.abspath(MUSIC_LIBRARY_PATH)}
-        with get_db() as conn:
-            rows = conn.execute("SELECT path FROM mount_points").fetchall()
-            for r in rows: 
-                if r['path']:
-                    raw_paths.add(os.path.abspath(r['path']))
-    except: 
-        raw_paths = {os.path.abspath(MUSIC_LIBRARY_PATH)}
-
-    # 路径规范化与去重 (排除子目录)
-    sorted_paths = sorted(list(raw_paths), key=len)
+        with open('/proc/sys/fs/inotify/max_user_watches') as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+def _watch_targets():
+    """需要监听的根目录：曲库与挂载目录，去掉已被上级目录覆盖的子目录。"""
     final_targets = []
-    for p in sorted_paths:
-        # 如果当前路径是已添加路径的子目录，则跳过
+    for p in sorted(library_roots(), key=len):
         if not any(p.startswith(parent + os.sep) or p == parent for parent in final_targets):
             final_targets.append(p)
-    
-    # 3. 重新添加 schedule
-    event_handler = MusicFileEventHandler()
-    for path in final_targets:
-        if os.path.exists(path):
+    return final_targets
+
+def _known_dir_count(conn, root):
+    """上次扫描记录的目录数，用于估算 inotify 监听数。"""
+    lo, hi = path_prefix_range(root)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM scan_dirs WHERE path = ? OR (path >= ? AND path < ?)",
+                            (root.rstrip(os.sep), lo, hi)).fetchone()[0]
+    except sqlite3.OperationalError:
+        # 启动时数据库可能尚未完成迁移
+        return 0
+
+class WatchManager:
+    """按根目录管理监听：增量添加/移除，记录各根目录的后端与 inotify 监听数预算。"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._watches = {}     # 根目录 -> {'backend', 'dirs', 'handle', 'error'}
+        self._pending = False
+        self._worker = None
+        self._poller = None
+
+    def refresh(self):
+        """在后台线程中按当前根目录增量更新监听，多次调用合并为一次。"""
+        with self._lock:
+            self._pending = True
+            if self._worker and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run_refresh, daemon=True)
+            self._worker.start()
+
+    def _run_refresh(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    return
+                self._pending = False
             try:
-                global_observer.schedule(event_handler, path, recursive=True)
-                logger.info(f"监听目录: {path}")
+                self._sync()
             except Exception as e:
-                logger.warning(f"无法监听目录 {path}: {e}")
+                logger.warning(f"更新监听目录失败: {e}")
+
+    def _choose_backend(self, root, dirs, budget_left):
+        override = _storage_override(root).get('watch')
+        if override in WATCH_BACKENDS:
+            return override
+        if not Observer:
+            return 'poll'
+        if detect_storage_class(root) == 'network':
+            # SMB/NFS 上其他客户端的修改不会触发 inotify
+            return 'poll'
+        if budget_left is not None and dirs > budget_left:
+            return 'poll'
+        return 'inotify'
+
+    def _sync(self):
+        targets = [p for p in _watch_targets() if os.path.exists(p)]
+        limit = inotify_watch_limit()
+        with get_db() as conn:
+            dir_counts = {root: max(1, _known_dir_count(conn, root)) for root in targets}
+
+        with self._lock:
+            current = dict(self._watches)
+        # 移除已不需要或后端需要变化的监听
+        for root, watch in current.items():
+            if root not in dir_counts:
+                self._remove(root, watch)
+        with self._lock:
+            used = sum(w['dirs'] for w in self._watches.values() if w['backend'] == 'inotify')
+        for root in targets:
+            with self._lock:
+                watch = self._watches.get(root)
+            dirs = dir_counts[root]
+            budget_left = None
+            if limit is not None:
+                # 已在 inotify 下的根目录，自身占用的监听数不计入已用
+                budget_left = int(limit * WATCH_BUDGET_RATIO) - used
+                if watch and watch['backend'] == 'inotify':
+                    budget_left += watch['dirs']
+            backend = self._choose_backend(root, dirs, budget_left)
+            if watch and watch['backend'] == backend:
+                if backend == 'inotify':
+                    used += dirs - watch['dirs']
+                watch['dirs'] = dirs
+                continue
+            if watch:
+                self._remove(root, watch)
+                if watch['backend'] == 'inotify':
+                    used -= watch['dirs']
+            if backend == 'inotify':
+                if self._add_inotify(root, dirs):
+                    used += dirs
+                    continue
+                backend = 'poll'
+            with self._lock:
+                self._watches[root] = {'backend': backend, 'dirs': dirs, 'handle': None, 'error': None}
+            logger.info(f"监听目录: {root}（{'轮询目录修改时间' if backend == 'poll' else '不监听'}）")
+        self._ensure_poller()
 
+    def _add_inotify(self, root, dirs):
+        try:
+            handle = global_observer.schedule(MusicFileEventHandler(), root, recursive=True)
+        except Exception as e:
+            # 多为 inotify 监听数耗尽（ENOSPC），改为轮询
+            logger.warning(f"无法监听目录 {root}: {e}，改为轮询")
+            return False
+        with self._lock:
+            self._watches[root] = {'backend': 'inotify', 'dirs': dirs, 'handle': handle, 'error': None}
+        logger.info(f"监听目录: {root}（inotify，约 {dirs} 个目录）")
+        return True
+
+    def _remove(self, root, watch):
+        if watch['handle'] is not None and global_observer:
+            try:
+                global_observer.unschedule(watch['handle'])
+            except Exception as e:
+                logger.warning(f"取消监听失败: {root}, 错误: {e}")
+        with self._lock:
+            self._watches.pop(root, None)
+
+    def _ensure_poller(self):
+        with self._lock:
+            if self._poller and self._poller.is_alive():
+                return
+            if not any(w['backend'] == 'poll' for w in self._watches.values()):
+                return
+            self._poller = threading.Thread(target=self._poll_loop, daemon=True)
+            self._poller.start()
+
+    def _poll_loop(self):
+        while True:
+            time.sleep(WATCH_POLL_INTERVAL)
+            with self._lock:
+                roots = [root for root, w in self._watches.items() if w['backend'] == 'poll']
+            if not roots:
+                return
+            for root in roots:
+                try:
+                    self._poll_root(root)
+                except Exception as e:
+                    with self._lock:
+                        if root in self._watches:
+                            self._watches[root]['error'] = str(e)
+                    logger.warning(f"轮询目录失败: {root}, 错误: {e}")
+
+    def _poll_root(self, root):
+        """stat 上次扫描记录的目录，mtime 变化或消失的目录排队扫描。"""
+        if not mount_available(root):
+            SCAN_SCHEDULER.submit_scan(root, scrape=False)
+            return
+        lo, hi = path_prefix_range(root)
+        changed, last = [], ''
+        while True:
+            with get_db() as conn:
+                rows = conn.execute("SELECT path, mtime FROM scan_dirs WHERE path > ? AND (path = ? OR (path >= ? AND path < ?)) ORDER BY path LIMIT ?",
+                                    (last, root.rstrip(os.sep), lo, hi, SCAN_BATCH_SIZE)).fetchall()
+            if not rows:
+                break
+            last = rows[-1]['path']
+            for row in rows:
+                try:
+                    if os.stat(row['path']).st_mtime != row['mtime']:
+                        changed.append(row['path'])
+                except OSError:
+                    # 目录被删除时上级目录的 mtime 也会变化，由上级目录的扫描处理
+                    continue
+        if not changed:
+            return
+        logger.info(f"轮询发现 {len(changed)} 个目录有变化: {root}")
+        if len(changed) > WATCH_POLL_MAX_DIRS:
+            SCAN_SCHEDULER.submit_scan(root, scrape=False)
+            return
+        for path in changed:
+            SCAN_SCHEDULER.submit_scan(path, scrape=False)
+
+    def status(self):
+        limit = inotify_watch_limit()
+        with self._lock:
+            roots = {root: {'backend': w['backend'], 'dirs': w['dirs'], 'error': w['error']} for root, w in self._watches.items()}
+        used = sum(w['dirs'] for w in roots.values() if w['backend'] == 'inotify')
+        return {
+            'roots': roots,
+            'inotify_limit': limit,
+            'inotify_budget': int(limit * WATCH_BUDGET_RATIO) if limit else None,
+            'inotify_used': used,
+            'poll_interval': WATCH_POLL_INTERVAL,
+        }
+
+WATCHERS = WatchManager()
 
 NETEASE_DOWNLOAD_DIR = os.path.join(MUSIC_LIBRARY_PATH, 'NetEase')
 NETEASE_API_BASE_DEFAULT = 'http://localhost:23236'
@@ -519,76 +870,416 @@ def logout():
     return resp
 
 # --- 数据库管理 ---
+DB_CACHE_SIZE_KB = max(0, args.db_cache_size)
+DB_MMAP_SIZE = max(0, args.db_mmap_size) * 1024 * 1024
+DB_STATEMENT_CACHE_SIZE = 256   # 每个连接缓存的预编译语句数量
+DB_POOL_MAX_IDLE = 16           # 空闲连接上限，超出后直接关闭
+DB_OPTIMIZE_INTERVAL = 3600     # PRAGMA optimize 执行间隔（秒）
+
+class DBConnectionPool:
+    """SQLite 连接池。
+
+    同一线程内的嵌套 get_db() 复用同一连接；最外层用完后归还空闲池，
+    供其他线程（如 Flask 请求线程）直接复用，避免每次请求重新打开数据库。
+    """
+    def __init__(self, db_path, max_idle=DB_POOL_MAX_IDLE):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self._local = threading.local()
+        self._idle = []
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._wal_ready = False
+        self._last_optimize = time.time()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30.0, check_same_thread=False,
+                               cached_statements=DB_STATEMENT_CACHE_SIZE)
+        conn.row_factory = sqlite3.Row
+        if not self._wal_ready:
+            # journal_mode 持久化在数据库文件中，只需设置一次
+            try:
+                mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+                if str(mode).lower() != 'wal':
+                    logger.warning(f"数据库未能切换到 WAL 模式，当前模式: {mode}")
+                self._wal_ready = True
+            except sqlite3.OperationalError as e:
+                logger.warning(f"设置 WAL 模式失败: {e}")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        return conn
+
+    def acquire(self):
+        local = self._local
+        if getattr(local, 'conn', None) is not None:
+            local.depth += 1
+            return local.conn
+
+        conn = None
+        stale = []
+        with self._lock:
+            generation = self._generation
+            while self._idle and conn is None:
+                gen, candidate = self._idle.pop()
+                if gen == generation:
+                    conn = candidate
+                else:
+                    stale.append(candidate)
+        for c in stale:
+            try: c.close()
+            except Exception: pass
+        if conn is None:
+            conn = self._connect()
+
+        local.conn = conn
+        local.depth = 1
+        local.generation = generation
+        return conn
+
+    def release(self, failed=False):
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        if conn is None:
+            return
+        local.depth -= 1
+        if local.depth > 0:
+            return
+        local.conn = None
+
+        try:
+            if failed:
+                conn.rollback()
+            else:
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"数据库事务收尾失败: {e}")
+        self._maybe_optimize(conn)
+
+        with self._lock:
+            if local.generation == self._generation and len(self._idle) < self.max_idle:
+                self._idle.append((local.generation, conn))
+                return
+        try: conn.close()
+        except Exception: pass
+
+    def _maybe_optimize(self, conn, force=False):
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_optimize < DB_OPTIMIZE_INTERVAL:
+                return
+            self._last_optimize = now
+        try:
+            conn.execute("PRAGMA optimize")
+        except sqlite3.Error as e:
+            logger.warning(f"PRAGMA optimize 执行失败: {e}")
+
+    def optimize(self):
+        """立即执行一次 PRAGMA optimize（如大批量写入后）。"""
+        with get_db() as conn:
+            self._maybe_optimize(conn, force=True)
+
+    def close_all(self):
+        """关闭所有空闲连接；正在使用中的连接归还时会被丢弃。"""
+        with self._lock:
+            self._generation += 1
+            self._wal_ready = False
+            idle, self._idle = self._idle, []
+        for _, conn in idle:
+            try: conn.close()
+            except Exception: pass
+
+class _PooledConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def __enter__(self):
+        return self.pool.acquire()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.pool.release(failed=exc_type is not None)
+        return False
+
+DB_POOL = DBConnectionPool(DB_PATH)
+
 def get_db():
-    conn = sqlite3.connect(DB_PATH, timeout=30.0, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """从连接池获取连接，需配合 with 使用；退出时自动提交（异常时回滚）。"""
+    return _PooledConnection(DB_POOL)
+
+# --- 数据库结构迁移 ---
+# 每个迁移步骤只追加、不修改；新的表结构变更请在 SCHEMA_MIGRATIONS 末尾追加新版本。
+def _migration_base_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS songs (
+            id TEXT PRIMARY KEY,
+            path TEXT UNIQUE,
+            filename TEXT,
+            title TEXT,
+            artist TEXT,
+            album TEXT,
+            mtime REAL,
+            size INTEGER,
+            has_cover INTEGER DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS favorite_playlists (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            is_default INTEGER DEFAULT 0,
+            created_at REAL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS favorites (
+           song_id TEXT,
+           playlist_id TEXT,
+           title TEXT DEFAULT '',
+           artist TEXT DEFAULT '',
+           created_at REAL,
+           PRIMARY KEY (song_id, playlist_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS mount_points (
+            path TEXT PRIMARY KEY,
+            created_at REAL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS system_settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+def _migration_query_indexes(conn):
+    # 查重 (filename, size)、按文件名查路径、列表排序与收藏夹查询
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_filename_size ON songs(filename, size)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_title ON songs(title)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_artist_album ON songs(artist, album)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_favorites_playlist ON favorites(playlist_id)")
+
+def _migration_search_index(conn):
+    try:
+        conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS songs_fts USING fts5({', '.join(SEARCH_INDEX_COLUMNS)}, tokenize='trigram')")
+    except sqlite3.OperationalError as e:
+        # 旧版 SQLite 未编译 FTS5 / trigram，搜索接口会退回 LIKE 查询
+        logger.warning(f"当前 SQLite 不支持 FTS5 trigram，跳过全文索引: {e}")
+        return
+    rebuild_search_index(conn)
+
+def _migration_sort_indexes(conn):
+    # 键集分页要求排序列非 NULL，统一用空字符串
+    for col in ('title', 'artist', 'album'):
+        conn.execute(f"UPDATE songs SET {col}='' WHERE {col} IS NULL")
+    # 单列索引隐含 rowid，可直接支撑 ORDER BY col, rowid 的键集分页
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_artist ON songs(artist)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_album ON songs(album)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_mtime ON songs(mtime)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_size ON songs(size)")
+    # 列表去重 (title, artist, size)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_dedup ON songs(title, artist, size)")
+
+def _migration_library_changes(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS library_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            song_id TEXT NOT NULL,
+            action TEXT NOT NULL,
+            changed_at REAL
+        )
+    ''')
+
+def _migration_stream_info(conn):
+    # codec 为 NULL 表示尚未用统一读取器解析过，下次扫描会重新读取
+    for column, col_type in (('duration', 'REAL'), ('bitrate', 'INTEGER'), ('sample_rate', 'INTEGER'),
+                             ('codec', 'TEXT'), ('lyrics', 'TEXT')):
+        conn.execute(f"ALTER TABLE songs ADD COLUMN {column} {col_type}")
+
+def _migration_fingerprints(conn):
+    # fingerprint 为 NULL 的旧记录会在下次扫描时补算；重复分组改由内容指纹维护
+    conn.execute("ALTER TABLE songs ADD COLUMN fingerprint TEXT")
+    conn.execute("ALTER TABLE songs ADD COLUMN duplicate_group TEXT")
+    conn.execute("ALTER TABLE songs ADD COLUMN is_canonical INTEGER DEFAULT 1")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_fingerprint ON songs(fingerprint)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_duplicate_group ON songs(duplicate_group) WHERE duplicate_group IS NOT NULL")
+    conn.execute("DROP INDEX IF EXISTS idx_songs_dedup")
+
+def _migration_scan_dirs(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scan_dirs (
+            path TEXT PRIMARY KEY,
+            mtime REAL,
+            entries INTEGER,
+            scanned_at REAL
+        )
+    ''')
+
+def _migration_offline(conn):
+    # 所在挂载目录不可用时标记为离线而不是删除，挂载恢复后按大小与修改时间直接恢复
+    conn.execute("ALTER TABLE songs ADD COLUMN offline INTEGER DEFAULT 0")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_offline ON songs(path) WHERE offline = 1")
+
+def _migration_tag_cache(conn):
+    # 按内容指纹 + 大小 + 修改时间缓存解析结果，与路径无关，移除挂载目录后仍保留
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tag_cache (
+            fingerprint TEXT,
+            size INTEGER,
+            mtime REAL,
+            title TEXT,
+            artist TEXT,
+            album TEXT,
+            has_cover INTEGER,
+            duration REAL,
+            bitrate INTEGER,
+            sample_rate INTEGER,
+            codec TEXT,
+            lyrics TEXT,
+            cached_at REAL,
+            PRIMARY KEY (fingerprint, size, mtime)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tag_cache_stat ON tag_cache(size, mtime)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tag_cache_cached_at ON tag_cache(cached_at)")
+    conn.execute('''
+        INSERT OR IGNORE INTO tag_cache
+        SELECT fingerprint, size, mtime, title, artist, album, has_cover, duration, bitrate, sample_rate, codec, lyrics, ?
+        FROM songs WHERE fingerprint IS NOT NULL AND codec IS NOT NULL
+    ''', (time.time(),))
+
+def _migration_scan_history(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scan_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at REAL,
+            finished_at REAL,
+            scope TEXT,
+            full INTEGER,
+            storage_class TEXT,
+            written INTEGER,
+            deleted INTEGER,
+            report TEXT
+        )
+    ''')
+
+def _migration_cover_thumbs(conn):
+    # 封面按内容哈希登记尺寸与占位色块；cover_hash 为 NULL 表示无封面或尚未登记
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS covers (
+            hash TEXT PRIMARY KEY,
+            width INTEGER,
+            height INTEGER,
+            lqip TEXT,
+            created_at REAL
+        )
+    ''')
+    conn.execute("ALTER TABLE songs ADD COLUMN cover_hash TEXT")
+    conn.execute("ALTER TABLE tag_cache ADD COLUMN cover_hash TEXT")
+
+def _migration_cover_store(conn):
+    # source 为封面字节所在文件（存储副本或同名 .jpg），kind 标明来源；按哈希查找引用的歌曲
+    conn.execute("ALTER TABLE covers ADD COLUMN source TEXT")
+    conn.execute("ALTER TABLE covers ADD COLUMN kind TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_cover_hash ON songs(cover_hash) WHERE cover_hash IS NOT NULL")
+
+def _migration_cover_palette(conn):
+    # 逗号分隔的十六进制颜色，第一个为主色；未安装 Pillow 时为 NULL
+    conn.execute("ALTER TABLE covers ADD COLUMN palette TEXT")
+
+def _migration_scan_history_error(conn):
+    # 扫描中途失败时记下错误信息，成功的扫描为 NULL
+    conn.execute("ALTER TABLE scan_history ADD COLUMN error TEXT")
+
+SCHEMA_MIGRATIONS = [
+    (1, '基础表结构', _migration_base_tables),
+    (2, '常用查询索引', _migration_query_indexes),
+    (3, '全文搜索索引', _migration_search_index),
+    (4, '列表排序索引', _migration_sort_indexes),
+    (5, '曲库变更日志', _migration_library_changes),
+    (6, '音频流信息与内嵌歌词', _migration_stream_info),
+    (7, '内容指纹与重复分组', _migration_fingerprints),
+    (8, '目录快照', _migration_scan_dirs),
+    (9, '离线挂载标记', _migration_offline),
+    (10, '标签解析缓存', _migration_tag_cache),
+    (11, '扫描历史', _migration_scan_history),
+    (12, '封面缩略图', _migration_cover_thumbs),
+    (13, '封面内容寻址存储', _migration_cover_store),
+    (14, '封面配色', _migration_cover_palette),
+    (15, '扫描失败记录', _migration_scan_history_error),
+]
+
+def get_schema_version(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at REAL
+        )
+    ''')
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+def migrate_db(conn):
+    """按版本顺序执行尚未应用的迁移，每个版本独立事务。"""
+    current = get_schema_version(conn)
+    conn.commit()
+    for version, description, step in SCHEMA_MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info(f"执行数据库迁移 v{version}: {description}")
+        try:
+            conn.execute("BEGIN")
+            step(conn)
+            conn.execute("INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                         (version, description, time.time()))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        current = version
+    return current
+
+# 启动线程与主入口都会调用 init_db，迁移只能执行一次，并发执行会互相冲突并触发重建
+_INIT_DB_LOCK = threading.Lock()
+_DB_INITIALIZED = False
 
 def init_db():
+    global _DB_INITIALIZED
+    with _INIT_DB_LOCK:
+        if not _DB_INITIALIZED:
+            _init_db_once()
+            _DB_INITIALIZED = True
+
+def _init_db_once():
     def _init_db_core():
         with get_db() as conn:
-            # 检查旧模式并迁移
+            # 检查旧模式并迁移（早于版本化迁移的数据库）；游标须读完，未结束的查询会让迁移中的 DROP 报 table is locked
             try:
-                cursor = conn.execute("SELECT path FROM songs LIMIT 1")
+                conn.execute("SELECT path FROM songs LIMIT 1").fetchone()
             except Exception:
                 conn.execute("DROP TABLE IF EXISTS songs")
                 conn.execute("DROP TABLE IF EXISTS mount_files")
 
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS songs (
-                    id TEXT PRIMARY KEY,
-                    path TEXT UNIQUE,
-                    filename TEXT,
-                    title TEXT,
-                    artist TEXT,
-                    album TEXT,
-                    mtime REAL,
-                    size INTEGER,
-                    has_cover INTEGER DEFAULT 0
-                )
-            ''')
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS favorite_playlists (
-                    id TEXT PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    is_default INTEGER DEFAULT 0,
-                    created_at REAL
-                )
-            ''')
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS favorites (
-                   song_id TEXT,
-                   playlist_id TEXT,
-                   title TEXT DEFAULT '',
-                   artist TEXT DEFAULT '',
-                   created_at REAL,
-                   PRIMARY KEY (song_id, playlist_id)
-                )
-            ''')
-            
+            version = migrate_db(conn)
+            logger.info(f"数据库结构版本: v{version}")
+
+            global SEARCH_INDEX_ENABLED
+            SEARCH_INDEX_ENABLED = conn.execute("SELECT 1 FROM sqlite_master WHERE name='songs_fts'").fetchone() is not None
+
             # 检查是否已有默认收藏夹，如果没有则创建
             default_count = conn.execute("SELECT COUNT(*) FROM favorite_playlists WHERE is_default = 1").fetchone()[0]
             if default_count == 0:
                 conn.execute("INSERT INTO favorite_playlists (id, name, is_default, created_at) VALUES (?, ?, ?, ?)", 
                            ('default', '默认收藏夹', 1, time.time()))
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS mount_points (
-                    path TEXT PRIMARY KEY,
-                    created_at REAL
-                )
-            ''')
-            
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS system_settings (
-                    key TEXT PRIMARY KEY,
-                    value TEXT
-                )
-            ''')
             
             # 清理错误索引的非音频文件
             try:
-                placeholders = ' OR '.join([f"filename NOT LIKE '%{ext}'" for ext in AUDIO_EXTS])
-                conn.execute(f"DELETE FROM songs WHERE {placeholders}")
+                placeholders = ' AND '.join([f"filename NOT LIKE '%{ext}'" for ext in AUDIO_EXTS])
+                delete_songs_where(conn, placeholders)
             except: pass
             
             conn.commit()
@@ -599,145 +1290,348 @@ def init_db():
     except Exception as e:
         logger.error(f"数据库初始化失败: {e}，尝试重建数据库...")
         try:
-            if os.path.exists(DB_PATH):
-                os.remove(DB_PATH)
+            DB_POOL.close_all()
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(DB_PATH + suffix):
+                    os.remove(DB_PATH + suffix)
             _init_db_core()
             logger.info("数据库重建完成。")
         except Exception as e2:
              logger.exception(f"数据库重建失败: {e2}")
 
+# --- 歌曲表写入与全文索引 ---
+# songs_fts 以 songs.rowid 作为 rowid，写入 songs 时使用 UPSERT 保持 rowid 不变
+SEARCH_INDEX_COLUMNS = ('title', 'artist', 'album', 'filename',
+                        'title_fold', 'artist_fold', 'album_fold', 'filename_fold')
+SEARCH_INDEX_WEIGHTS = (10.0, 5.0, 3.0, 1.0, 10.0, 5.0, 3.0, 1.0)
+SEARCH_INDEX_ENABLED = False
+
+SONG_UPSERT_SQL = '''
+    INSERT INTO songs (id, path, filename, title, artist, album, mtime, size, has_cover,
+                       duration, bitrate, sample_rate, codec, lyrics, fingerprint, cover_hash)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(path) DO UPDATE SET
+        id=excluded.id, filename=excluded.filename, title=excluded.title, artist=excluded.artist,
+        album=excluded.album, mtime=excluded.mtime, size=excluded.size, has_cover=excluded.has_cover,
+        duration=excluded.duration, bitrate=excluded.bitrate, sample_rate=excluded.sample_rate,
+        codec=excluded.codec, lyrics=excluded.lyrics, fingerprint=excluded.fingerprint,
+        cover_hash=excluded.cover_hash, offline=0
+'''
+
+def fold_text(text):
+    """搜索归一化：繁体转简体并转小写。"""
+    if not text:
+        return ''
+    return t2s(str(text)).lower()
+
+def _search_index_row(row):
+    values = [row['title'] or '', row['artist'] or '', row['album'] or '', row['filename'] or '']
+    return (row['rowid'], *values, *[fold_text(v) for v in values])
+
+def _write_search_index(conn, rows):
+    conn.executemany("DELETE FROM songs_fts WHERE rowid=?", [(r['rowid'],) for r in rows])
+    conn.executemany(f"INSERT INTO songs_fts (rowid, {', '.join(SEARCH_INDEX_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     [_search_index_row(r) for r in rows])
+
+def update_search_index(conn, paths):
+    """按路径刷新全文索引中的对应行。"""
+    if not SEARCH_INDEX_ENABLED or not paths:
+        return
+    paths = list(paths)
+    for i in range(0, len(paths), 500):
+        chunk = paths[i:i + 500]
+        marks = ','.join('?' * len(chunk))
+        rows = conn.execute(f"SELECT rowid, title, artist, album, filename FROM songs WHERE path IN ({marks})", chunk).fetchall()
+        _write_search_index(conn, rows)
+
+def rebuild_search_index(conn):
+    """全量重建全文索引。"""
+    conn.execute("DELETE FROM songs_fts")
+    cursor = conn.execute("SELECT rowid, title, artist, album, filename FROM songs")
+    while True:
+        rows = cursor.fetchmany(1000)
+        if not rows:
+            break
+        conn.executemany(f"INSERT INTO songs_fts (rowid, {', '.join(SEARCH_INDEX_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         [_search_index_row(r) for r in rows])
+
+# --- 曲库变更日志 ---
+LIBRARY_CHANGES_KEEP = 200000   # 变更日志保留条数，更早的记录被裁剪
+
+def _existing_song_ids(conn, paths):
+    found = {}
+    paths = list(paths)
+    for i in range(0, len(paths), 500):
+        chunk = paths[i:i + 500]
+        marks = ','.join('?' * len(chunk))
+        for row in conn.execute(f"SELECT path, id FROM songs WHERE path IN ({marks})", chunk):
+            found[row['path']] = row['id']
+    return found
+
+def log_library_changes(conn, changes):
+    """记录变更 [(song_id, action)]，action 为 insert / update / delete。"""
+    if not changes:
+        return
+    now = time.time()
+    conn.executemany("INSERT INTO library_changes (song_id, action, changed_at) VALUES (?, ?, ?)",
+                     [(sid, action, now) for sid, action in changes])
+
+def prune_library_changes(conn):
+    """裁剪过旧的变更日志，并记录裁剪水位供 /api/music/changes 判断是否需要全量同步。"""
+    row = conn.execute("SELECT MAX(seq) FROM library_changes").fetchone()
+    floor = (row[0] or 0) - LIBRARY_CHANGES_KEEP
+    if floor <= 0:
+        return
+    if conn.execute("DELETE FROM library_changes WHERE seq <= ?", (floor,)).rowcount:
+        conn.execute("INSERT OR REPLACE INTO system_settings (key, value) VALUES ('library_changes_floor', ?)", (str(floor),))
+
+def _assign_song_ids(conn, rows):
+    """确定每行的歌曲 ID，返回 (新行列表, 被移动文件的旧路径列表)。
+
+    已入库的路径沿用原 ID；新路径若与某条文件已不存在的记录指纹相同，视为移动并继承其 ID
+    （收藏不受影响）；否则优先使用内容指纹作为 ID，被同内容的其他文件占用时退回路径 ID。
+    """
+    existing = _existing_song_ids(conn, [r[1] for r in rows])
+    batch_paths = {r[1] for r in rows}
+    claimed, moved_from, result = set(), [], []
+    for r in rows:
+        path, fp = r[1], r[14]
+        sid = existing.get(path)
+        if sid is None and fp:
+            # 离线挂载上的记录文件暂时不可见，不能当作已移动
+            for old in conn.execute("SELECT id, path FROM songs WHERE fingerprint=? AND path!=? AND offline=0", (fp, path)):
+                if old['id'] not in claimed and old['path'] not in batch_paths and not os.path.exists(old['path']):
+                    sid = old['id']
+                    moved_from.append(old['path'])
+                    break
+            if sid is None and fp not in claimed and not conn.execute("SELECT 1 FROM songs WHERE id=?", (fp,)).fetchone():
+                sid = fp
+        sid = sid or r[0]
+        claimed.add(sid)
+        result.append((sid, *r[1:]))
+    return result, moved_from
+
+def save_song_rows(conn, rows):
+    """写入歌曲行，同步全文索引、变更日志与重复分组。
+
+    行格式: (id, path, filename, title, artist, album, mtime, size, has_cover,
+             duration, bitrate, sample_rate, codec, lyrics, fingerprint, cover_hash)
+    其中 id 仅作为无法按内容确定 ID 时的后备值。
+    """
+    if not rows:
+        return
+    # title/artist/album 不存 NULL，保证排序与键集分页一致
+    rows = [(*r[:3], r[3] or '', r[4] or '', r[5] or '', *r[6:]) for r in rows]
+    rows, moved_from = _assign_song_ids(conn, rows)
+    old_fps = _path_fingerprints(conn, [r[1] for r in rows] + moved_from)
+    if moved_from:
+        delete_song_paths(conn, moved_from, refresh_groups=False)
+    existing = _existing_song_ids(conn, [r[1] for r in rows])
+    changes = [(r[0], 'update' if r[1] in existing else 'insert') for r in rows]
+    conn.executemany(SONG_UPSERT_SQL, rows)
+    save_tag_cache(conn, rows)
+    register_covers(conn, {r[15] for r in rows if r[15]})
+    update_search_index(conn, [r[1] for r in rows])
+    log_library_changes(conn, changes)
+    refresh_duplicate_groups(conn, old_fps | {r[14] for r in rows})
+
+# --- 标签解析缓存 ---
+TAG_CACHE_MAX = 500000   # 缓存条数上限，超出后按最近写入时间淘汰
+
+def save_tag_cache(conn, rows):
+    """把 save_song_rows 格式的歌曲行写入标签缓存。"""
+    now = time.time()
+    conn.executemany('''
+        INSERT OR REPLACE INTO tag_cache (fingerprint, size, mtime, title, artist, album, has_cover,
+                                          duration, bitrate, sample_rate, codec, lyrics, cover_hash, cached_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(r[14], r[7], r[6], r[3], r[4], r[5], r[8], *r[9:14], r[15], now) for r in rows if r[14] and r[12]])
+
+def lookup_tag_cache(infos):
+    """按大小与修改时间查标签缓存，返回 {path: extract_song_batch 格式的元组}。
+
+    候选条目总要与文件的内容指纹一致才算命中，避免大小与修改时间碰巧相同的不同文件误用标签。
+    缓存中有封面而本机封面缓存已不存在的文件视为未命中，交给提取流程重新保存封面。
+    """
+    hits = {}
+    if not infos:
+        return hits
+    with get_db() as conn:
+        for path, _, mtime, size in infos:
+            rows = conn.execute("SELECT * FROM tag_cache WHERE size=? AND mtime=?", (size, mtime)).fetchall()
+            if not rows:
+                continue
+            try:
+                fp = compute_fingerprint(path)
+            except OSError:
+                continue
+            rows = [r for r in rows if r['fingerprint'] == fp]
+            if not rows:
+                continue
+            r = rows[0]
+            has_cover, cover_hash = song_cover_state(path, r['cover_hash'])
+            if r['has_cover'] and not has_cover:
+                continue
+            hits[path] = (r['title'], r['artist'], r['album'], has_cover, r['duration'], r['bitrate'],
+                          r['sample_rate'], r['codec'], r['lyrics'] or '', r['fingerprint'], cover_hash)
+    return hits
+
+def prune_tag_cache(conn):
+    """缓存超出上限时淘汰最早写入的条目。"""
+    count = conn.execute("SELECT COUNT(*) FROM tag_cache").fetchone()[0]
+    if count > TAG_CACHE_MAX:
+        conn.execute("DELETE FROM tag_cache WHERE cached_at <= (SELECT cached_at FROM tag_cache ORDER BY cached_at LIMIT 1 OFFSET ?)",
+                     (count - TAG_CACHE_MAX - 1,))
+
+def _path_fingerprints(conn, paths):
+    found = set()
+    paths = list(paths)
+    for i in range(0, len(paths), 500):
+        chunk = paths[i:i + 500]
+        marks = ','.join('?' * len(chunk))
+        found |= _song_fingerprints(conn, f"path IN ({marks})", chunk)
+    return found
+
+def _song_fingerprints(conn, where_sql, params=()):
+    return {r[0] for r in conn.execute(f"SELECT DISTINCT fingerprint FROM songs WHERE ({where_sql}) AND fingerprint IS NOT NULL", params)}
+
+def refresh_duplicate_groups(conn, fingerprints):
+    """重新计算指定指纹的重复分组：同指纹多于一条时记 duplicate_group，在线记录中 rowid 最小者为 is_canonical。"""
+    fps = [fp for fp in fingerprints if fp]
+    now = time.time()
+    for i in range(0, len(fps), 500):
+        chunk = fps[i:i + 500]
+        marks = ','.join('?' * len(chunk))
+        canonical = "(rowid = (SELECT d.rowid FROM songs d WHERE d.fingerprint = songs.fingerprint ORDER BY d.offline, d.rowid LIMIT 1))"
+        # 列表可见性变化记入变更日志
+        conn.execute(f"INSERT INTO library_changes (song_id, action, changed_at) SELECT id, 'update', ? FROM songs WHERE fingerprint IN ({marks}) AND is_canonical != {canonical}",
+                     (now, *chunk))
+        conn.execute(f"""
+            UPDATE songs SET
+                is_canonical = {canonical},
+                duplicate_group = CASE WHEN (SELECT COUNT(*) FROM songs d WHERE d.fingerprint = songs.fingerprint) > 1 THEN fingerprint END
+            WHERE fingerprint IN ({marks})
+        """, chunk)
+
+def delete_song_paths(conn, paths, refresh_groups=True):
+    """按路径删除歌曲行，同步全文索引、变更日志与重复分组。"""
+    paths = list(paths)
+    if not paths:
+        return
+    existing = _existing_song_ids(conn, paths)
+    params = [(p,) for p in existing]
+    fps = _path_fingerprints(conn, existing) if refresh_groups else set()
+    if SEARCH_INDEX_ENABLED:
+        conn.executemany("DELETE FROM songs_fts WHERE rowid=(SELECT rowid FROM songs WHERE path=?)", params)
+    conn.executemany("DELETE FROM songs WHERE path=?", params)
+    log_library_changes(conn, [(sid, 'delete') for sid in existing.values()])
+    refresh_duplicate_groups(conn, fps)
+
+def set_song_cover_flag(conn, where_sql, params, has_cover, cover_hash=None):
+    """更新 has_cover 与 cover_hash；封面地址与占位色块属于列表字段，实际变化的行记入变更日志。"""
+    if cover_hash:
+        register_covers(conn, [cover_hash])
+    conn.execute(f"INSERT INTO library_changes (song_id, action, changed_at) SELECT id, 'update', ? FROM songs WHERE ({where_sql}) AND (has_cover != ? OR cover_hash IS NOT ?)",
+                 (time.time(), *params, has_cover, cover_hash))
+    conn.execute(f"UPDATE songs SET has_cover=?, cover_hash=? WHERE {where_sql}", (has_cover, cover_hash, *params))
+
+def delete_songs_where(conn, where_sql, params=()):
+    """按条件删除歌曲行，同步全文索引与变更日志。"""
+    now = time.time()
+    fps = _song_fingerprints(conn, where_sql, params)
+    conn.execute(f"INSERT INTO library_changes (song_id, action, changed_at) SELECT id, 'delete', ? FROM songs WHERE {where_sql}",
+                 (now, *params))
+    if SEARCH_INDEX_ENABLED:
+        conn.execute(f"DELETE FROM songs_fts WHERE rowid IN (SELECT rowid FROM songs WHERE {where_sql})", params)
+    conn.execute(f"DELETE FROM songs WHERE {where_sql}", params)
+    refresh_duplicate_groups(conn, fps)
+
+def move_song_file(conn, src, dest):
+    """文件改名/移动：原地更新路径，保留 ID、收藏与已解析的元数据。旧路径未入库时返回 False。"""
+    row = conn.execute("SELECT id FROM songs WHERE path=?", (src,)).fetchone()
+    if not row:
+        return False
+    if src != dest and conn.execute("SELECT 1 FROM songs WHERE path=?", (dest,)).fetchone():
+        delete_song_paths(conn, [dest])
+    conn.execute("UPDATE songs SET path=?, filename=? WHERE path=?", (dest, os.path.basename(dest), src))
+    update_search_index(conn, [dest])
+    log_library_changes(conn, [(row['id'], 'update')])
+    return True
+
+def move_song_dir(conn, src, dest):
+    """目录移动：按路径前缀批量改写其下所有歌曲的路径，返回更新行数。
+
+    文件名不变，列表字段与全文索引都不受影响，因此不记变更日志。
+    目标位置已有同路径的记录（如目录被覆盖移动）时先删除，由移入的歌曲取代。
+    """
+    src_prefix = src.rstrip(os.sep) + os.sep
+    dest_prefix = dest.rstrip(os.sep) + os.sep
+    lo, hi = path_prefix_range(src)
+    conflicts = [r[0] for r in conn.execute("SELECT ? || substr(path, ?) AS target FROM songs WHERE path >= ? AND path < ? AND target IN (SELECT path FROM songs)",
+                                            (dest_prefix, len(src_prefix) + 1, lo, hi))]
+    delete_song_paths(conn, conflicts)
+    cur = conn.execute("UPDATE songs SET path = ? || substr(path, ?) WHERE path >= ? AND path < ?",
+                       (dest_prefix, len(src_prefix) + 1, lo, hi))
+    return cur.rowcount
+
+def move_song_sidecars(conn, src, dest):
+    """文件改名/移动时带上同名的歌词与封面，以及按文件名缓存的歌词。"""
+    src_base, dest_base = os.path.splitext(src)[0], os.path.splitext(dest)[0]
+    if src_base == dest_base:
+        return
+    moves = [(src_base + ext, dest_base + ext, True) for ext in ('.lrc', '.jpg')]
+    old_name, new_name = os.path.basename(src_base), os.path.basename(dest_base)
+    if old_name != new_name:
+        # 缓存按文件名共用，旧文件名仍被其他歌曲使用时只复制
+        marks = ','.join('?' * len(AUDIO_EXTS))
+        still_used = conn.execute(f"SELECT 1 FROM songs WHERE filename IN ({marks})", [old_name + e for e in AUDIO_EXTS]).fetchone()
+        # 封面按内容哈希存放，与文件名无关，只需带上歌词缓存
+        cache_dir = os.path.join(MUSIC_LIBRARY_PATH, 'lyrics')
+        moves.append((os.path.join(cache_dir, old_name + '.lrc'), os.path.join(cache_dir, new_name + '.lrc'), not still_used))
+    for old, new, move in moves:
+        if not os.path.exists(old) or os.path.exists(new):
+            continue
+        try:
+            if move:
+                shutil.move(old, new)
+            else:
+                shutil.copy2(old, new)
+        except OSError as e:
+            logger.warning(f"移动附属文件失败: {old} -> {new}, 错误: {e}")
+
 # --- 元数据提取 ---
+# 标签解析与内容指纹在 scan_worker 中，进程模式下由独立的提取进程执行
+
 def get_metadata(file_path):
-    metadata = {'title': None, 'artist': None, 'album': None}
-    try:
-        audio = None
-        try:
-            audio = EasyID3(file_path)
-        except Exception as e1:
-            try:
-                audio = File(file_path, easy=True)
-            except Exception as e2:
-                audio = File(file_path)
-                logger.warning(f"文件 {file_path} 元数据解析异常: {e2}")
-        if audio:
-            def get_tag(key):
-                val = None
-                # Method 1: Direct .get (EasyID3 etc)
-                if hasattr(audio, 'get'):
-                    val = audio.get(key)
-                # Method 2: via .tags (FLAC etc)
-                elif hasattr(audio, 'tags') and audio.tags:
-                    val = audio.tags.get(key)
-                    # Try uppercase for Vorbis comments if standard key fails
-                    if not val:
-                        val = audio.tags.get(key.upper())
-                
-                if val:
-                    if isinstance(val, list):
-                        val = val[0]
-                    # 确保返回值是字符串类型，处理ASFUnicodeAttribute等特殊类型
-                    if val is not None and not isinstance(val, str):
-                        val = str(val)
-                    return val
-                return None
-            metadata['title'] = get_tag('title')
-            metadata['artist'] = get_tag('artist')
-            metadata['album'] = get_tag('album')
-    except Exception as e:
-        logger.error(f"提取元数据失败: {file_path}, 错误: {e}")
-    filename = os.path.splitext(os.path.basename(file_path))[0]
-    if not metadata['title']:
-        if ' - ' in filename:
-            parts = filename.split(' - ', 1)
-            if not metadata['artist']: metadata['artist'] = parts[0].strip()
-            metadata['title'] = parts[1].strip()
-        else:
-            metadata['title'] = filename
-    if not metadata['artist']: metadata['artist'] = "未知艺术家"
+    tags = read_audio_tags(file_path)
+    metadata = {'title': tags['title'], 'artist': tags['artist'], 'album': tags['album']}
     logger.debug(f"文件 {file_path} 元数据: {metadata}")
     return metadata
 
-def extract_embedded_cover(file_path: str, base_name: str = None):
-    """提取音频内嵌封面并保存为 covers/<base_name>.jpg，成功返回 True。"""
-    try:
-        if not os.path.exists(file_path):
-            return False
-        base_name = base_name or os.path.splitext(os.path.basename(file_path))[0]
-        cover_dir = os.path.join(MUSIC_LIBRARY_PATH, 'covers')
-        os.makedirs(cover_dir, exist_ok=True)
-        target_path = os.path.join(cover_dir, f"{base_name}.jpg")
-        if os.path.exists(target_path):
-            return True
-
-        audio = File(file_path)
-        if not audio:
-            return False
-
-        data = None
-
-        # MP3 / ID3
-        if hasattr(audio, 'tags') and audio.tags:
-            if hasattr(audio.tags, 'getall'):
-                for tag in audio.tags.getall('APIC'):
-                    if getattr(tag, 'data', None):
-                        data = tag.data
-                        break
-            if not data:
-                covr = audio.tags.get('covr')
-                if covr:
-                    val = covr[0] if isinstance(covr, (list, tuple)) else covr
-                    try:
-                        data = bytes(val)
-                    except Exception:
-                        pass
+def extract_embedded_cover(file_path: str, data: bytes = None):
+    """登记音频内嵌封面，返回内容哈希，没有内嵌封面时返回 None；原图在首次请求时才提取。
 
-        # FLAC / 其他
-        if not data and hasattr(audio, 'pictures'):
-            pics = getattr(audio, 'pictures') or []
-            if pics:
-                data = pics[0].data
+    data 为已读取的封面字节时直接使用，不再重新解析文件。
+    """
+    try:
+        if data is None:
+            if not os.path.exists(file_path):
+                return None
+            data = read_audio_tags(file_path)['cover']
 
         if not data:
             logger.info(f"未找到内嵌封面: {file_path}")
-            return False
-
-        with open(target_path, 'wb') as f:
-            f.write(data)
-        logger.info(f"内嵌封面提取并保存: {target_path}")
-        return True
+            return None
+        return prepare_cover(file_path, data, kind='embedded')
     except Exception as e:
         logger.warning(f"提取内嵌封面失败: {file_path}, 错误: {repr(e)}")
-        return False
+        return None
 
 def extract_embedded_lyrics(file_path: str):
     """提取音频内嵌歌词，返回歌词字符串或 None。"""
-    try:
-        if not os.path.exists(file_path):
-            return None
-        
-        audio = File(file_path)
-        if not audio:
-            return None
-
-        # 1. MP3 / ID3 (USLT)
-        if hasattr(audio, 'tags') and isinstance(audio.tags, ID3):
-            for key in audio.tags.keys():
-                if key.startswith('USLT'):
-                    return audio.tags[key].text
-        
-        # 2. FLAC / Vorbis Comments
-        if hasattr(audio, 'tags'):
-            lyrics = audio.tags.get('lyrics') or audio.tags.get('LYRICS') or audio.tags.get('unsyncedlyrics') or audio.tags.get('UNSYNCEDLYRICS')
-            if lyrics:
-                return lyrics[0]
-                
-        # 3. M4A / MP4
-        if hasattr(audio, 'tags') and '©lyr' in audio.tags:
-             return audio.tags['©lyr'][0]
-
-    except Exception as e:
-        logger.warning(f"提取内嵌歌词失败: {file_path}, 错误: {repr(e)}")
-    return None
+    if not os.path.exists(file_path):
+        return None
+    return read_audio_tags(file_path)['lyrics']
 
 def fetch_cover_bytes(url: str):
     if not url:
@@ -788,19 +1682,507 @@ def embed_cover_to_file(audio_path: str, cover_bytes: bytes):
     except Exception as e:
         logger.warning(f"内嵌封面失败: {audio_path}, 错误: {e}")
 
-def save_cover_file(cover_bytes: bytes, base_name: str):
-    if not cover_bytes or not base_name:
+# --- 封面缩略图 ---
+# 按原图内容哈希缓存各尺寸缩略图（covers/thumbs/<hash>_<size>.webp|jpg），索引与刮削时预先生成，
+# 请求时按 ?size= 选择不小于目标的最小尺寸；Accept 支持 WebP 时返回 WebP，否则返回 JPEG
+COVER_SIZES = (64, 256, 1024)
+COVER_THUMB_DIR = os.path.join(MUSIC_LIBRARY_PATH, 'covers', 'thumbs')
+COVER_WEBP = bool(Image and pil_features and pil_features.check('webp'))
+COVER_LQIP_GRID = 3     # 占位色块为 3x3 颜色网格，前端用渐变绘制，无需解码图片
+COVER_PALETTE_SIZE = 4  # 配色：主色加最多三种强调色，前端据此设置播放页主题色，无需在浏览器里解码封面
+COVER_PALETTE_COLORS = 12
+COVER_PALETTE_MIN_DISTANCE = 48
+_COVER_HASH_MEMO = {}   # (path, mtime, size) -> 内容哈希
+_COVER_HASH_MEMO_MAX = 4096
+
+def sidecar_cover_path(path):
+    """音频文件同目录下的同名 .jpg 封面，没有时返回 None。"""
+    candidate = os.path.splitext(path)[0] + ".jpg"
+    return candidate if os.path.exists(candidate) else None
+
+def legacy_cover_path(path):
+    """旧版按文件名存放的 covers/<base_name>.jpg，没有时返回 None；不同目录的同名文件共用，仅作兜底。"""
+    candidate = os.path.join(MUSIC_LIBRARY_PATH, 'covers', f"{os.path.splitext(os.path.basename(path))[0]}.jpg")
+    return candidate if os.path.exists(candidate) else None
+
+def cover_file_hash(path, data=None):
+    """封面文件的内容哈希，按 (路径, 修改时间, 大小) 缓存。"""
+    st = os.stat(path)
+    key = (path, st.st_mtime, st.st_size)
+    cover_hash = _COVER_HASH_MEMO.get(key)
+    if cover_hash is None:
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        cover_hash = hashlib.sha1(data).hexdigest()
+        if len(_COVER_HASH_MEMO) >= _COVER_HASH_MEMO_MAX:
+            _COVER_HASH_MEMO.clear()
+        _COVER_HASH_MEMO[key] = cover_hash
+    return cover_hash
+
+def _cover_variant_path(cover_hash, size, webp):
+    return os.path.join(COVER_THUMB_DIR, f"{cover_hash}_{size}.{'webp' if webp else 'jpg'}")
+
+def _save_cover_variant(img, target, webp):
+    # 先写临时文件再替换，避免并发请求读到写了一半的文件
+    tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+    try:
+        if webp:
+            img.save(tmp, 'WEBP', quality=80, method=4)
+        else:
+            img.save(tmp, 'JPEG', quality=82, optimize=True, progressive=True)
+        os.replace(tmp, target)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def _load_cover_image(path, data=None):
+    """返回 (RGB 图像, 原图尺寸)；data 为封面字节时直接从内存解码。"""
+    with Image.open(io.BytesIO(data) if data is not None else path) as img:
+        size = img.size
+        img.draft('RGB', (COVER_SIZES[-1], COVER_SIZES[-1]))  # JPEG 按缩小比例解码，省去全尺寸解码
+        return img.convert('RGB'), size
+
+def _cover_palette(img):
+    """按像素数从多到少取色，与已选颜色过近的跳过；返回逗号分隔的十六进制颜色，第一个为主色。"""
+    small = img.copy()
+    small.thumbnail((COVER_SIZES[0], COVER_SIZES[0]))
+    quantized = small.quantize(colors=COVER_PALETTE_COLORS)
+    rgb = quantized.getpalette()
+    picked = []
+    for _, index in sorted(quantized.getcolors(), reverse=True):
+        color = tuple(rgb[index * 3:index * 3 + 3])
+        if all(sum((a - b) ** 2 for a, b in zip(color, other)) >= COVER_PALETTE_MIN_DISTANCE ** 2 for other in picked):
+            picked.append(color)
+            if len(picked) == COVER_PALETTE_SIZE:
+                break
+    return ','.join('%02x%02x%02x' % color for color in picked)
+
+def _cover_details(img, size):
+    """由已解码的封面算出原图尺寸、占位色块与配色。"""
+    grid = img.resize((COVER_LQIP_GRID, COVER_LQIP_GRID), Image.BOX)
+    return {'width': size[0], 'height': size[1],
+            'lqip': ''.join('%02x%02x%02x' % px for px in grid.getdata()),
+            'palette': _cover_palette(img)}
+
+def _cover_meta_path(cover_hash):
+    return os.path.join(COVER_THUMB_DIR, f"{cover_hash}.json")
+
+def _cover_embedded_marker(cover_hash):
+    return os.path.join(COVER_THUMB_DIR, f"{cover_hash}.embedded")
+
+def prepare_cover(path, data=None, kind='sidecar'):
+    """登记封面文件：返回内容哈希，首次遇到时记下来源，并生成各尺寸缩略图与占位色块（需 Pillow）。
+
+    kind 为 'embedded' 时 path 是音频文件、data 为内嵌封面字节，只在内存中处理，不写出原图。
+    生成结果写入 covers/thumbs，不访问数据库，可在提取进程中执行；写入 songs 时由 register_covers 登记。
+    """
+    try:
+        cover_hash = hashlib.sha1(data).hexdigest() if kind == 'embedded' else cover_file_hash(path, data)
+    except OSError:
         return None
+    if kind == 'embedded' and not os.path.exists(_cover_embedded_marker(cover_hash)):
+        # 标记该图出现在某个音频的内嵌封面中，之后可随时从音频重新提取
+        with contextlib.suppress(OSError):
+            os.makedirs(COVER_THUMB_DIR, exist_ok=True)
+            open(_cover_embedded_marker(cover_hash), 'wb').close()
+    meta_path = _cover_meta_path(cover_hash)
+    if os.path.exists(meta_path):
+        return cover_hash
+    meta = {'width': None, 'height': None, 'lqip': None, 'palette': None, 'source': path, 'kind': kind}
     try:
-        cover_dir = os.path.join(MUSIC_LIBRARY_PATH, 'covers')
-        os.makedirs(cover_dir, exist_ok=True)
-        cover_path = os.path.join(cover_dir, f"{base_name}.jpg")
-        with open(cover_path, 'wb') as f:
-            f.write(cover_bytes)
-        return cover_path
+        os.makedirs(COVER_THUMB_DIR, exist_ok=True)
+        if Image is not None:
+            img, (width, height) = _load_cover_image(path, data)
+            for size in COVER_SIZES:
+                if size >= max(width, height):
+                    break
+                thumb = img.copy()
+                thumb.thumbnail((size, size), Image.LANCZOS)
+                _save_cover_variant(thumb, _cover_variant_path(cover_hash, size, COVER_WEBP), COVER_WEBP)
+            meta.update(_cover_details(img, (width, height)))
     except Exception as e:
-        logger.warning(f"封面保存失败: {base_name}, 错误: {e}")
+        logger.warning(f"生成封面缩略图失败: {path}, 错误: {e}")
+    try:
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+    except OSError as e:
+        logger.warning(f"写入封面信息失败: {path}, 错误: {e}")
+    return cover_hash
+
+def register_covers(conn, hashes):
+    """把 prepare_cover 记下的封面信息登记到 covers 表；旧记录缺少来源时补上。"""
+    hashes = list(hashes)
+    for i in range(0, len(hashes), 500):
+        chunk = hashes[i:i + 500]
+        marks = ','.join('?' * len(chunk))
+        known = {r[0] for r in conn.execute(f"SELECT hash FROM covers WHERE hash IN ({marks}) AND source IS NOT NULL", chunk)}
+        rows = []
+        for cover_hash in chunk:
+            if cover_hash in known:
+                continue
+            try:
+                with open(_cover_meta_path(cover_hash), encoding='utf-8') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            rows.append((cover_hash, meta.get('width'), meta.get('height'), meta.get('lqip'), meta.get('palette'),
+                         meta.get('source'), meta.get('kind'), time.time()))
+        conn.executemany('''
+            INSERT INTO covers (hash, width, height, lqip, palette, source, kind, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(hash) DO UPDATE SET source=excluded.source, kind=excluded.kind,
+                palette=COALESCE(covers.palette, excluded.palette) WHERE covers.source IS NULL
+        ''', rows)
+
+def _known_cover(cover_hash):
+    """哈希对应的封面仍可用：封面存储中有副本，或是音频内嵌封面（按需提取）。"""
+    return os.path.exists(cover_store_path(cover_hash)) or os.path.exists(_cover_embedded_marker(cover_hash))
+
+def song_cover_state(path, cover_hash=None, legacy=False):
+    """音频文件当前的 (has_cover, cover_hash)。
+
+    同名 .jpg 优先；其次沿用仍可用的已知哈希（内嵌或刮削的封面）。
+    旧版 covers/<base_name>.jpg 按文件名共用，只在 legacy 为 True 时（为升级前已有封面的歌曲补登记）收录。
+    """
+    sidecar = sidecar_cover_path(path)
+    if sidecar:
+        return 1, prepare_cover(sidecar)
+    if cover_hash and _known_cover(cover_hash):
+        return 1, cover_hash
+    legacy = legacy and legacy_cover_path(path)
+    if legacy:
+        try:
+            with open(legacy, 'rb') as f:
+                return 1, store_cover(f.read())
+        except OSError:
+            pass
+    return 0, None
+
+def cover_variant(path, size, webp, cover_hash=None):
+    """返回封面 path 不小于 size 的缩略图路径，按需生成；原图不大于目标尺寸或无 Pillow 时返回 None。"""
+    if Image is None:
+        return None
+    target = next((s for s in COVER_SIZES if s >= size), COVER_SIZES[-1])
+    webp = webp and COVER_WEBP
+    cover_hash = cover_hash or prepare_cover(path)
+    if not cover_hash:
+        return None
+    variant = _cover_variant_path(cover_hash, target, webp)
+    if os.path.exists(variant):
+        return variant
+    img, (width, height) = _load_cover_image(path)
+    if target >= max(width, height):
+        return None
+    img.thumbnail((target, target), Image.LANCZOS)
+    os.makedirs(COVER_THUMB_DIR, exist_ok=True)
+    _save_cover_variant(img, variant, webp)
+    return variant
+
+# --- 封面存储 ---
+# 刮削与下载得到的封面按内容哈希存放在 covers/store/<前两位>/<哈希>，相同的图只存一份；同名 .jpg 原地引用不复制；
+# 内嵌封面扫描时只记下哈希与所在音频，首次请求时才提取到有容量上限的 covers/cache。
+# covers 表记录每个哈希的来源，歌曲通过 cover_hash 引用；按哈希的封面地址内容不变，同专辑的歌曲共用一份浏览器缓存
+COVER_STORE_DIR = os.path.join(MUSIC_LIBRARY_PATH, 'covers', 'store')
+COVER_CACHE_DIR = os.path.join(MUSIC_LIBRARY_PATH, 'covers', 'cache')
+COVER_CACHE_MAX_BYTES = max(0, args.cover_cache_size) * 1024 * 1024
+COVER_URL_PREFIX = '/api/music/covers/hash/'
+COVER_PRUNE_GRACE = 3600    # 新登记的封面一小时内不回收，避免误删扫描中尚未写入 songs 的封面
+COVER_CACHE_MAX_AGE = 365 * 24 * 3600
+
+def cover_store_path(cover_hash):
+    return os.path.join(COVER_STORE_DIR, cover_hash[:2], cover_hash)
+
+def hashed_cover_url(cover_hash):
+    return f"{COVER_URL_PREFIX}{cover_hash}"
+
+def store_cover(data):
+    """把封面字节写入内容寻址存储并返回哈希；内容相同的封面只写一次。
+
+    只用于无法从音频重新读出的封面（刮削、下载、旧版缓存）；内嵌封面按需提取，见 EmbeddedCoverCache。
+    """
+    if not data:
         return None
+    cover_hash = hashlib.sha1(data).hexdigest()
+    target = cover_store_path(cover_hash)
+    if not os.path.exists(target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, target)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    prepare_cover(target, data, kind='store')
+    return cover_hash
+
+class EmbeddedCoverCache:
+    """按需提取的内嵌封面缓存：总字节数超出上限时淘汰最久未访问的文件。
+
+    访问时间记在文件修改时间上，重启后按修改时间恢复淘汰顺序。
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = None    # 哈希 -> 字节数，按访问先后排列，首次使用时从磁盘载入
+        self._total = 0
+
+    def _path(self, cover_hash):
+        return os.path.join(self.directory, cover_hash[:2], cover_hash)
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        found = []
+        for dirpath, _, names in os.walk(self.directory):
+            for name in names:
+                file_path = os.path.join(dirpath, name)
+                if name.endswith('.tmp'):
+                    with contextlib.suppress(OSError):
+                        os.remove(file_path)
+                    continue
+                try:
+                    st = os.stat(file_path)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, name, st.st_size))
+        found.sort()
+        self._entries = OrderedDict((name, size) for _, name, size in found)
+        self._total = sum(self._entries.values())
+
+    def get(self, cover_hash):
+        with self._lock:
+            self._load()
+            if cover_hash not in self._entries:
+                return None
+            self._entries.move_to_end(cover_hash)
+        path = self._path(cover_hash)
+        try:
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self._total -= self._entries.pop(cover_hash, 0)
+            return None
+        return path
+
+    def put(self, cover_hash, data):
+        path = self._path(cover_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        evicted = []
+        with self._lock:
+            self._load()
+            self._total -= self._entries.pop(cover_hash, 0)
+            self._entries[cover_hash] = len(data)
+            self._total += len(data)
+            # 刚写入的一张总是保留，即使单张超过上限
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                old_hash, size = self._entries.popitem(last=False)
+                self._total -= size
+                evicted.append(old_hash)
+        for old_hash in evicted:
+            with contextlib.suppress(OSError):
+                os.remove(self._path(old_hash))
+        return path
+
+    def discard(self, cover_hash):
+        with self._lock:
+            if self._entries is not None:
+                self._total -= self._entries.pop(cover_hash, 0)
+        with contextlib.suppress(OSError):
+            os.remove(self._path(cover_hash))
+
+    def status(self):
+        with self._lock:
+            self._load()
+            return {'files': len(self._entries), 'bytes': self._total, 'max_bytes': self.max_bytes}
+
+EMBEDDED_COVERS = EmbeddedCoverCache(COVER_CACHE_DIR, COVER_CACHE_MAX_BYTES)
+
+def cover_mimetype(path):
+    """按文件头判断封面格式，内嵌封面不一定是 JPEG。"""
+    with open(path, 'rb') as f:
+        head = f.read(12)
+    if head.startswith(b'\x89PNG'):
+        return 'image/png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[:3] == b'GIF':
+        return 'image/gif'
+    return 'image/jpeg'
+
+def _open_cover_source(cover_hash, source, kind):
+    """来源中的封面内容仍与哈希一致时返回可发送的文件：同名 .jpg 直接返回，内嵌封面提取到缓存。"""
+    try:
+        if kind == 'embedded':
+            data = read_audio_tags(source)['cover']
+            if data and hashlib.sha1(data).hexdigest() == cover_hash:
+                return EMBEDDED_COVERS.put(cover_hash, data)
+            return None
+        return source if cover_file_hash(source) == cover_hash else None
+    except Exception:
+        return None
+
+def resolve_cover(cover_hash):
+    """按哈希找到可发送的封面文件，找不到返回 None。
+
+    依次查找存储中的副本、已提取的内嵌封面、登记的来源，以及仍引用该哈希的歌曲旁的同名 .jpg 或其内嵌封面。
+    """
+    stored = cover_store_path(cover_hash)
+    if os.path.exists(stored):
+        return stored
+    cached = EMBEDDED_COVERS.get(cover_hash)
+    if cached:
+        return cached
+    with get_db() as conn:
+        row = conn.execute("SELECT source, kind FROM covers WHERE hash=?", (cover_hash,)).fetchone()
+        registered = (row['source'], row['kind']) if row and row['source'] else None
+        candidates = [registered] if registered else []
+        for r in conn.execute("SELECT path FROM songs WHERE cover_hash=? AND offline=0 LIMIT 20", (cover_hash,)):
+            candidates += [(os.path.splitext(r['path'])[0] + ".jpg", 'sidecar'), (r['path'], 'embedded')]
+        for source, kind in candidates:
+            path = _open_cover_source(cover_hash, source, kind)
+            if not path:
+                continue
+            if (source, kind) != registered:
+                # 登记的来源已移走或改动，改记当前找到的文件
+                conn.execute("UPDATE covers SET source=?, kind=? WHERE hash=?", (source, kind, cover_hash))
+            return path
+    return None
+
+def attach_cover_if_missing(path, cover_hash):
+    """下载的歌曲格式不支持内嵌封面时，仍把下载到的封面关联给它。"""
+    if not cover_hash:
+        return
+    with get_db() as conn:
+        set_song_cover_flag(conn, "path=? AND has_cover=0", (path,), 1, cover_hash)
+
+def refresh_song_cover(conn, path):
+    """重新检查已入库歌曲的封面：同名 .jpg 增删时更新，内嵌或刮削得到的封面保持不变。"""
+    row = conn.execute("SELECT cover_hash FROM songs WHERE path=?", (path,)).fetchone()
+    set_song_cover_flag(conn, "path=?", (path,), *song_cover_state(path, row['cover_hash'] if row else None))
+
+def prune_covers(conn):
+    """回收不再被任何歌曲引用的封面：删除存储副本、缩略图与登记，同名 .jpg 原文件不动。"""
+    hashes = [r[0] for r in conn.execute(
+        "SELECT hash FROM covers c WHERE created_at < ? AND NOT EXISTS (SELECT 1 FROM songs s WHERE s.cover_hash = c.hash)",
+        (time.time() - COVER_PRUNE_GRACE,))]
+    for cover_hash in hashes:
+        EMBEDDED_COVERS.discard(cover_hash)
+        files = [cover_store_path(cover_hash), _cover_meta_path(cover_hash), _cover_embedded_marker(cover_hash)]
+        files += [_cover_variant_path(cover_hash, size, webp) for size in COVER_SIZES for webp in (False, True)]
+        for file_path in files:
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"删除封面文件失败: {file_path}, 错误: {e}")
+    conn.executemany("DELETE FROM covers WHERE hash=?", [(h,) for h in hashes])
+    if hashes:
+        logger.info(f"回收未引用的封面 {len(hashes)} 张")
+
+def backfill_cover_details():
+    """为安装 Pillow 之前或升级前登记的封面补算占位色块与配色。
+
+    内嵌封面直接从音频读出后在内存中解码，不写入提取缓存；无法解码的封面记为空串，之后不再重试。
+    来源文件暂时不存在（如挂载离线）的跳过，下次启动再试。
+    """
+    if Image is None:
+        return
+    last, filled = '', 0
+    while True:
+        with get_db() as conn:
+            covers = conn.execute("SELECT hash, source, kind FROM covers WHERE (palette IS NULL OR lqip IS NULL) AND hash > ? ORDER BY hash LIMIT 500",
+                                  (last,)).fetchall()
+        if not covers:
+            break
+        last = covers[-1]['hash']
+        rows, failed = [], []
+        for cover_hash, source, kind in covers:
+            stored = cover_store_path(cover_hash)
+            path, data = (stored, None) if os.path.exists(stored) else (source, None)
+            if not path or not os.path.exists(path):
+                continue
+            if path == source:
+                try:
+                    if kind == 'embedded':
+                        data = read_audio_tags(source)['cover']
+                    else:
+                        with open(source, 'rb') as f:
+                            data = f.read()
+                except OSError:
+                    continue
+                if not data or hashlib.sha1(data).hexdigest() != cover_hash:
+                    # 来源已改动，留给扫描重新登记
+                    continue
+            try:
+                img, size = _load_cover_image(path, data)
+                details = _cover_details(img, size)
+            except Exception as e:
+                logger.warning(f"计算封面配色失败: {path}, 错误: {e}")
+                failed.append((cover_hash,))
+                continue
+            meta_path = _cover_meta_path(cover_hash)
+            try:
+                with open(meta_path, encoding='utf-8') as f:
+                    meta = json.load(f)
+                meta.update(details)
+                with open(meta_path, 'w', encoding='utf-8') as f:
+                    json.dump(meta, f)
+            except (OSError, ValueError):
+                pass
+            rows.append((details['width'], details['height'], details['lqip'], details['palette'], cover_hash))
+        with get_db() as conn:
+            conn.executemany("UPDATE covers SET width=?, height=?, lqip=?, palette=? WHERE hash=?", rows)
+            conn.executemany("UPDATE covers SET lqip=COALESCE(lqip, ''), palette=COALESCE(palette, '') WHERE hash=?", failed)
+        filled += len(rows)
+    if filled:
+        logger.info(f"已为 {filled} 张封面补算配色")
+        bump_library_version()
+
+def backfill_cover_hashes():
+    """为升级前入库、有封面但没有 cover_hash 的歌曲补登记封面。
+
+    依次查找同名 .jpg、内嵌封面、旧版 covers/<base_name>.jpg；旧版目录按文件名共用，放在内嵌封面之后以免取到同名歌曲的封面。
+    """
+    last, filled = 0, 0
+    while True:
+        with get_db() as conn:
+            rows = conn.execute("SELECT rowid, path FROM songs WHERE has_cover=1 AND cover_hash IS NULL AND offline=0 AND rowid > ? ORDER BY rowid LIMIT 500",
+                                (last,)).fetchall()
+        if not rows:
+            break
+        last = rows[-1]['rowid']
+        states = []
+        for r in rows:
+            path = r['path']
+            sidecar = sidecar_cover_path(path)
+            if sidecar:
+                states.append((path, (1, prepare_cover(sidecar))))
+                continue
+            try:
+                data = read_audio_tags(path)['cover']
+            except Exception:
+                data = None
+            states.append((path, (1, prepare_cover(path, data, kind='embedded')) if data else song_cover_state(path, legacy=True)))
+        with get_db() as conn:
+            for path, state in states:
+                set_song_cover_flag(conn, "path=?", (path,), *state)
+        filled += len(states)
+    if filled:
+        logger.info(f"已为 {filled} 首歌曲补登记封面")
+        bump_library_version()
 
 def fetch_netease_lyrics(song_id: str):
     """返回 (lrc, yrc) 字符串；若无则为 None。"""
@@ -857,41 +2239,50 @@ def embed_lyrics_to_file(audio_path: str, lrc_text: str):
 
 AUDIO_EXTS = ('.mp3', '.wav', '.ogg', '.flac', '.aac', '.m4a')
 
+def index_files(paths, deleted=()):
+    """批量索引文件并删除 deleted 中的路径，全部在同一事务中写入；返回变化条数。
+
+    大小与修改时间未变（如移动、附件变化）的文件不重新解析标签，只刷新封面状态。
+    """
+    infos = []
+    for path in paths:
+        # 严格限制只能索引音频文件
+        if os.path.splitext(path)[1].lower() not in AUDIO_EXTS: continue
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        infos.append((path, os.path.basename(path), stat.st_mtime, stat.st_size))
+    infos.sort()
+
+    with get_db() as conn:
+        unchanged = unchanged_song_paths(conn, infos)
+    changed = [info for info in infos if info[0] not in unchanged]
+    rows = []
+    cached = lookup_tag_cache(changed)
+    rows.extend(build_song_row(info, cached[info[0]]) for info in changed if info[0] in cached)
+    changed = [info for info in changed if info[0] not in cached]
+    if changed:
+        batches = list(iter_dir_batches(changed))
+        # 并发数按所在存储选择，机械盘上按路径顺序少量并发读取
+        workers = storage_profile(os.path.dirname(changed[0][0]))['workers']
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, len(batches))) as executor:
+            for batch, results in zip(batches, executor.map(extract_song_batch, [[info[0] for info in b] for b in batches])):
+                rows.extend(row for row in map(build_song_row, batch, results) if row)
+
+    with get_db() as conn:
+        if deleted:
+            delete_song_paths(conn, deleted)
+        for path in unchanged:
+            refresh_song_cover(conn, path)
+        save_song_rows(conn, rows)
+    return len(rows) + len(unchanged) + len(deleted)
+
 def index_single_file(file_path):
     """单独索引一个文件。"""
     try:
-        if not os.path.exists(file_path): return
-        # 严格限制只能索引音频文件
-        ext = os.path.splitext(file_path)[1].lower()
-        if ext not in AUDIO_EXTS: return
-        
-        stat = os.stat(file_path)
-        meta = get_metadata(file_path)
-        sid = generate_song_id(file_path)
-        base_name = os.path.splitext(os.path.basename(file_path))[0]
-        base_path = os.path.splitext(file_path)[0]
-        cover_path = os.path.join(MUSIC_LIBRARY_PATH, 'covers', f"{base_name}.jpg")
-        has_cover = 0
-        if os.path.exists(base_path + ".jpg") or os.path.exists(cover_path):
-            has_cover = 1
-        else:
-            # 尝试提取内嵌封面
-            if extract_embedded_cover(file_path, base_name):
-                has_cover = 1
-        
-        with get_db() as conn:
-            # 全局去重检测
-            dup = conn.execute("SELECT path FROM songs WHERE filename=? AND size=? AND path!=?", (os.path.basename(file_path), stat.st_size, file_path)).fetchone()
-            if dup:
-                logger.info(f"索引: 跳过重复文件 {file_path} (已存在: {dup['path']})")
-                return
-
-            conn.execute('''
-                INSERT OR REPLACE INTO songs (id, path, filename, title, artist, album, mtime, size, has_cover)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (sid, file_path, os.path.basename(file_path), meta['title'], meta['artist'], meta['album'], stat.st_mtime, stat.st_size, has_cover))
-            conn.commit()
-        logger.info(f"单文件索引完成: {file_path}")
+        if index_files([file_path]):
+            logger.info(f"单文件索引完成: {file_path}")
     except Exception as e:
         logger.error(f"单文件索引失败: {e}")
 
@@ -905,9 +2296,10 @@ def scrape_single_song(item, idx, total):
     try:
         # 0. 先尝试提取内嵌封面 (Fix: 优先使用内嵌封面，避免无效刮削)
         if item['need_cover']:
-             if extract_embedded_cover(song['path']):
+             cover_hash = extract_embedded_cover(song['path'])
+             if cover_hash:
                 with get_db() as conn:
-                    conn.execute("UPDATE songs SET has_cover=1 WHERE id=?", (song['id'],))
+                    set_song_cover_flag(conn, "id=?", (song['id'],), 1, cover_hash)
                     conn.commit()
                 logger.info(f"刮削时发现内嵌封面，已提取: {song['title']}")
                 item['need_cover'] = False # 已解决封面，不再网络下载封面
@@ -1027,18 +2419,15 @@ def scrape_single_song(item, idx, total):
                      pass
             
             if found_cover:
-                base_name = os.path.splitext(song['filename'])[0]
-                local_cover_path = os.path.join(MUSIC_LIBRARY_PATH, 'covers', f"{base_name}.jpg")
                 try:
                     resp = requests.get(found_cover, timeout=10, headers=COMMON_HEADERS)
                     if resp.status_code == 200:
-                        with open(local_cover_path, 'wb') as f:
-                            f.write(resp.content)
+                        cover_hash = store_cover(resp.content)
                         # 更新数据库
                         with get_db() as conn:
-                            conn.execute("UPDATE songs SET has_cover=1 WHERE id=?", (song['id'],))
+                            set_song_cover_flag(conn, "id=?", (song['id'],), 1, cover_hash)
                             conn.commit()
-                        logger.info(f"自动保存封面成功: {local_cover_path}")
+                        logger.info(f"自动保存封面成功: {song['title']} -> {cover_hash}")
                     else:
                         logger.warning(f"下载封面失败: {resp.status_code} - {found_cover}")
                         is_partial_fail = True
@@ -1083,8 +2472,8 @@ def auto_scrape_missing_metadata(target_dir=None):
                 sql = "SELECT id, path, title, artist, album, filename, has_cover FROM songs"
                 params = ()
                 if target_dir:
-                    sql += " WHERE path LIKE ? || '%'"
-                    params = (target_dir,)
+                    sql += " WHERE path >= ? AND path < ?"
+                    params = path_prefix_range(target_dir)
                 cursor = conn.execute(sql, params)
                 all_songs = cursor.fetchall()
 
@@ -1162,11 +2551,8 @@ def retry_scrape_mount():
         if not path:
              return jsonify({'success': False, 'error': '未指定路径'})
         
-        if SCAN_STATUS.get('is_scraping') or SCAN_STATUS.get('scanning'):
-             return jsonify({'success': False, 'error': '后台任务进行中，请稍后'})
-             
-        threading.Thread(target=auto_scrape_missing_metadata, args=(path,), daemon=True).start()
-        return jsonify({'success': True, 'message': '已开始重新刮削'})
+        SCAN_SCHEDULER.submit_scrape(path)
+        return jsonify({'success': True, 'message': '已加入刮削队列'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
@@ -1177,294 +2563,1036 @@ def update_mount_point():
         if not path:
              return jsonify({'success': False, 'error': '未指定路径'})
         
-        if SCAN_STATUS.get('is_scraping') or SCAN_STATUS.get('scanning'):
-             return jsonify({'success': False, 'error': '后台任务进行中，请稍后'})
-             
-        threading.Thread(target=scan_directory_single, args=(path,), daemon=True).start()
-        return jsonify({'success': True, 'message': '开始更新目录...'})
+        # 手动更新目录时逐个检查文件，确保原地修改的文件也能被发现
+        SCAN_SCHEDULER.submit_scan(path, full=True)
+        return jsonify({'success': True, 'message': '已加入扫描队列，开始更新目录...'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
-def scan_directory_single(target_dir):
-    """扫描指定目录并更新数据库"""
-    global SCAN_STATUS
-    
-    if not os.path.exists(target_dir):
-        logger.error(f"目录不存在: {target_dir}")
+# --- 流式扫描管线 ---
+# 遍历 → 有界队列 → 元数据线程 → 分批写入；内存占用与曲库规模无关，每批提交一次
+SCAN_BATCH_SIZE = 500      # 遍历比对与写入提交的批大小
+SCAN_QUEUE_SIZE = 1000     # 各阶段之间队列的容量上限
+SCAN_DIR_BATCH = 32        # 同一目录内的文件按批交给提取进程，减少进程间往返
+SCAN_WORKERS = max(1, args.scan_workers or os.cpu_count() or 4)
+SCAN_WORKER_SCRIPT = os.path.join(BASE_DIR, 'scan_worker.py')
+# 进程模式以独立解释器运行 scan_worker.py，不 fork 带着后台线程的本进程；打包模式下没有单独的脚本，只能用线程
+SCAN_MODE = 'thread' if getattr(sys, 'frozen', False) or not os.path.exists(SCAN_WORKER_SCRIPT) else args.scan_mode
+_SCAN_DONE = object()
+
+SCAN_WALK_THREADS = 8      # 并行遍历目录的线程数，网络存储上主要耗时在元数据往返
+SCAN_HISTORY_KEEP = 200    # scan_history 保留的记录数
+
+class ScanProfiler:
+    """扫描分阶段计时与计数。
+
+    阶段耗时为各线程累计的秒数（并行阶段可能大于总耗时）；提取进程内的统计通过 export/merge 汇总。
+    """
+    def __init__(self):
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self.phases = {}     # 阶段 -> [秒数, 次数]
+        self.counters = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds, calls=1):
+        with self._lock:
+            entry = self.phases.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += calls
+
+    def add(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def export(self):
+        with self._lock:
+            return {'phases': {k: list(v) for k, v in self.phases.items()}, 'counters': dict(self.counters)}
+
+    def merge(self, stats):
+        for name, (seconds, calls) in stats.get('phases', {}).items():
+            self.add_time(name, seconds, calls)
+        for name, n in stats.get('counters', {}).items():
+            self.add(name, n)
+
+    def report(self):
+        """汇总为可序列化的报告，附带吞吐率。"""
+        elapsed = max(time.time() - self.started_at, 1e-6)
+        stats = self.export()
+        counters, phases = stats['counters'], stats['phases']
+
+        def rate(counter, phase=None):
+            seconds = phases[phase][0] if phase in phases else elapsed
+            return round(counters.get(counter, 0) / seconds, 1) if seconds > 0 else 0
+
+        return {
+            'elapsed': round(elapsed, 3),
+            'phases': {k: {'seconds': round(v[0], 3), 'calls': v[1]} for k, v in sorted(phases.items())},
+            'counters': counters,
+            'rates': {
+                'files_per_sec': rate('files_seen'),
+                'parsed_files_per_sec': rate('files_parsed', 'parse'),
+                'stat_per_sec': rate('files_stat', 'stat'),
+                'db_rows_per_sec': rate('rows_written', 'db_write'),
+                # 标签解析只读取文件头尾，parsed_file_mb 是被解析文件的总大小而非实际读取量；指纹读取量是准确的
+                'parsed_file_mb': round(counters.get('parsed_file_bytes', 0) / 1048576, 1),
+                'fingerprint_read_mb': round(counters.get('fingerprint_bytes', 0) / 1048576, 1),
+            },
+        }
+
+def record_scan_history(scope, full, storage_class, written, deleted, profiler, error=None):
+    """保存一次扫描的统计报告，并裁剪旧记录；error 为失败扫描的错误信息。"""
+    try:
+        with get_db() as conn:
+            conn.execute("INSERT INTO scan_history (started_at, finished_at, scope, full, storage_class, written, deleted, report, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (profiler.started_at, time.time(), scope, 1 if full else 0, storage_class, written, deleted,
+                          json.dumps(profiler.report(), ensure_ascii=False), error))
+            conn.execute("DELETE FROM scan_history WHERE id <= (SELECT MAX(id) FROM scan_history) - ?", (SCAN_HISTORY_KEEP,))
+    except sqlite3.Error as e:
+        logger.warning(f"保存扫描历史失败: {e}")
+
+def _indexed_paths(conn, paths):
+    """返回已完整入库（已解析流信息与指纹）的路径。"""
+    found = set()
+    for i in range(0, len(paths), 500):
+        chunk = paths[i:i + 500]
+        marks = ','.join('?' * len(chunk))
+        found.update(r[0] for r in conn.execute(
+            f"SELECT path FROM songs WHERE path IN ({marks}) AND codec IS NOT NULL AND fingerprint IS NOT NULL", chunk))
+    return found
+
+def _scan_one_dir(dir_path, use_snapshot, ordered=False, profiler=None):
+    """列出单个目录，返回 (dir_mtime, entries, 子目录, 音频路径, 需比对的文件信息)。
+
+    目录 mtime 与条目数同上次扫描一致时，其中的文件只要已入库就不再逐个 stat。
+    ordered 为 True 时子目录按路径排序、文件按 inode（近似磁盘上的位置）排序，供机械盘顺序读取。
+    """
+    profiler = profiler or ScanProfiler()
+    # 目录名不是有效的 UTF-8 时无法写入快照与遍历记录，直接报错由调用方记为失败目录
+    dir_path.encode('utf-8')
+    with profiler.phase('walk'):
+        dir_stat = os.stat(dir_path)
+        with os.scandir(dir_path) as it:
+            entries = list(it)
+    subdirs, files = [], []
+    for entry in entries:
+        try:
+            if entry.is_dir():
+                # 排除自动生成的目录，不跟随目录符号链接（与 os.walk 默认一致）
+                if entry.name not in ('lyrics', 'covers', MOUNT_INDEX_DIRNAME) and not entry.is_symlink():
+                    subdirs.append(entry.path)
+            elif entry.name.lower().endswith(AUDIO_EXTS) and entry.is_file():
+                # 非 UTF-8 的文件名无法写入数据库，跳过
+                entry.path.encode('utf-8')
+                files.append(entry)
+        except UnicodeEncodeError:
+            logger.warning(f"文件名不是有效的 UTF-8，已跳过: {entry.path!r}")
+            profiler.add('files_skipped')
+        except OSError:
+            continue
+    if ordered:
+        subdirs.sort()
+        files.sort(key=lambda e: e.inode())
+    paths = [e.path for e in files]
+    profiler.add('dirs')
+    profiler.add('files_seen', len(paths))
+
+    to_stat = files
+    if use_snapshot and files:
+        with profiler.phase('snapshot'), get_db() as conn:
+            row = conn.execute("SELECT mtime, entries FROM scan_dirs WHERE path=?", (dir_path,)).fetchone()
+            if row and row['mtime'] == dir_stat.st_mtime and row['entries'] == len(entries):
+                indexed = _indexed_paths(conn, paths)
+                to_stat = [e for e in files if e.path not in indexed]
+    infos = []
+    with profiler.phase('stat'):
+        for entry in to_stat:
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            infos.append((entry.path, entry.name, st.st_mtime, st.st_size))
+    profiler.add('files_stat', len(to_stat))
+    return dir_stat.st_mtime, len(entries), subdirs, paths, infos
+
+def walk_audio_dirs(roots, use_snapshot=True, threads=SCAN_WALK_THREADS, ordered=False, profiler=None, failed=None):
+    """多线程并行遍历目录树，逐个目录产出 (dir, dir_mtime, entries, 音频路径, 需比对的文件信息)。
+
+    ordered 为 True 时按路径深度优先遍历（单线程下即为严格的路径顺序）。
+    failed 为列表时记录处理失败的目录，其下的子目录也未被遍历。
+    """
+    dir_q = queue.LifoQueue() if ordered else queue.Queue()
+    out_q = queue.Queue(maxsize=SCAN_QUEUE_SIZE)
+    lock = threading.Lock()
+    state = {'pending': 0, 'stop': False}
+
+    for root_dir in dict.fromkeys(roots):
+        if os.path.isdir(root_dir):
+            state['pending'] += 1
+            dir_q.put(root_dir)
+    if not state['pending']:
         return
 
-    # Check lock (reuse logic partially or just check global status)
-    if SCAN_STATUS.get('scanning'): return
+    def put(item):
+        while not state['stop']:
+            try:
+                out_q.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
 
+    def worker():
+        while True:
+            dir_path = dir_q.get()
+            if dir_path is None:
+                return
+            try:
+                dir_mtime, entries, subdirs, paths, infos = _scan_one_dir(dir_path, use_snapshot, ordered, profiler)
+                with lock:
+                    state['pending'] += len(subdirs)
+                # 后进先出队列逆序放入，使第一个子目录最先被取出
+                for sub in (reversed(subdirs) if ordered else subdirs):
+                    dir_q.put(sub)
+                put((dir_path, dir_mtime, entries, paths, infos))
+            except Exception as e:
+                # 任何异常都只跳过该目录（如无法编码的目录名），不能让遍历线程退出，否则扫描会一直等待
+                logger.warning(f"遍历目录失败: {dir_path!r}, 错误: {e}")
+                if failed is not None:
+                    failed.append(dir_path)
+            finally:
+                with lock:
+                    state['pending'] -= 1
+                    done = state['pending'] == 0
+                if done:
+                    put(_SCAN_DONE)
+
+    pool = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, threads))]
+    for t in pool: t.start()
     try:
-        with app.app_context():
-            SCAN_STATUS.update({
-                'scanning': True, 
-                'scan_total': 0, 
-                'scan_processed': 0, 
-                'current_file': '正在扫描目录...'
-            })
-            logger.info(f"开始单独扫描目录: {target_dir}")
-            
-            disk_files = {} # path -> info
-            supported_exts = AUDIO_EXTS
-            
-            for root, dirs, files in os.walk(target_dir):
-                 dirs[:] = [d for d in dirs if d not in ('lyrics', 'covers')]
-                 for f in files:
-                     if f.lower().endswith(supported_exts):
-                         path = os.path.join(root, f)
-                         try:
-                             stat = os.stat(path)
-                             info = {'mtime': stat.st_mtime, 'size': stat.st_size, 'path': path, 'filename': f}
-                             disk_files[path] = info
-                         except: pass
+        while True:
+            item = out_q.get()
+            if item is _SCAN_DONE:
+                return
+            yield item
+    finally:
+        state['stop'] = True
+        for _ in pool:
+            dir_q.put(None)
+
+def extract_song_batch(paths, profiler=None, parsed=None):
+    """提取一批文件的元数据，逐个返回精简元组，失败为 None。
+
+    元组: (title, artist, album, has_cover, duration, bitrate, sample_rate, codec, lyrics, fingerprint, cover_hash)
+    parsed 为提取进程返回的 parse_batch 结果，缺省时在当前线程解析；封面登记在本进程完成。
+    """
+    profiler = profiler or ScanProfiler()
+    if parsed is None:
+        parsed, stats = parse_batch(paths, COVER_THUMB_DIR)
+        profiler.merge(stats)
+    results = []
+    for path, item in zip(paths, parsed):
+        if item is None:
+            results.append(None)
+            continue
+        tags, fingerprint, cover_hash = item
+        try:
+            # 同名 .jpg 优先，其次登记内嵌封面（只记哈希，不写出原图）；新扫描的文件不使用旧版按文件名共用的封面
+            with profiler.phase('cover'):
+                if cover_hash and not sidecar_cover_path(path):
+                    if tags['cover']:
+                        cover_hash = prepare_cover(path, tags['cover'], kind='embedded')
+                    has_cover = 1
+                    profiler.add('embedded_covers')
+                else:
+                    has_cover, cover_hash = song_cover_state(path)
+            results.append((tags['title'], tags['artist'], tags['album'], has_cover, tags['duration'],
+                            tags['bitrate'], tags['sample_rate'], tags['codec'], tags['lyrics'] or '',
+                            fingerprint, cover_hash))
+        except Exception as e:
+            logger.warning(f"提取元数据失败: {path}, 错误: {e}")
+            profiler.add('files_failed')
+            results.append(None)
+    return results
+
+class ScanWorkerPool:
+    """常驻的提取进程池，进程按需启动并在多次扫描间复用。
+
+    每个进程以独立解释器运行 scan_worker.py（fork 后立即 exec），不继承本进程的线程、锁、日志与数据库连接。
+    """
+    def __init__(self, size):
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._started = 0
+
+    def _acquire(self):
+        # 等待期间有进程被丢弃时名额会空出来，因此定时重新检查是否可以补启动
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                if self._started < self.size:
+                    self._started += 1
+                    try:
+                        return subprocess.Popen([sys.executable, SCAN_WORKER_SCRIPT], stdin=subprocess.PIPE,
+                                                stdout=subprocess.PIPE, cwd=BASE_DIR)
+                    except OSError:
+                        self._started -= 1
+                        raise
+            try:
+                return self._idle.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+    def _discard(self, proc):
+        with contextlib.suppress(OSError):
+            proc.kill()
+        with contextlib.suppress(Exception):
+            proc.wait(timeout=5)
+        with self._lock:
+            self._started -= 1
+
+    def parse(self, paths):
+        """交给一个空闲进程解析，返回 parse_batch 的结果；进程异常时丢弃并抛出。"""
+        proc = self._acquire()
+        try:
+            pickle.dump((paths, COVER_THUMB_DIR), proc.stdin, protocol=pickle.HIGHEST_PROTOCOL)
+            proc.stdin.flush()
+            result = pickle.load(proc.stdout)
+        except BaseException:
+            self._discard(proc)
+            raise
+        self._idle.put(proc)
+        return result
+
+def unchanged_song_paths(conn, infos):
+    """返回 infos (path, filename, mtime, size) 中大小与修改时间均与库中一致的路径。
+
+    未解析过流信息或指纹的旧记录视为需要更新。
+    """
+    unchanged = set()
+    for i in range(0, len(infos), 500):
+        chunk = infos[i:i + 500]
+        marks = ','.join('?' * len(chunk))
+        known = {r['path']: (r['mtime'], r['size']) for r in conn.execute(
+            f"SELECT path, mtime, size FROM songs WHERE path IN ({marks}) AND codec IS NOT NULL AND fingerprint IS NOT NULL",
+            [info[0] for info in chunk])}
+        unchanged.update(info[0] for info in chunk if known.get(info[0]) == (info[2], info[3]))
+    return unchanged
+
+def build_song_row(info, extracted):
+    """由遍历信息和提取结果组装 save_song_rows 使用的歌曲行。"""
+    if extracted is None:
+        return None
+    path, filename, mtime, size = info
+    return (generate_song_id(path), path, filename, *extracted[:3], mtime, size, *extracted[3:])
+
+def iter_dir_batches(infos, size=SCAN_DIR_BATCH):
+    """按所在目录把连续的文件信息分批，同一批不跨目录。"""
+    batch, current_dir = [], None
+    for info in infos:
+        d = os.path.dirname(info[0])
+        if batch and (d != current_dir or len(batch) >= size):
+            yield batch
+            batch = []
+        current_dir = d
+        batch.append(info)
+    if batch:
+        yield batch
+
+def _open_scan_ledger():
+    """本次扫描遍历到的路径记录在临时磁盘库中，用于结束后找出已消失的歌曲。"""
+    ledger = sqlite3.connect('', check_same_thread=False)
+    ledger.execute("PRAGMA journal_mode=OFF")
+    ledger.execute("PRAGMA synchronous=OFF")
+    ledger.execute("CREATE TABLE seen (path TEXT PRIMARY KEY) WITHOUT ROWID")
+    ledger.execute("CREATE TABLE dirs (path TEXT PRIMARY KEY, mtime REAL, entries INTEGER) WITHOUT ROWID")
+    return ledger
+
+def path_prefix_range(path):
+    """目录下所有路径的区间 [lo, hi)，可走 path 索引且不会误匹配同名前缀的兄弟目录。"""
+    base = path.rstrip(os.sep)
+    return base + os.sep, base + chr(ord(os.sep) + 1)
+
+def _under_dirs(path, dirs):
+    """path 是否为 dirs 中某个目录本身或其下的路径。"""
+    return any(path == d or path.startswith(d.rstrip(os.sep) + os.sep) for d in dirs)
+
+def _sweep_missing_songs(ledger, scope=None, skip_dirs=()):
+    """按路径顺序分批比对数据库与本次遍历结果，删除已不存在的歌曲；skip_dirs 下的歌曲不清理。"""
+    deleted = 0
+    last = ''
+    scope_sql = " AND path >= ? AND path < ?" if scope else ''
+    while True:
+        with get_db() as conn:
+            params = (last, *path_prefix_range(scope), SCAN_BATCH_SIZE) if scope else (last, SCAN_BATCH_SIZE)
+            paths = [r['path'] for r in conn.execute(f"SELECT path FROM songs WHERE path > ?{scope_sql} ORDER BY path LIMIT ?", params)]
+            if not paths:
+                return deleted
+            last = paths[-1]
+            marks = ','.join('?' * len(paths))
+            found = {r[0] for r in ledger.execute(f"SELECT path FROM seen WHERE path IN ({marks})", paths)}
+            missing = [p for p in paths if p not in found and not (skip_dirs and _under_dirs(p, skip_dirs))]
+            if missing:
+                delete_song_paths(conn, missing)
+                deleted += len(missing)
+
+def _save_dir_snapshot(ledger, scope=None, skip_dirs=()):
+    """把本次遍历到的目录 mtime 写入 scan_dirs，并移除已不存在的目录记录；skip_dirs 下的记录保持不变。"""
+    now = time.time()
+    last = ''
+    while True:
+        rows = ledger.execute("SELECT path, mtime, entries FROM dirs WHERE path > ? ORDER BY path LIMIT ?", (last, SCAN_BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        last = rows[-1][0]
+        with get_db() as conn:
+            conn.executemany("INSERT OR REPLACE INTO scan_dirs (path, mtime, entries, scanned_at) VALUES (?, ?, ?, ?)",
+                             [(*r, now) for r in rows])
+    scope_sql = " AND (path = ? OR (path >= ? AND path < ?))" if scope else ''
+    last = ''
+    while True:
+        with get_db() as conn:
+            params = [last]
+            if scope:
+                params += [scope.rstrip(os.sep), *path_prefix_range(scope)]
+            paths = [r[0] for r in conn.execute(f"SELECT path FROM scan_dirs WHERE path > ?{scope_sql} ORDER BY path LIMIT ?", (*params, SCAN_BATCH_SIZE))]
+            if not paths:
+                return
+            last = paths[-1]
+            marks = ','.join('?' * len(paths))
+            found = {r[0] for r in ledger.execute(f"SELECT path FROM dirs WHERE path IN ({marks})", paths)}
+            conn.executemany("DELETE FROM scan_dirs WHERE path=?",
+                             [(p,) for p in paths if p not in found and not (skip_dirs and _under_dirs(p, skip_dirs))])
+
+_SCAN_POOL = None
+_SCAN_POOL_LOCK = threading.Lock()
+
+def scan_worker_pool():
+    """进程模式下返回全局常驻的提取进程池，线程模式返回 None。"""
+    global _SCAN_POOL
+    if SCAN_MODE != 'process':
+        return None
+    with _SCAN_POOL_LOCK:
+        if _SCAN_POOL is None:
+            _SCAN_POOL = ScanWorkerPool(SCAN_WORKERS)
+        return _SCAN_POOL
 
-            with get_db() as conn:
-                # 只获取相关路径的歌曲
-                cursor = conn.cursor()
-                # Assuming path stored in DB is absolute
-                cursor.execute("SELECT id, path, mtime, size FROM songs WHERE path LIKE ? || '%'", (target_dir,))
-                db_rows = {row['path']: row for row in cursor.fetchall()}
-                
-                to_delete_paths = set(db_rows.keys()) - set(disk_files.keys())
-                if to_delete_paths:
-                    cursor.executemany("DELETE FROM songs WHERE path=?", [(p,) for p in to_delete_paths])
-                    conn.commit()
+def run_scan_pipeline(roots, scope=None, full=False, profile=None, profiler=None):
+    """流式扫描 roots 并写入数据库，返回 (写入数, 删除数)。
 
-                files_to_process_list = []
-                for path, info in disk_files.items():
-                    db_rec = db_rows.get(path)
-                    # If new or modified
-                    if not db_rec or db_rec['mtime'] != info['mtime'] or db_rec['size'] != info['size']:
-                        files_to_process_list.append(info)
+    scope 为目录前缀时只清理该目录下已消失的歌曲，否则清理全部。
+    full 为 True 时忽略目录快照，逐个 stat 所有文件（可发现未改变目录 mtime 的原地修改）。
+    profile 为并发配置，默认按第一个根目录所在存储检测；profiler 收集分阶段统计。
+    """
+    profiler = profiler or ScanProfiler()
+    if profile is None:
+        profile = storage_profile(roots[0]) if roots else STORAGE_PROFILES['unknown']
+    workers_count = profile['workers']
+    logger.info(f"扫描并发: 存储类型 {profile.get('class', 'unknown')}，遍历 {profile['walk_threads']} 线程，提取 {workers_count} 线程")
+    work_q = queue.Queue(maxsize=max(1, SCAN_QUEUE_SIZE // SCAN_DIR_BATCH))
+    result_q = queue.Queue(maxsize=SCAN_QUEUE_SIZE)
+    written = [0]
+    writer_error = []
+    pool = scan_worker_pool()
+
+    def extract_batch(batch):
+        SCAN_STATUS['current_path'] = batch[0][0]
+        with profiler.phase('tag_cache'):
+            cached = lookup_tag_cache(batch)
+        profiler.add('cache_hits', len(cached))
+        paths = [info[0] for info in batch if info[0] not in cached]
+        parsed = None
+        if pool and paths:
+            try:
+                parsed, stats = pool.parse(paths)
+                profiler.merge(stats)
+            except Exception as e:
+                logger.warning(f"提取进程异常，改为线程内提取: {e}")
+        results = extract_song_batch(paths, profiler, parsed)
+        cached.update(zip(paths, results))
+        return [build_song_row(info, cached[info[0]]) for info in batch]
 
-                total_files = len(files_to_process_list)
-                SCAN_STATUS.update({'scan_total': total_files, 'scan_processed': 0})
-                
-                to_update_db = []
-                
-                if total_files > 0:
-                    def process_file_metadata(info):
-                        # Simple inline version
-                        SCAN_STATUS['current_path'] = info['path']
-                        meta = get_metadata(info['path'])
-                        sid = generate_song_id(info['path'])
-                        base_path = os.path.splitext(info['path'])[0]
-                        has_cover = 1 if os.path.exists(base_path + ".jpg") or os.path.exists(os.path.join(MUSIC_LIBRARY_PATH, 'covers', f"{os.path.basename(base_path)}.jpg")) else 0
-                        if has_cover == 0:
-                            if extract_embedded_cover(info['path']): has_cover = 1
-                        # 确保所有元数据都是字符串类型，避免数据库绑定错误
-                        title = str(meta['title']) if meta['title'] is not None else ''
-                        artist = str(meta['artist']) if meta['artist'] is not None else ''
-                        album = str(meta['album']) if meta['album'] is not None else ''
-                        return (sid, info['path'], info['filename'], title, artist, album, info['mtime'], info['size'], has_cover)
-
-                    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-                         futures = {executor.submit(process_file_metadata, item): item for item in files_to_process_list}
-                         for future in concurrent.futures.as_completed(futures):
-                             try:
-                                 res = future.result()
-                                 to_update_db.append(res)
-                             except Exception: pass
-                             SCAN_STATUS['scan_processed'] += 1
-                             if SCAN_STATUS['scan_processed'] % 5 == 0:
-                                 SCAN_STATUS['current_file'] = f"处理中... {int((SCAN_STATUS['scan_processed']/total_files)*100)}%"
-
-                if to_update_db:
-                    conn.executemany('''
-                        INSERT OR REPLACE INTO songs (id, path, filename, title, artist, album, mtime, size, has_cover)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', to_update_db)
-                    conn.commit()
-            
-            # Finally trigger scraping for missing metadata in this dir
-            auto_scrape_missing_metadata(target_dir)
+    def metadata_worker():
+        # 进程模式下每个线程负责把一批文件交给一个提取进程并等待结果；任何情况下都要通知写入线程本线程已结束
+        try:
+            while True:
+                batch = work_q.get()
+                if batch is _SCAN_DONE:
+                    return
+                try:
+                    rows = extract_batch(batch)
+                except Exception as e:
+                    logger.exception(f"提取批次失败（{len(batch)} 个文件）: {batch[0][0]}, 错误: {e}")
+                    profiler.add('files_failed', len(batch))
+                    rows = [None] * len(batch)
+                for row in rows:
+                    result_q.put(row)
+        finally:
+            result_q.put(_SCAN_DONE)
 
-    except Exception as e:
-        logger.exception(f"目录扫描失败: {e}")
+    def flush(conn, batch):
+        try:
+            with profiler.phase('db_write'):
+                save_song_rows(conn, batch)
+                conn.commit()
+            written[0] += len(batch)
+            profiler.add('rows_written', len(batch))
+        except sqlite3.Error as e:
+            conn.rollback()
+            logger.error(f"扫描结果写入失败（{len(batch)} 条）: {e}")
+
+    def writer():
+        batch, finished = [], 0
+        try:
+            with get_db() as conn:
+                while finished < workers_count:
+                    row = result_q.get()
+                    if row is _SCAN_DONE:
+                        finished += 1
+                        continue
+                    SCAN_STATUS['scan_processed'] += 1
+                    if SCAN_STATUS['scan_processed'] % 10 == 0 and SCAN_STATUS['scan_total']:
+                        SCAN_STATUS['current_file'] = f"处理中... {int((SCAN_STATUS['scan_processed']/SCAN_STATUS['scan_total'])*100)}%"
+                    if row is None:
+                        continue
+                    # 重复文件同样入库，由指纹分组决定列表中显示哪一条
+                    batch.append(row)
+                    if len(batch) >= SCAN_BATCH_SIZE:
+                        flush(conn, batch)
+                        batch = []
+                if batch:
+                    flush(conn, batch)
+        except Exception as e:
+            logger.exception(f"扫描写入线程异常: {e}")
+            writer_error.append(e)
+            # 继续取走剩余结果直到所有提取线程结束，避免它们阻塞在队列上
+            while finished < workers_count:
+                if result_q.get() is _SCAN_DONE:
+                    finished += 1
+
+    workers = [threading.Thread(target=metadata_worker, daemon=True) for _ in range(workers_count)]
+    writer_thread = threading.Thread(target=writer, daemon=True)
+    for t in workers: t.start()
+    writer_thread.start()
+
+    ledger = _open_scan_ledger()
+    walk_ok = False
+    failed_dirs = []
+    try:
+        walker = walk_audio_dirs(roots, use_snapshot=not full, threads=profile['walk_threads'], ordered=profile['ordered'],
+                                 profiler=profiler, failed=failed_dirs)
+        for dir_path, dir_mtime, entries, paths, infos in walker:
+            ledger.executemany("INSERT OR IGNORE INTO seen (path) VALUES (?)", [(p,) for p in paths])
+            ledger.execute("INSERT OR REPLACE INTO dirs (path, mtime, entries) VALUES (?, ?, ?)", (dir_path, dir_mtime, entries))
+            if not infos:
+                continue
+            with profiler.phase('compare'), get_db() as conn:
+                unchanged = unchanged_song_paths(conn, infos)
+            changed = [info for info in infos if info[0] not in unchanged]
+            profiler.add('files_changed', len(changed))
+            SCAN_STATUS['scan_total'] += len(changed)
+            for batch in iter_dir_batches(changed):
+                work_q.put(batch)
+        walk_ok = True
     finally:
-        SCAN_STATUS['scanning'] = False
-        SCAN_STATUS['current_file'] = '扫描完成'
-        SCAN_STATUS['processed'] = SCAN_STATUS['total']
-        global LIBRARY_VERSION
-        LIBRARY_VERSION = time.time()
+        for _ in workers:
+            work_q.put(_SCAN_DONE)
+        writer_thread.join()
 
-# --- 优化后的并发扫描逻辑 ---
-def scan_library_incremental():
-    global SCAN_STATUS
-    
-    lock_file = os.path.join(MUSIC_LIBRARY_PATH, '.scan_lock')
-    if os.path.exists(lock_file):
-        if time.time() - os.path.getmtime(lock_file) > 300:
+    try:
+        if writer_error:
+            raise RuntimeError(f"扫描结果写入失败: {writer_error[0]}")
+        # 遍历中途出错时不清理也不更新目录快照，避免误删或下次跳过未处理的目录；读取失败的目录同样跳过
+        deleted = 0
+        if failed_dirs:
+            logger.warning(f"{len(failed_dirs)} 个目录读取失败，其下的歌曲本次不做清理")
+            profiler.add('dirs_failed', len(failed_dirs))
+        if walk_ok:
+            with profiler.phase('sweep'):
+                deleted = _sweep_missing_songs(ledger, scope, failed_dirs)
+            with profiler.phase('snapshot_save'):
+                _save_dir_snapshot(ledger, scope, failed_dirs)
+            profiler.add('rows_deleted', deleted)
+    finally:
+        ledger.close()
+    return written[0], deleted
+
+# --- 存储类型检测 ---
+# 按挂载目录所在存储选择并发：机械盘随机并发读会让磁头来回寻道，SSD 与网络存储则需要更多并发填满队列
+NETWORK_FS_TYPES = ('nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', '9p', 'ceph', 'glusterfs', 'davfs',
+                    'fuse.sshfs', 'fuse.rclone', 'fuse.s3fs')
+STORAGE_PROFILES = {
+    'hdd': {'walk_threads': 1, 'workers': 2, 'ordered': True},
+    'ssd': {'walk_threads': 8, 'workers': SCAN_WORKERS, 'ordered': False},
+    'network': {'walk_threads': 16, 'workers': max(SCAN_WORKERS, 16), 'ordered': False},
+    'unknown': {'walk_threads': SCAN_WALK_THREADS, 'workers': SCAN_WORKERS, 'ordered': False},
+}
+STORAGE_SETTING_PREFIX = 'storage:'  # system_settings 中按挂载目录保存的覆盖配置
+
+def _mount_info(path):
+    """从 /proc/mounts 找出 path 所在的挂载，返回 (挂载点, 设备, 文件系统类型)。"""
+    best = ('', '', '')
+    try:
+        with open('/proc/mounts', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 3:
+                    continue
+                # 挂载点中的空格等字符以八进制转义
+                mnt = re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), parts[1])
+                # 同一挂载点被多次挂载时以后出现的为准
+                if (path == mnt or path.startswith(mnt.rstrip('/') + '/')) and len(mnt) >= len(best[0]):
+                    best = (mnt, parts[0], parts[2])
+    except OSError:
+        pass
+    return best
+
+def _block_rotational(path, device):
+    """读取 path 所在块设备的 queue/rotational，无法判断时返回 None。"""
+    candidates = []
+    try:
+        st_dev = os.stat(path).st_dev
+        candidates.append(os.path.realpath(f"/sys/dev/block/{os.major(st_dev)}:{os.minor(st_dev)}"))
+    except (OSError, AttributeError):
+        pass
+    # btrfs 等文件系统的 st_dev 是匿名设备号，改用 /proc/mounts 中的设备名
+    if device.startswith('/dev/'):
+        candidates.append(os.path.realpath(os.path.join('/sys/class/block', os.path.basename(os.path.realpath(device)))))
+    for sys_dir in candidates:
+        # 分区没有 queue 目录，取所属磁盘
+        for d in (sys_dir, os.path.dirname(sys_dir)):
             try:
-                os.remove(lock_file)
-                logger.info("过期扫描锁文件已移除。")
-            except Exception as e:
-                logger.warning(f"移除扫描锁文件失败: {e}")
-        else:
-            return 
+                with open(os.path.join(d, 'queue', 'rotational')) as f:
+                    return f.read().strip() == '1'
+            except OSError:
+                continue
+    return None
 
+def detect_storage_class(path):
+    """检测 path 所在存储类型：hdd / ssd / network / unknown。"""
+    path = os.path.realpath(path)
+    _, device, fstype = _mount_info(path)
+    if fstype in NETWORK_FS_TYPES:
+        return 'network'
+    if fstype in ('tmpfs', 'ramfs'):
+        return 'ssd'
+    rotational = _block_rotational(path, device)
+    if rotational is None:
+        return 'unknown'
+    return 'hdd' if rotational else 'ssd'
+
+def _storage_override(path):
+    """读取覆盖 path 的挂载目录配置（最长前缀优先）。"""
+    best, override = '', {}
     try:
-        with app.app_context():
-            # 更新状态：开始
-            # 更新状态：开始扫描
-            SCAN_STATUS.update({
-                'scanning': True, 
-                'scan_total': 0, 
-                'scan_processed': 0, 
-                'current_file': '正在遍历文件...'
-            })
-            
-            with open(lock_file, 'w') as f: f.write(str(time.time()))
-            logger.info("开始增量扫描...")
-            
-            # 1. 获取所有扫描根目录
-        scan_roots = [MUSIC_LIBRARY_PATH]
+        with get_db() as conn:
+            rows = conn.execute("SELECT key, value FROM system_settings WHERE key >= ? AND key < ?",
+                                (STORAGE_SETTING_PREFIX, STORAGE_SETTING_PREFIX[:-1] + chr(ord(':') + 1))).fetchall()
+    except sqlite3.Error as e:
+        logger.warning(f"读取存储配置失败: {e}")
+        return override
+    for row in rows:
+        mount = row['key'][len(STORAGE_SETTING_PREFIX):]
+        if (path == mount or path.startswith(mount.rstrip(os.sep) + os.sep)) and len(mount) > len(best):
+            try:
+                best, override = mount, json.loads(row['value']) or {}
+            except ValueError:
+                continue
+    return override
+
+def storage_profile(path):
+    """path 所在存储的扫描并发配置：检测结果叠加 system_settings 中的覆盖。"""
+    path = os.path.abspath(path)
+    detected = detect_storage_class(path)
+    override = _storage_override(path)
+    cls = override.get('class') if override.get('class') in STORAGE_PROFILES else detected
+    profile = dict(STORAGE_PROFILES[cls])
+    for key in ('walk_threads', 'workers'):
         try:
-            with get_db() as conn:
-                rows = conn.execute("SELECT path FROM mount_points").fetchall()
-                scan_roots.extend([r['path'] for r in rows])
-        except Exception: pass
-        
-        disk_files = {} # path -> info
-        supported_exts = AUDIO_EXTS
-        
-        # 2. 遍历所有目录
-        for root_dir in scan_roots:
-            if not os.path.exists(root_dir): continue
-            for root, dirs, files in os.walk(root_dir):
-                # 排除自动生成的目录
-                dirs[:] = [d for d in dirs if d not in ('lyrics', 'covers')]
-                for f in files:
-                    if f.lower().endswith(supported_exts):
-                        path = os.path.join(root, f)
-                        try:
-                            stat = os.stat(path)
-                            info = {'mtime': stat.st_mtime, 'size': stat.st_size, 'path': path, 'filename': f}
-                            disk_files[path] = info
-                        except: pass
+            if override.get(key):
+                profile[key] = max(1, int(override[key]))
+        except (TypeError, ValueError):
+            pass
+    profile.update({'class': cls, 'detected': detected})
+    return profile
+
+# --- 挂载可用性 ---
+def library_root_for(path):
+    """path 所属的曲库根目录或挂载目录（最长匹配），不属于任何根目录时返回 None。"""
+    path = os.path.abspath(path)
+    best = None
+    for root in library_roots():
+        if (path == root or path.startswith(root.rstrip(os.sep) + os.sep)) and len(root) > len(best or ''):
+            best = root
+    return best
+
+def mount_available(root):
+    """根目录是否可用：存在且非空（拔出的移动硬盘通常只留下空的挂载点目录）。"""
+    if os.path.abspath(root) == os.path.abspath(MUSIC_LIBRARY_PATH):
+        return os.path.isdir(root)
+    try:
+        with os.scandir(root) as it:
+            return next(it, None) is not None
+    except OSError:
+        return False
 
+def set_songs_offline(conn, path):
+    """把 path 目录下的歌曲标记为离线，保留记录与收藏；返回标记条数。"""
+    lo, hi = path_prefix_range(path)
+    where = "path >= ? AND path < ? AND offline = 0"
+    fps = _song_fingerprints(conn, where, (lo, hi))
+    conn.execute(f"INSERT INTO library_changes (song_id, action, changed_at) SELECT id, 'update', ? FROM songs WHERE {where}",
+                 (time.time(), lo, hi))
+    count = conn.execute(f"UPDATE songs SET offline = 1 WHERE {where}", (lo, hi)).rowcount
+    # 其他位置的同内容文件接替显示
+    refresh_duplicate_groups(conn, fps)
+    return count
+
+def reactivate_offline_songs(path):
+    """挂载恢复后逐个 stat path 下的离线歌曲，大小与修改时间一致的直接恢复。
+
+    返回 (恢复数, 不一致数)；不一致的留待扫描重新解析或清理。
+    """
+    lo, hi = path_prefix_range(path)
+    restored, stale, last = 0, 0, ''
+    while True:
         with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, path, mtime, size FROM songs")
-            db_rows = {row['path']: row for row in cursor.fetchall()}
-            
-            # 删除不存在的文件
-            # 注意：如果某个点被临时拔出，这里会删除其歌曲。
-            # 简单起见：全量比对，消失即删除。
-            to_delete_paths = set(db_rows.keys()) - set(disk_files.keys())
-            if to_delete_paths:
-                cursor.executemany("DELETE FROM songs WHERE path=?", [(p,) for p in to_delete_paths])
+            rows = conn.execute("SELECT path, mtime, size FROM songs WHERE offline = 1 AND path > ? AND path >= ? AND path < ? ORDER BY path LIMIT ?",
+                                (max(last, lo), lo, hi, SCAN_BATCH_SIZE)).fetchall()
+            if not rows:
+                return restored, stale
+            last = rows[-1]['path']
+            matched = []
+            for row in rows:
+                try:
+                    st = os.stat(row['path'])
+                except OSError:
+                    stale += 1
+                    continue
+                if (st.st_mtime, st.st_size) == (row['mtime'], row['size']):
+                    matched.append(row['path'])
+                else:
+                    stale += 1
+            if matched:
+                marks = ','.join('?' * len(matched))
+                conn.execute(f"INSERT INTO library_changes (song_id, action, changed_at) SELECT id, 'update', ? FROM songs WHERE path IN ({marks})",
+                             (time.time(), *matched))
+                conn.execute(f"UPDATE songs SET offline = 0 WHERE path IN ({marks})", matched)
+                refresh_duplicate_groups(conn, _path_fingerprints(conn, matched))
+                conn.commit()
+                restored += len(matched)
+
+# --- 挂载目录导出副本 ---
+# 扫描后把挂载目录下的歌曲复制一份到便携文件（路径相对挂载目录），优先放在目录自身，随移动硬盘携带；
+# 在新位置或另一台机器上添加该目录时先导入，扫描只需逐个 stat 比对，不必重新解析标签。
+# 这只是导出副本，不是分库：歌曲只存于主库 songs 表，各挂载共用同一写入路径，移除挂载仍在主库上按路径范围删除
+MOUNT_INDEX_ENABLED = args.mount_index
+MOUNT_INDEX_DIRNAME = '.2fmusic'
+MOUNT_INDEX_VERSION = 1
+MOUNT_INDEX_COLUMNS = ('id', 'filename', 'title', 'artist', 'album', 'mtime', 'size', 'has_cover',
+                       'duration', 'bitrate', 'sample_rate', 'codec', 'lyrics', 'fingerprint')
+
+def mount_index_path(root):
+    """挂载目录导出副本的文件路径：目录可写时放在目录内，否则放在曲库的 mount_index 目录。"""
+    local_dir = os.path.join(root, MOUNT_INDEX_DIRNAME)
+    if os.path.isdir(local_dir) or os.access(root, os.W_OK):
+        return os.path.join(local_dir, 'index.db')
+    return os.path.join(MUSIC_LIBRARY_PATH, 'mount_index', hashlib.md5(root.encode('utf-8')).hexdigest() + '.db')
+
+def _open_mount_index(root, create=False):
+    """打开一个附加了导出副本（别名 idx）的临时连接，仅在导出与导入时使用；索引不存在且不创建时返回 None。"""
+    index_path = mount_index_path(root)
+    if not os.path.exists(index_path):
+        if not create:
+            return None
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=30.0, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("ATTACH DATABASE ? AS idx", (index_path,))
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS idx.songs (
+                rel_path TEXT PRIMARY KEY, {', '.join(MOUNT_INDEX_COLUMNS)}
+            )
+        """)
+        conn.execute("CREATE TABLE IF NOT EXISTS idx.meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("INSERT OR IGNORE INTO idx.meta (key, value) VALUES ('version', ?)", (str(MOUNT_INDEX_VERSION),))
+        conn.commit()
+    except sqlite3.Error:
+        conn.close()
+        raise
+    return conn
+
+def export_mount_index(root, scope=None):
+    """把 scope（默认整个挂载目录）下的在线歌曲复制到导出副本，返回导出条数。"""
+    root = root.rstrip(os.sep)
+    lo, hi = path_prefix_range(scope or root)
+    try:
+        conn = _open_mount_index(root, create=True)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"写入挂载目录导出副本失败: {root}, 错误: {e}")
+        return 0
+    try:
+        offset = len(root) + 2  # substr 从 1 开始，并跳过分隔符
+        rel_lo, rel_hi = lo[offset - 1:], hi[offset - 1:]
+        if scope and scope.rstrip(os.sep) != root:
+            conn.execute("DELETE FROM idx.songs WHERE rel_path >= ? AND rel_path < ?", (rel_lo, rel_hi))
+        else:
+            conn.execute("DELETE FROM idx.songs")
+        count = conn.execute(f"""
+            INSERT INTO idx.songs (rel_path, {', '.join(MOUNT_INDEX_COLUMNS)})
+            SELECT substr(path, ?), {', '.join(MOUNT_INDEX_COLUMNS)} FROM main.songs
+            WHERE path >= ? AND path < ? AND offline = 0 AND codec IS NOT NULL AND fingerprint IS NOT NULL
+        """, (offset, lo, hi)).rowcount
+        conn.commit()
+        return count
+    except sqlite3.Error as e:
+        conn.rollback()
+        logger.warning(f"写入挂载目录导出副本失败: {root}, 错误: {e}")
+        return 0
+    finally:
+        conn.close()
+
+def import_mount_index(root):
+    """主库中还没有该挂载目录的歌曲时，从导出副本导入主库；返回导入条数。"""
+    root = root.rstrip(os.sep)
+    lo, hi = path_prefix_range(root)
+    with get_db() as conn:
+        if conn.execute("SELECT 1 FROM songs WHERE path >= ? AND path < ? LIMIT 1", (lo, hi)).fetchone():
+            return 0
+    try:
+        idx = _open_mount_index(root)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"读取挂载目录导出副本失败: {root}, 错误: {e}")
+        return 0
+    if idx is None:
+        return 0
+    imported, last = 0, ''
+    try:
+        while True:
+            rows = idx.execute(f"SELECT rel_path, {', '.join(MOUNT_INDEX_COLUMNS)} FROM idx.songs WHERE rel_path > ? ORDER BY rel_path LIMIT ?",
+                                 (last, SCAN_BATCH_SIZE)).fetchall()
+            if not rows:
+                return imported
+            last = rows[-1]['rel_path']
+            marks = ','.join('?' * len(rows))
+            with get_db() as conn:
+                known_covers = dict(conn.execute(f"SELECT fingerprint, cover_hash FROM tag_cache WHERE cover_hash IS NOT NULL AND fingerprint IN ({marks})",
+                                                 [r['fingerprint'] for r in rows]).fetchall())
+            song_rows = []
+            for r in rows:
+                path = os.path.join(root, r['rel_path'])
+                # 封面存储属于本机曲库，按指纹沿用本机已存的封面；仍缺的保留 has_cover，由补登记任务读取
+                has_cover, cover_hash = song_cover_state(path, known_covers.get(r['fingerprint']))
+                song_rows.append((r['id'], path, r['filename'], r['title'], r['artist'], r['album'], r['mtime'], r['size'],
+                                  has_cover or r['has_cover'], *tuple(r)[9:], cover_hash))
+            with get_db() as conn:
+                save_song_rows(conn, song_rows)
                 conn.commit()
+            imported += len(song_rows)
+    except sqlite3.Error as e:
+        logger.warning(f"读取挂载目录导出副本失败: {root}, 错误: {e}")
+        return imported
+    finally:
+        idx.close()
 
-            # 筛选需要更新的文件
-            files_to_process_list = []
-            for path, info in disk_files.items():
-                db_rec = db_rows.get(path)
-                if not db_rec or db_rec['mtime'] != info['mtime'] or db_rec['size'] != info['size']:
-                    files_to_process_list.append(info)
+# --- 扫描调度 ---
+class ScanScheduler:
+    """按目录范围排队、合并的扫描调度器。
 
-            # 更新状态 scan_total
-            total_files = len(files_to_process_list)
-            SCAN_STATUS.update({'scan_total': total_files, 'scan_processed': 0})
-            
-            to_update_db = []
-            
-            # 3. 多线程处理
-            if total_files > 0:
-                logger.info(f"使用线程池处理 {total_files} 个文件...")
-                
-                def process_file_metadata(info):
-                    # Update current path for UI
-                    SCAN_STATUS['current_path'] = info['path']
-                    
-                    meta = get_metadata(info['path'])
-                    sid = generate_song_id(info['path'])
-                    # 封面逻辑
-                    base_path = os.path.splitext(info['path'])[0]
-                    # 检查本地是否有封面文件
-                    has_cover = 1 if os.path.exists(base_path + ".jpg") or os.path.exists(os.path.join(MUSIC_LIBRARY_PATH, 'covers', f"{os.path.basename(base_path)}.jpg")) else 0
-                    
-                    # Fix: 如果没有外部封面，尝试提取内嵌封面
-                    if has_cover == 0:
-                        if extract_embedded_cover(info['path']):
-                            has_cover = 1
-                            
-                    # 确保所有元数据都是字符串类型，避免数据库绑定错误
-                    title = str(meta['title']) if meta['title'] is not None else ''
-                    artist = str(meta['artist']) if meta['artist'] is not None else ''
-                    album = str(meta['album']) if meta['album'] is not None else ''
-                    return (sid, info['path'], info['filename'], title, artist, album, info['mtime'], info['size'], has_cover)
-
-                with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-                    futures = {executor.submit(process_file_metadata, item): item for item in files_to_process_list}
-                    for future in concurrent.futures.as_completed(futures):
-                        try:
-                            res = future.result()
-                            to_update_db.append(res)
-                        except Exception: pass
-                        
-                        SCAN_STATUS['scan_processed'] += 1
-                        if SCAN_STATUS['scan_processed'] % 10 == 0:
-                            SCAN_STATUS['current_file'] = f"处理中... {int((SCAN_STATUS['scan_processed']/total_files)*100)}%"
-
-                # 过滤重复文件 (批次内去重 + 数据库去重)
-                final_update_db = []
-                seen_in_batch = set() # (filename, size)
-
-                for item in to_update_db:
-                    # structure: (sid, path, filename, title, artist, album, mtime, size, has_cover)
-                    # item[1]=path, item[2]=filename, item[7]=size
-                    c_path, c_fname, c_size = item[1], item[2], item[7]
-                    
-                    # 1. 批次内查重
-                    if (c_fname, c_size) in seen_in_batch:
-                        logger.info(f"扫描: 跳过批次内重复文件 {c_path}")
-                        continue
-                        
-                    # 2. 数据库查重 (排除自己)
-                    # 注意: 这里使用 conn (外层已开启)
-                    # 需要确保 conn 线程安全? sqlite3 单线程模式下需要注意。
-                    # 但 Flask 这里的 conn 是 thread-local 还是? 
-                    # scan_library_incremental 是后台任务，单线程执行 (executor 是处理 metadata 的)。
-                    # "with get_db() as conn" 在上层。所以是安全的。
-                    try:
-                        dup = conn.execute("SELECT path FROM songs WHERE filename=? AND size=? AND path!=?", (c_fname, c_size, c_path)).fetchone()
-                        if dup:
-                            logger.info(f"扫描: 跳过全局重复文件 {c_path} (已存在: {dup['path']})")
-                            continue
-                    except Exception: pass
-                    
-                    seen_in_batch.add((c_fname, c_size))
-                    final_update_db.append(item)
-
-                if final_update_db:
-                    cursor.executemany('''
-                        INSERT OR REPLACE INTO songs (id, path, filename, title, artist, album, mtime, size, has_cover)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', final_update_db)
+    扫描请求按所在存储设备（st_dev）分队列，每个设备同一时间只跑一个扫描，
+    不同设备可并行；队列中互相包含的请求合并为范围更大的一个，已有扫描时排队而不是丢弃。
+    扫描完成后的刮削请求进入单独的队列，同样合并。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues = {}    # 队列键 -> [请求]
+        self._running = {}   # 队列键 -> 正在执行的请求
+        self._active_scans = 0
+        self._profilers = {}  # 正在扫描的目录 -> ScanProfiler
+
+    @staticmethod
+    def _covers(outer, inner):
+        # path 为 None 表示整个曲库
+        if outer is None:
+            return True
+        if inner is None:
+            return False
+        outer = outer.rstrip(os.sep)
+        return inner == outer or inner.startswith(outer + os.sep)
+
+    def _enqueue(self, key, req):
+        with self._lock:
+            pending = self._queues.setdefault(key, [])
+            for other in pending:
+                if self._covers(other['path'], req['path']):
+                    other['full'] |= req['full']
+                    other['scrape'] |= req['scrape']
+                    return
+            for other in [o for o in pending if self._covers(req['path'], o['path'])]:
+                req['full'] |= other['full']
+                req['scrape'] |= other['scrape']
+                pending.remove(other)
+            pending.append(req)
+            if key not in self._running:
+                self._running[key] = None
+                threading.Thread(target=self._run_queue, args=(key,), daemon=True).start()
+
+    def _run_queue(self, key):
+        while True:
+            with self._lock:
+                pending = self._queues.get(key)
+                if not pending:
+                    self._queues.pop(key, None)
+                    self._running.pop(key, None)
+                    return
+                req = pending.pop(0)
+                self._running[key] = req
+            try:
+                if key == 'scrape':
+                    auto_scrape_missing_metadata(req['path'])
+                else:
+                    self._scan(req)
+            except Exception as e:
+                logger.exception(f"扫描任务失败: {req['path']}, 错误: {e}")
+
+    def submit_scan(self, path, full=False, scrape=True):
+        """排队扫描 path 目录；full 为 True 时忽略目录快照逐个检查文件。"""
+        path = os.path.abspath(path)
+        try:
+            key = ('dev', os.stat(path).st_dev)
+        except OSError:
+            key = ('path', path)
+        logger.info(f"扫描请求已排队: {path}")
+        self._enqueue(key, {'path': path, 'full': full, 'scrape': scrape})
+
+    def submit_scrape(self, path=None):
+        """排队刮削 path 下缺失的封面和歌词，path 为空时刮削整个曲库。"""
+        self._enqueue('scrape', {'path': os.path.abspath(path) if path else None, 'full': False, 'scrape': True})
+
+    def status(self):
+        with self._lock:
+            profilers = dict(self._profilers)
+            result = {
+                'running': [req['path'] for key, req in self._running.items() if req and key != 'scrape'],
+                'queued': sum(len(q) for key, q in self._queues.items() if key != 'scrape'),
+            }
+        # 正在进行的扫描的实时分阶段统计
+        result['profiles'] = {path: p.report() for path, p in profilers.items()}
+        return result
+
+    def _scan(self, req):
+        with self._lock:
+            if self._active_scans == 0:
+                SCAN_STATUS.update({
+                    'scanning': True,
+                    'scan_total': 0,
+                    'scan_processed': 0,
+                    'current_file': '正在遍历文件...'
+                })
+            self._active_scans += 1
+        path = req['path']
+        try:
+            root = library_root_for(path) or path
+            if not mount_available(root):
+                # 挂载不可用时不做比对清理，只把歌曲标记为离线
+                with get_db() as conn:
+                    count = set_songs_offline(conn, path)
                     conn.commit()
+                logger.warning(f"目录不可用，跳过扫描: {path}，{count} 首歌曲标记为离线")
+                if count:
+                    bump_library_version()
+                return
+            is_mount = MOUNT_INDEX_ENABLED and root != os.path.abspath(MUSIC_LIBRARY_PATH)
+            if is_mount:
+                imported = import_mount_index(root)
+                if imported:
+                    logger.info(f"从挂载目录导出副本导入 {imported} 首歌曲: {root}")
+                    backfill_cover_hashes()
+            restored, stale = reactivate_offline_songs(path)
+            if restored or stale:
+                logger.info(f"目录已恢复: {path}，恢复 {restored} 首离线歌曲，{stale} 首需要重新检查")
+            # 有离线期间变化过的文件时逐个 stat，避免目录快照跳过它们
+            full = req['full'] or stale > 0
+            logger.info(f"开始扫描: {path}{' (完整检查)' if full else ''}")
+            profiler = ScanProfiler()
+            profile = storage_profile(path)
+            with self._lock:
+                self._profilers[path] = profiler
+            try:
+                written, deleted = run_scan_pipeline([path], scope=path, full=full, profile=profile, profiler=profiler)
+            except Exception as e:
+                # 失败的扫描同样留下记录，写入数为失败前已提交的条数
+                counters = profiler.export()['counters']
+                record_scan_history(path, full, profile['class'], counters.get('rows_written', 0), counters.get('rows_deleted', 0),
+                                    profiler, error=str(e) or type(e).__name__)
+                raise
+            finally:
+                with self._lock:
+                    self._profilers.pop(path, None)
+            record_scan_history(path, full, profile['class'], written, deleted, profiler)
+            # 按扫描后的目录数重新核算监听预算
+            WATCHERS.refresh()
+            logger.info(f"扫描完成: {path}，写入 {written} 首，删除 {deleted} 首")
+            if is_mount and (written or deleted or restored or not os.path.exists(mount_index_path(root))):
+                export_mount_index(root, path)
+            with get_db() as conn:
+                prune_library_changes(conn)
+                prune_tag_cache(conn)
+                prune_covers(conn)
+            if written or deleted:
+                # 大批量写入后刷新查询规划统计
+                DB_POOL.optimize()
+            if written or deleted or restored:
+                bump_library_version()
+            if req['scrape']:
+                self.submit_scrape(path)
+        finally:
+            with self._lock:
+                self._active_scans -= 1
+                if self._active_scans == 0:
+                    SCAN_STATUS['scanning'] = False
+                    SCAN_STATUS['current_file'] = ''
+                    SCAN_STATUS['scan_processed'] = SCAN_STATUS['scan_total']
+
+SCAN_SCHEDULER = ScanScheduler()
+
+def library_roots():
+    """曲库根目录与所有挂载目录。"""
+    roots = [os.path.abspath(MUSIC_LIBRARY_PATH)]
+    try:
+        with get_db() as conn:
+            roots.extend(os.path.abspath(r['path']) for r in conn.execute("SELECT path FROM mount_points") if r['path'])
+    except Exception as e:
+        logger.warning(f"读取挂载目录失败: {e}")
+    return list(dict.fromkeys(roots))
 
-        logger.info("扫描完成。")
-        
-        # --- 自动刮削缺失元数据 (后台独立线程) ---
-        SCAN_STATUS['is_scraping'] = True
-        SCAN_STATUS['current_file'] = "正在准备自动刮削..."
-        threading.Thread(target=auto_scrape_missing_metadata).start()
-        
-        global LIBRARY_VERSION; LIBRARY_VERSION = time.time()
-        
+def scan_library_incremental():
+    """排队扫描整个曲库：每个根目录单独排队，并清理不在任何根目录下的记录。"""
+    roots = library_roots()
+    try:
+        with get_db() as conn:
+            where, params = [], []
+            for root in roots:
+                where.append("(path >= ? AND path < ?)")
+                params.extend(path_prefix_range(root))
+            delete_songs_where(conn, f"NOT ({' OR '.join(where)})", params)
     except Exception as e:
-        logger.error(f"扫描失败: {e}")
-    finally:
-        SCAN_STATUS['scanning'] = False
-        SCAN_STATUS['current_file'] = ''
-        if os.path.exists(lock_file): 
-            try: os.remove(lock_file)
-            except: pass
+        logger.warning(f"清理曲库外记录失败: {e}")
+    for root in roots:
+        SCAN_SCHEDULER.submit_scan(root)
 
-threading.Thread(target=lambda: (init_db(), scan_library_incremental()), daemon=True).start()
+threading.Thread(target=lambda: (init_db(), scan_library_incremental(), backfill_cover_hashes(), backfill_cover_details()), daemon=True).start()
 threading.Thread(target=init_watchdog, daemon=True).start()
 
 # --- 路由定义 ---
@@ -1478,6 +3606,7 @@ def get_system_status():
     """返回当前扫描状态和进度"""
     status = dict(SCAN_STATUS)
     status['library_version'] = LIBRARY_VERSION
+    status['optional_features'] = OPTIONAL_FEATURES
 
     # 实时获取准确数量
     try:
@@ -1486,47 +3615,456 @@ def get_system_status():
             pl_cnt = conn.execute("SELECT COUNT(*) FROM favorite_playlists").fetchone()[0]
             status['music_count'] = music_cnt
             status['playlist_count'] = pl_cnt
+            status['library_seq'] = conn.execute("SELECT MAX(seq) FROM library_changes").fetchone()[0] or 0
+        status['scan_queue'] = SCAN_SCHEDULER.status()
+        status['watchers'] = WATCHERS.status()
+        status['cover_cache'] = EMBEDDED_COVERS.status()
     except Exception as e:
         logger.error(f"Error counting stats: {e}")
         pass
         
     return jsonify(status)
 
+@app.route('/api/system/scan_history', methods=['GET'])
+def get_scan_history():
+    """最近的扫描记录与分阶段统计，用于对比调优前后的扫描表现。"""
+    try:
+        limit = max(1, min(request.args.get('limit', 20, type=int), SCAN_HISTORY_KEEP))
+        with get_db() as conn:
+            rows = conn.execute("SELECT * FROM scan_history ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        data = []
+        for row in rows:
+            item = {k: row[k] for k in row.keys() if k != 'report'}
+            item['full'] = bool(item['full'])
+            try:
+                item['report'] = json.loads(row['report'] or '{}')
+            except ValueError:
+                item['report'] = {}
+            data.append(item)
+        return jsonify({'success': True, 'data': data})
+    except Exception as e:
+        logger.exception(f"获取扫描历史失败: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+# 列表可用的排序键与返回字段
+SONG_SORT_KEYS = ('title', 'artist', 'album', 'mtime', 'size')
+SONG_FIELDS = ('id', 'filename', 'title', 'artist', 'album', 'album_art', 'cover_lqip', 'cover_palette', 'mtime', 'size', 'duration')
+# 仅在 fields 参数显式指定时返回
+SONG_EXTRA_FIELDS = ('bitrate', 'sample_rate', 'codec')
+MUSIC_PAGE_MAX = 1000
+
+# 封面附加字段来自 covers 表，查询歌曲行时一并带出；未安装 Pillow 时为 null（见 optional_features），无法解码的封面为空串
+COVER_JOIN_SQL = "LEFT JOIN covers c ON c.hash = s.cover_hash"
+COVER_SELECT_SQL = "c.lqip AS cover_lqip, c.palette AS cover_palette"
+COVER_FIELDS = ('cover_lqip', 'cover_palette')
+
+# 去重：内容指纹相同的文件只显示 is_canonical 的一条，分组在写入时维护；离线挂载上的歌曲不显示
+SONG_DEDUP_SQL = 's.is_canonical = 1 AND s.offline = 0'
+
+def encode_list_cursor(sort_value, rowid):
+    raw = json.dumps([sort_value, rowid], ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_list_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    sort_value, rowid = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    return sort_value, int(rowid)
+
+def query_song_list(conn, sort='title', order='asc', cursor=None, limit=None, fields=None):
+    """按排序键读取（去重后的）歌曲列表；limit 为空时返回全部。
+
+    返回 (songs, next_cursor)。分页使用 (排序列, rowid) 键集游标，翻页代价与页码无关。
+    """
+    fields = fields or SONG_FIELDS
+    columns = {'rowid', sort} | {f for f in fields if f != 'album_art' and f not in COVER_FIELDS}
+    if 'album_art' in fields:
+        columns |= {'has_cover', 'filename', 'cover_hash'}
+    select = ', '.join(f"s.{c}" for c in sorted(columns))
+    source = "songs s"
+    if any(f in COVER_FIELDS for f in fields):
+        select += f", {COVER_SELECT_SQL}"
+        source += f" {COVER_JOIN_SQL}"
+
+    desc = order == 'desc'
+    where = [SONG_DEDUP_SQL]
+    params = []
+    if cursor:
+        sort_value, last_rowid = decode_list_cursor(cursor)
+        where.append(f"(s.{sort}, s.rowid) {'<' if desc else '>'} (?, ?)")
+        params.extend([sort_value, last_rowid])
+    direction = 'DESC' if desc else 'ASC'
+    sql = f"SELECT {select} FROM {source} WHERE {' AND '.join(where)} ORDER BY s.{sort} {direction}, s.rowid {direction}"
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit + 1)
+    rows = conn.execute(sql, params).fetchall()
+
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_list_cursor(rows[-1][sort], rows[-1]['rowid'])
+    songs = [song_row_to_dict(row, fields) for row in rows]
+    return songs, next_cursor
+
+# --- 列表响应编码 ---
+# format=json（默认，逐行对象）/ columns（列式数组，artist/album 字典编码）/ msgpack（列式 + 二进制）
+LIST_FORMATS = ('json', 'columns', 'msgpack')
+
+def msgpack_dumps(obj):
+    return msgpack.packb(obj, use_bin_type=True, default=str)
+
+def records_to_columns(records, dict_fields=('artist', 'album')):
+    """将字典列表转为列式结构；dict_fields 中的列存为字典下标，字典表放在 dicts。"""
+    columns, dicts = {}, {}
+    keys = list(records[0].keys()) if records else []
+    for key in keys:
+        values = [r.get(key) for r in records]
+        if key in dict_fields:
+            table, index, codes = [], {}, []
+            for v in values:
+                code = index.get(v)
+                if code is None:
+                    code = index[v] = len(table)
+                    table.append(v)
+                codes.append(code)
+            columns[key] = codes
+            dicts[key] = table
+        else:
+            columns[key] = values
+    return {'count': len(records), 'columns': columns, 'dicts': dicts}
+
+def list_response(records, extra=None, dict_fields=('artist', 'album')):
+    """按请求的 format 参数输出列表接口响应，data 为列表内容。"""
+    fmt = request.args.get('format', 'json')
+    if fmt not in LIST_FORMATS:
+        return jsonify({'success': False, 'error': f'不支持的格式: {fmt}'})
+    if fmt == 'msgpack' and msgpack is None:
+        return jsonify({'success': False, 'error': '服务器未安装 msgpack，请改用 format=columns'})
+    payload = {'success': True}
+    payload.update(extra or {})
+    if fmt == 'json':
+        payload['data'] = records
+        return jsonify(payload)
+
+    if records and isinstance(records[0], dict):
+        payload['format'] = 'columns'
+        payload['data'] = records_to_columns(records, dict_fields)
+    else:
+        payload['data'] = records
+    if fmt == 'columns':
+        return jsonify(payload)
+    return Response(msgpack_dumps(payload), mimetype='application/x-msgpack')
+
+# --- 曲库列表快照 ---
+class LibrarySnapshotCache:
+    """默认 /api/music 响应的预序列化、预压缩快照。
+
+    以 (LIBRARY_VERSION, 变更日志最大 seq) 作为状态键，状态不变时直接复用；
+    库版本更新时在后台线程重建，请求线程只做 ETag 比较。
+    """
+    def __init__(self):
+        self._build_lock = threading.Lock()
+        self._worker_lock = threading.Lock()
+        self._worker = None
+        self._dirty = False
+        self._snapshot = None
+
+    def _current_state(self, conn):
+        seq = conn.execute("SELECT MAX(seq) FROM library_changes").fetchone()[0] or 0
+        return (LIBRARY_VERSION, seq)
+
+    def _build(self, conn, state):
+        started = time.time()
+        songs, _ = query_song_list(conn)
+        raw = json.dumps({'success': True, 'data': songs}, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        snapshot = {
+            'state': state,
+            'etag': hashlib.sha1(raw).hexdigest(),
+            'count': len(songs),
+            'gzip': gzip.compress(raw, compresslevel=6),
+            'br': brotli.compress(raw, quality=5) if brotli else None,
+        }
+        self._snapshot = snapshot
+        logger.info(f"曲库快照已生成: {len(songs)} 首, {len(raw)} 字节, 耗时 {time.time() - started:.2f}s")
+        return snapshot
+
+    def get(self):
+        """返回与当前曲库状态一致的快照，必要时同步构建。"""
+        with get_db() as conn:
+            state = self._current_state(conn)
+            snapshot = self._snapshot
+            if snapshot and snapshot['state'] == state:
+                return snapshot
+            with self._build_lock:
+                snapshot = self._snapshot
+                if snapshot and snapshot['state'] == state:
+                    return snapshot
+                return self._build(conn, state)
+
+    def schedule_rebuild(self):
+        """在后台线程中重建快照；重建期间的多次触发会合并为一次。"""
+        with self._worker_lock:
+            self._dirty = True
+            if self._worker and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._rebuild_loop, daemon=True)
+            self._worker.start()
+
+    def _rebuild_loop(self):
+        while True:
+            with self._worker_lock:
+                if not self._dirty:
+                    self._worker = None
+                    return
+                self._dirty = False
+            try:
+                self.get()
+            except Exception as e:
+                logger.warning(f"曲库快照重建失败: {e}")
+
+LIBRARY_SNAPSHOT = LibrarySnapshotCache()
+
+def serve_library_snapshot():
+    snapshot = LIBRARY_SNAPSHOT.get()
+    accept = request.accept_encodings
+    if snapshot['br'] is not None and 'br' in accept:
+        encoding = 'br'
+    elif 'gzip' in accept:
+        encoding = 'gzip'
+    else:
+        encoding = None
+    # 不同编码的响应体不同，强 ETag 按编码区分
+    etag = f"{snapshot['etag']}-{encoding}" if encoding else snapshot['etag']
+    if etag in request.if_none_match:
+        resp = Response(status=304)
+    elif encoding:
+        resp = Response(snapshot[encoding], mimetype='application/json')
+        resp.headers['Content-Encoding'] = encoding
+    else:
+        resp = Response(gzip.decompress(snapshot['gzip']), mimetype='application/json')
+    resp.set_etag(etag)
+    resp.headers['Vary'] = 'Accept-Encoding'
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
 @app.route('/api/music', methods=['GET'])
 def get_music_list():
+    """获取音乐列表。
+
+    可选参数：sort=title|artist|album|mtime|size，order=asc|desc，
+    fields=逗号分隔的返回字段，limit/cursor 开启键集分页（不传则返回全部），
+    format=json|columns|msgpack（列式输出中 album_art 替换为 cover_hash）。
+    """
     logger.info("API请求: 获取音乐列表")
+    if not request.args:
+        # 默认完整列表走预压缩快照
+        try:
+            return serve_library_snapshot()
+        except Exception as e:
+            logger.exception(f"获取音乐列表失败: {e}")
+            return jsonify({'success': False, 'error': str(e)})
+
+    sort = request.args.get('sort', 'title')
+    if sort not in SONG_SORT_KEYS:
+        return jsonify({'success': False, 'error': f'不支持的排序键: {sort}'})
+    order = 'desc' if request.args.get('order', 'asc').lower() == 'desc' else 'asc'
+
+    fields = None
+    if request.args.get('fields'):
+        fields = tuple(f for f in request.args.get('fields').split(',') if f in SONG_FIELDS + SONG_EXTRA_FIELDS)
+        if not fields:
+            return jsonify({'success': False, 'error': 'fields 参数无有效字段'})
+
+    limit = None
+    cursor = request.args.get('cursor') or None
+    if request.args.get('limit') or cursor:
+        try:
+            limit = max(1, min(int(request.args.get('limit', 100)), MUSIC_PAGE_MAX))
+        except ValueError:
+            return jsonify({'success': False, 'error': 'limit 参数无效'})
+
     try:
         with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM songs ORDER BY title")
-            songs = []
-            seen = set()
-            
-            for row in cursor.fetchall():
-                # 去重逻辑：如果 标题+歌手+大小 完全一致，视为重复文件，仅保留第一个
-                # 这样可以解决不同目录下存放相同文件导致的列表重复问题
-                unique_key = (row['title'], row['artist'], row['size'])
-                if unique_key in seen:
-                    continue
-                seen.add(unique_key)
-                
-                album_art = None
-                if row['has_cover']:
-                    base_name = os.path.splitext(row['filename'])[0]
-                    # 封面图链接带上 filename 参数仅作缓存区分，实际通过 scan 查找
-                    album_art = f"/api/music/covers/{quote(base_name)}.jpg?filename={quote(row['filename'])}"
-                songs.append({
-                    'id': row['id'], # 新增 ID
-                    'filename': row['filename'], 'title': row['title'],
-                    'artist': row['artist'], 'album': row['album'], 'album_art': album_art,
-                    'mtime': row['mtime'], 'size': row['size']
-                })
+            try:
+                songs, next_cursor = query_song_list(conn, sort, order, cursor, limit, fields)
+            except (ValueError, TypeError, UnicodeDecodeError):
+                return jsonify({'success': False, 'error': 'cursor 参数无效'})
         logger.info(f"返回音乐数量: {len(songs)}")
-        return jsonify({'success': True, 'data': songs})
+        if request.args.get('format', 'json') != 'json':
+            # 列式输出中封面地址由哈希拼出（/api/music/covers/hash/<cover_hash>），只保留哈希
+            for song in songs:
+                if 'album_art' in song:
+                    album_art = song.pop('album_art')
+                    song['cover_hash'] = album_art[len(COVER_URL_PREFIX):] if album_art and album_art.startswith(COVER_URL_PREFIX) else None
+        extra = {'next_cursor': next_cursor} if limit else None
+        return list_response(songs, extra)
     except Exception as e:
         logger.exception(f"获取音乐列表失败: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/music/changes')
+def get_music_changes():
+    """增量同步：返回 seq > since 的新增 / 更新 / 删除歌曲。
+
+    客户端以返回的 latest_seq 作为下一次的 since；reset 为 True 时说明变更日志
+    已被裁剪，需要重新拉取完整列表。has_more 为 True 时应继续请求。
+    """
+    try:
+        since = max(0, int(request.args.get('since', 0)))
+        limit = max(1, min(int(request.args.get('limit', 5000)), 20000))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'since/limit 参数无效'})
+    try:
+        with get_db() as conn:
+            latest = conn.execute("SELECT MAX(seq) FROM library_changes").fetchone()[0] or 0
+            floor_row = conn.execute("SELECT value FROM system_settings WHERE key='library_changes_floor'").fetchone()
+            floor = int(floor_row['value']) if floor_row and floor_row['value'] else 0
+            if since < floor:
+                return jsonify({'success': True, 'reset': True, 'latest_seq': latest})
+
+            rows = conn.execute("SELECT seq, song_id, action FROM library_changes WHERE seq > ? ORDER BY seq LIMIT ?",
+                                (since, limit)).fetchall()
+            # 同一首歌在窗口内多次变更，只保留最终状态；窗口内出现过 insert 的视为新增
+            final, inserted_ids = {}, set()
+            for row in rows:
+                final[row['song_id']] = row['action']
+                if row['action'] == 'insert':
+                    inserted_ids.add(row['song_id'])
+
+            live_ids = [sid for sid, action in final.items() if action != 'delete']
+            live = {}
+            for i in range(0, len(live_ids), 500):
+                chunk = live_ids[i:i + 500]
+                marks = ','.join('?' * len(chunk))
+                for row in conn.execute(f"SELECT s.*, {COVER_SELECT_SQL}, {SONG_DEDUP_SQL} AS visible FROM songs s {COVER_JOIN_SQL} WHERE s.id IN ({marks})", chunk):
+                    live[row['id']] = row
+
+        inserted, updated, deleted = [], [], []
+        for sid, action in final.items():
+            row = live.get(sid)
+            # 已不存在或在列表中被去重隐藏的歌曲，对客户端而言等同删除
+            if action == 'delete' or row is None or not row['visible']:
+                deleted.append(sid)
+            elif sid in inserted_ids:
+                inserted.append(song_row_to_dict(row))
+            else:
+                updated.append(song_row_to_dict(row))
+
+        next_since = rows[-1]['seq'] if rows else max(since, latest)
+        return jsonify({
+            'success': True, 'reset': False,
+            'since': since, 'latest_seq': next_since, 'has_more': len(rows) >= limit,
+            'inserted': inserted, 'updated': updated, 'deleted': deleted
+        })
+    except Exception as e:
+        logger.exception(f"获取曲库变更失败: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+def song_row_to_dict(row, fields=None):
+    """将 songs 行转换为前端使用的歌曲字典，fields 指定时只返回这些字段。"""
+    fields = fields or SONG_FIELDS
+    song = {}
+    for field in fields:
+        if field == 'album_art':
+            album_art = None
+            if row['cover_hash']:
+                # 按内容哈希的地址，同一张封面的歌曲共用浏览器缓存
+                album_art = hashed_cover_url(row['cover_hash'])
+            elif row['has_cover']:
+                # 尚未补登记哈希的旧数据，按文件名找封面
+                base_name = os.path.splitext(row['filename'])[0]
+                album_art = f"/api/music/covers/{quote(base_name)}.jpg?filename={quote(row['filename'])}"
+            song['album_art'] = album_art
+        else:
+            song[field] = row[field]
+    return song
+
+def _like_pattern(term):
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+@app.route('/api/music/duplicates')
+def get_duplicate_groups():
+    """列出内容指纹相同的重复文件分组，每组第一条为列表中显示的那条。"""
+    try:
+        limit = max(1, min(int(request.args.get('limit', 100)), 500))
+        offset = max(0, int(request.args.get('offset', 0)))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'limit/offset 参数无效'})
+    try:
+        with get_db() as conn:
+            total = conn.execute("SELECT COUNT(DISTINCT duplicate_group) FROM songs WHERE duplicate_group IS NOT NULL").fetchone()[0]
+            groups = [r[0] for r in conn.execute(
+                "SELECT duplicate_group FROM songs WHERE duplicate_group IS NOT NULL GROUP BY duplicate_group ORDER BY COUNT(*) DESC, duplicate_group LIMIT ? OFFSET ?",
+                (limit, offset))]
+            data = []
+            for group in groups:
+                songs = []
+                for row in conn.execute(f"SELECT s.*, {COVER_SELECT_SQL} FROM songs s {COVER_JOIN_SQL} WHERE s.duplicate_group=? ORDER BY s.is_canonical DESC, s.rowid", (group,)):
+                    song = song_row_to_dict(row)
+                    song.update({'path': row['path'], 'is_canonical': bool(row['is_canonical'])})
+                    songs.append(song)
+                data.append({'group': group, 'count': len(songs), 'songs': songs})
+        return jsonify({'success': True, 'data': data, 'total': total, 'offset': offset, 'limit': limit})
+    except Exception as e:
+        logger.exception(f"获取重复文件分组失败: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/music/search')
+def search_music():
+    """本地曲库全文搜索（标题/歌手/专辑/文件名，繁简与大小写不敏感）。"""
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return jsonify({'success': False, 'error': '请输入搜索关键词'})
+    try:
+        limit = max(1, min(int(request.args.get('limit', 50)), 200))
+    except Exception:
+        limit = 50
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+    except Exception:
+        offset = 0
+
+    terms = [t for t in fold_text(query).split() if t]
+    # trigram 分词要求至少 3 个字符，更短的词退回 LIKE 过滤
+    long_terms = [t for t in terms if len(t) >= 3]
+    short_terms = [t for t in terms if len(t) < 3]
+
+    try:
+        with get_db() as conn:
+            where, params = [], []
+            if SEARCH_INDEX_ENABLED:
+                source = "songs_fts f JOIN songs s ON s.rowid = f.rowid"
+                like_cols = ('f.title_fold', 'f.artist_fold', 'f.album_fold', 'f.filename_fold')
+                if long_terms:
+                    where.append("songs_fts MATCH ?")
+                    params.append(' AND '.join('"' + t.replace('"', '""') + '"' for t in long_terms))
+                    like_terms = short_terms
+                else:
+                    like_terms = terms
+                order = f"bm25(songs_fts, {', '.join(str(w) for w in SEARCH_INDEX_WEIGHTS)})" if long_terms else "s.title"
+            else:
+                source = "songs s"
+                like_cols = ('s.title', 's.artist', 's.album', 's.filename')
+                like_terms = [t.lower() for t in query.split() if t]
+                order = "s.title"
+
+            for term in like_terms:
+                pattern = _like_pattern(term)
+                where.append('(' + ' OR '.join(f"{col} LIKE ? ESCAPE '\\'" for col in like_cols) + ')')
+                params.extend([pattern] * len(like_cols))
+
+            where.append(SONG_DEDUP_SQL)
+            sql = f"SELECT s.*, {COVER_SELECT_SQL} FROM {source} {COVER_JOIN_SQL} WHERE {' AND '.join(where)} ORDER BY {order} LIMIT ? OFFSET ?"
+            rows = conn.execute(sql, (*params, limit + 1, offset)).fetchall()
+
+        has_more = len(rows) > limit
+        songs = [song_row_to_dict(row) for row in rows[:limit]]
+        return jsonify({'success': True, 'data': songs, 'offset': offset, 'limit': limit, 'has_more': has_more})
+    except Exception as e:
+        logger.exception(f"搜索音乐失败: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/api/music/play/<song_id>')
 def play_music(song_id):
     try:
@@ -1547,6 +4085,52 @@ def play_music(song_id):
     logger.warning(f"文件未找到或ID无效: {song_id}")
     return jsonify({'error': 'Not Found'}), 404
 
+@app.route('/api/mount_points/storage', methods=['GET'])
+def get_mount_storage():
+    """查看目录的存储类型检测结果与生效的扫描并发配置。"""
+    path = request.args.get('path') or MUSIC_LIBRARY_PATH
+    try:
+        path = os.path.abspath(path)
+        return jsonify({'success': True, 'data': {**storage_profile(path), 'override': _storage_override(path)}})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/mount_points/storage', methods=['POST'])
+def set_mount_storage():
+    """保存目录的存储类型/并发/监听方式覆盖配置，全部为空时清除覆盖。"""
+    try:
+        data = request.json or {}
+        path = data.get('path')
+        if not path:
+            return jsonify({'success': False, 'error': '未指定路径'})
+        path = os.path.abspath(path)
+        override = {}
+        if data.get('class'):
+            if data['class'] not in STORAGE_PROFILES:
+                return jsonify({'success': False, 'error': f"不支持的存储类型: {data['class']}"})
+            override['class'] = data['class']
+        for key in ('walk_threads', 'workers'):
+            if data.get(key):
+                try:
+                    override[key] = max(1, int(data[key]))
+                except (TypeError, ValueError):
+                    return jsonify({'success': False, 'error': f'{key} 必须为正整数'})
+        if data.get('watch'):
+            if data['watch'] not in WATCH_BACKENDS:
+                return jsonify({'success': False, 'error': f"不支持的监听方式: {data['watch']}"})
+            override['watch'] = data['watch']
+        with get_db() as conn:
+            if override:
+                conn.execute("INSERT OR REPLACE INTO system_settings (key, value) VALUES (?, ?)",
+                             (STORAGE_SETTING_PREFIX + path, json.dumps(override)))
+            else:
+                conn.execute("DELETE FROM system_settings WHERE key=?", (STORAGE_SETTING_PREFIX + path,))
+            conn.commit()
+        refresh_watchdog_paths()
+        return jsonify({'success': True, 'data': storage_profile(path)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
 # --- 目录相关 ---
 @app.route('/api/mount_points', methods=['GET'])
 def list_mount_points():
@@ -1587,9 +4171,9 @@ def add_mount_point():
             conn.execute("INSERT INTO mount_points (path, created_at) VALUES (?, ?)", (path, time.time()))
             conn.commit()
 
-        # 刷新监听并触发扫描
+        # 刷新监听并只扫描新增的目录
         refresh_watchdog_paths()
-        threading.Thread(target=scan_library_incremental, daemon=True).start()
+        SCAN_SCHEDULER.submit_scan(path)
         
         return jsonify({'success': True, 'message': '目录已添加，正在后台处理...'})
     except Exception as e:
@@ -1600,16 +4184,22 @@ def add_mount_point():
 def remove_mount_point():
     try:
         path = request.json.get('path')
+        if MOUNT_INDEX_ENABLED and mount_available(path):
+            # 移除前保存最新索引，目录再次添加时无需重新解析
+            export_mount_index(os.path.abspath(path))
         with get_db() as conn:
-            # 清理该路径下的歌曲
-            conn.execute("DELETE FROM songs WHERE path LIKE ? || '%'", (path,))
+            # 清理该路径下的歌曲、目录快照与存储配置
+            lo, hi = path_prefix_range(path)
+            delete_songs_where(conn, "path >= ? AND path < ?", (lo, hi))
+            conn.execute("DELETE FROM scan_dirs WHERE path = ? OR (path >= ? AND path < ?)", (path.rstrip(os.sep), lo, hi))
+            conn.execute("DELETE FROM system_settings WHERE key=?", (STORAGE_SETTING_PREFIX + path,))
             conn.execute("DELETE FROM mount_points WHERE path=?", (path,))
             conn.commit()
             
         refresh_watchdog_paths()
         
         # 触发一次库版本更新
-        global LIBRARY_VERSION; LIBRARY_VERSION = time.time()
+        bump_library_version()
             
         return jsonify({'success': True, 'message': '已移除'})
     except Exception as e: return jsonify({'success': False, 'error': str(e)})
@@ -2019,9 +4609,19 @@ def get_lyrics_api():
         except Exception as e:
             logger.warning(f"读取本地歌词失败: {lrc_path}, 错误: {e}")
 
-    # 2. 尝试提取内嵌歌词
+    # 2. 尝试提取内嵌歌词（扫描时已入库，NULL 表示尚未解析）
     if actual_path:
-        embedded_lrc = extract_embedded_lyrics(actual_path)
+        embedded_lrc = None
+        row = None
+        try:
+            with get_db() as conn:
+                row = conn.execute("SELECT lyrics FROM songs WHERE path=?", (actual_path,)).fetchone()
+        except Exception as e:
+            logger.warning(f"查询内嵌歌词失败: {e}")
+        if row and row['lyrics'] is not None:
+            embedded_lrc = row['lyrics'] or None
+        else:
+            embedded_lrc = extract_embedded_lyrics(actual_path)
         if embedded_lrc:
             # Save to cache if possible
             try:
@@ -2076,48 +4676,50 @@ def get_album_art_api():
     
     if not title or not filename: return jsonify({'success': False})
     filename = unquote(filename)
-    base_name = os.path.splitext(os.path.basename(filename))[0]
-    
-    local_path = os.path.join(MUSIC_LIBRARY_PATH, 'covers', f"{base_name}.jpg")
-    if os.path.exists(local_path):
-        return jsonify({'success': True, 'album_art': f"/api/music/covers/{quote(base_name)}.jpg?filename={quote(base_name)}"})
 
-    # 优先尝试从音频内嵌封面提取
-    actual_path = None
+    # 找到对应的音频文件：绝对路径直接使用，否则按文件名查库
+    actual_path, song_row = None, None
+    try:
+        with get_db() as conn:
+            if os.path.isabs(filename):
+                song_row = conn.execute("SELECT id, path, cover_hash FROM songs WHERE path=?", (filename,)).fetchone()
+            else:
+                song_row = conn.execute("SELECT id, path, cover_hash FROM songs WHERE filename=?", (os.path.basename(filename),)).fetchone()
+    except Exception as e:
+        logger.warning(f"查询歌曲路径失败: {e}")
     if os.path.isabs(filename) and os.path.exists(filename):
         actual_path = filename
-    else:
-        try:
-            with get_db() as conn:
-                row = conn.execute("SELECT path FROM songs WHERE filename=?", (os.path.basename(filename),)).fetchone()
-                if row and os.path.exists(row['path']):
-                    actual_path = row['path']
-        except Exception as e:
-            logger.warning(f"查询歌曲路径失败: {e}")
+    elif song_row and os.path.exists(song_row['path']):
+        actual_path = song_row['path']
 
-    if actual_path and extract_embedded_cover(actual_path, base_name):
-        try:
-            if not os.path.isabs(filename):
+    def found(cover_hash):
+        if song_row:
+            try:
                 with get_db() as conn:
-                    conn.execute("UPDATE songs SET has_cover=1 WHERE filename=?", (os.path.basename(filename),))
+                    set_song_cover_flag(conn, "id=?", (song_row['id'],), 1, cover_hash)
                     conn.commit()
-        except Exception:
-            pass
-        return jsonify({'success': True, 'album_art': f"/api/music/covers/{quote(base_name)}.jpg?filename={quote(base_name)}"})
+            except Exception:
+                pass
+        return jsonify({'success': True, 'album_art': hashed_cover_url(cover_hash)})
+
+    # 已有的同名 .jpg 或登记过的封面，其次从音频内嵌封面提取
+    if actual_path:
+        has_cover, cover_hash = song_cover_state(actual_path, song_row['cover_hash'] if song_row else None)
+        cover_hash = cover_hash if has_cover else extract_embedded_cover(actual_path)
+        if cover_hash:
+            return found(cover_hash)
 
     # 网络获取并保存 - Use integrated LrcApi
     try:
         logger.info(f"本地调用 LrcApi 搜索封面: title={title}, artist={artist}")
         result = mod.search_all(title=title, artist=artist, album='')
-        cover_url = result.get('cover') if result and result.get('cover') else None
-        if cover_url:
-            logger.info(f"LrcApi 找到封面 URL: {cover_url}")
+        remote_url = result.get('cover') if result and result.get('cover') else None
+        if remote_url:
+            logger.info(f"LrcApi 找到封面 URL: {remote_url}")
             try:
-                resp = requests.get(cover_url, timeout=10, headers=COMMON_HEADERS)
+                resp = requests.get(remote_url, timeout=10, headers=COMMON_HEADERS)
                 if resp.status_code == 200 and resp.headers.get('content-type', '').startswith('image/'):
-                    with open(local_path, 'wb') as f: 
-                        f.write(resp.content)
-                    return jsonify({'success': True, 'album_art': f"/api/music/covers/{quote(base_name)}.jpg?filename={quote(base_name)}"})
+                    return found(store_cover(resp.content))
                 else:
                     logger.warning(f"封面下载失败: {resp.status_code}")
             except Exception as dl_err:
@@ -2165,15 +4767,9 @@ def delete_file(song_id):
                 if os.path.exists(base + ext): os.remove(base + ext)
             except: pass
             
-        # 尝试清理主库下的 covers/lyrics
+        # 尝试清理主库下的歌词；封面按内容哈希共用，不再被引用时由扫描后的回收清理
         filename = os.path.basename(target_path)
         base_name = os.path.splitext(filename)[0]
-        
-        # 清理封面
-        try:
-             cv_path = os.path.join(MUSIC_LIBRARY_PATH, 'covers', base_name + '.jpg')
-             if os.path.exists(cv_path): os.remove(cv_path)
-        except: pass
 
         # 清理歌词 (.lrc / .yrc)
         for lext in ['.lrc', '.yrc']:
@@ -2184,7 +4780,7 @@ def delete_file(song_id):
         
         # 4. 数据库清理 (Watchdog 也会做，但双重保障)
         with get_db() as conn:
-            conn.execute("DELETE FROM songs WHERE path=?", (target_path,))
+            delete_song_paths(conn, [target_path])
             conn.commit()
             
         return jsonify({'success': True})
@@ -2245,7 +4841,7 @@ def clear_metadata(song_id=None):
         # 如果是库内文件（有song_id），还需要重置数据库状态
         if song_id:
             with get_db() as conn:
-                conn.execute("UPDATE songs SET has_cover=0 WHERE id=?", (song_id,))
+                set_song_cover_flag(conn, "id=?", (song_id,), 0)
                 conn.commit()
             
         logger.info(f"元数据已清除: {filename}, ID: {song_id}, 删除数: {deleted_count}")
@@ -2271,20 +4867,63 @@ def get_cover(cover_name):
             logger.warning(f"非法的封面请求路径: {path}")
             return jsonify({'error': 'Not found'}), 404
 
-        # 3. 返回文件
+        # 3. 返回文件；指定 size 时返回对应尺寸的缩略图
         if os.path.exists(path):
             try:
-                return send_file(path, mimetype='image/jpeg')
+                return _send_cover(path)
             except Exception:
                 # 记录详细异常以便排查 send_file 导致的错误
                 logger.exception(f"发送封面文件失败: {path}")
                 return jsonify({'error': 'Internal Server Error'}), 500
 
+        # 4. 旧地址按文件名找到歌曲，转到按哈希的地址（同名 .jpg 与内嵌封面都由此提供）
+        filename = request.args.get('filename') or os.path.splitext(cover_name)[0]
+        names = [filename] if os.path.splitext(filename)[1].lower() in AUDIO_EXTS else [filename + ext for ext in AUDIO_EXTS]
+        with get_db() as conn:
+            row = conn.execute(f"SELECT path, cover_hash FROM songs WHERE filename IN ({','.join('?' * len(names))}) ORDER BY is_canonical DESC, offline LIMIT 1",
+                               names).fetchone()
+        if row:
+            has_cover, cover_hash = song_cover_state(row['path'], row['cover_hash'])
+            if has_cover:
+                size = request.args.get('size', type=int)
+                return redirect(hashed_cover_url(cover_hash) + (f"?size={size}" if size else ''))
         return jsonify({'error': 'Not found'}), 404
     except Exception:
         logger.exception(f"处理封面请求失败: {cover_name}")
         return jsonify({'error': 'Internal Server Error'}), 500
 
+@app.route('/api/music/covers/hash/<cover_hash>')
+def get_cover_by_hash(cover_hash):
+    """按内容哈希返回封面：地址对应的内容不会变化，允许浏览器长期缓存。"""
+    if not re.fullmatch(r'[0-9a-f]{40}', cover_hash):
+        return jsonify({'error': 'Not found'}), 404
+    try:
+        path = resolve_cover(cover_hash)
+        if not path:
+            return jsonify({'error': 'Not found'}), 404
+        response = _send_cover(path, cover_hash)
+        response.headers['Cache-Control'] = f"public, max-age={COVER_CACHE_MAX_AGE}, immutable"
+        return response
+    except Exception:
+        logger.exception(f"发送封面文件失败: {cover_hash}")
+        return jsonify({'error': 'Internal Server Error'}), 500
+
+def _send_cover(path, cover_hash=None):
+    """发送封面文件，?size= 指定时返回对应尺寸的缩略图（Accept 支持时为 WebP）。
+
+    给出 cover_hash 时使用由哈希与尺寸组成的强 ETag，内容相同的请求直接返回 304。
+    """
+    size = request.args.get('size', type=int)
+    if size:
+        webp = 'image/webp' in request.headers.get('Accept', '')
+        variant = cover_variant(path, size, webp, cover_hash)
+        if variant:
+            response = send_file(variant, mimetype='image/webp' if variant.endswith('.webp') else 'image/jpeg',
+                                 etag=os.path.basename(variant) if cover_hash else True)
+            response.headers['Vary'] = 'Accept'
+            return response
+    return send_file(path, mimetype=cover_mimetype(path), etag=cover_hash or True)
+
 @app.route('/api/music/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files: return jsonify({'success': False, 'error': '未收到文件'})
@@ -2363,8 +5002,11 @@ def import_music_by_path():
             # 立即索引，确保入库
             index_single_file(dst_path)
         
-        # 计算预期的 ID (与扫描逻辑一致)
+        # 以入库后的实际 ID 为准（内容指纹 ID 或路径 ID）
         song_id = generate_song_id(dst_path)
+        with get_db() as conn:
+            row = conn.execute("SELECT id FROM songs WHERE path=?", (os.path.abspath(dst_path),)).fetchone()
+            if row: song_id = row['id']
         return jsonify({'success': True, 'id': song_id, 'filename': filename})
     except Exception as e: return jsonify({'success': False, 'error': str(e)})
 
@@ -2387,7 +5029,7 @@ def get_favorite_playlists():
             # 将Row对象转换为字典
             playlists = [dict(row) for row in rows]
             logger.info(f"获取收藏夹成功，共 {len(playlists)} 个收藏夹")
-            return jsonify({'success': True, 'data': playlists})
+            return list_response(playlists, dict_fields=())
     except Exception as e:
         logger.error(f"获取收藏夹失败: {e}")
         return jsonify({'success': False, 'error': str(e)})
@@ -2456,7 +5098,7 @@ def get_playlist_songs(playlist_id):
             rows = conn.execute("SELECT song_id FROM favorites WHERE playlist_id=?", (playlist_id,)).fetchall()
             song_ids = [r['song_id'] for r in rows]
             logger.info(f"获取收藏夹歌曲成功，收藏夹ID: {playlist_id}，共 {len(song_ids)} 首歌曲")
-            return jsonify({'success': True, 'data': song_ids})
+            return list_response(song_ids)
     except Exception as e:
         logger.error(f"获取收藏夹歌曲失败，收藏夹ID: {playlist_id}, 错误: {e}")
         return jsonify({'success': False, 'error': str(e)})
@@ -2518,7 +5160,7 @@ def get_favorites():
             rows = conn.execute("SELECT DISTINCT song_id FROM favorites").fetchall()
             song_ids = [r['song_id'] for r in rows]
             logger.info(f"获取所有收藏夹歌曲成功，共 {len(song_ids)} 首歌曲")
-            return jsonify({'success': True, 'data': song_ids})
+            return list_response(song_ids)
     except Exception as e:
         logger.error(f"获取所有收藏夹歌曲失败: {e}")
         return jsonify({'success': False, 'error': str(e)})
@@ -2790,7 +5432,7 @@ def search_netease_music():
                 'downloadable': (not is_vip) or matched,
                 'matched': matched
             })
-        return jsonify({'success': True, 'data': songs})
+        return list_response(songs)
     except Exception as e:
         logger.warning(f"网易云搜索失败: {e}")
         return jsonify({'success': False, 'error': '搜索失败，请检查网易云 API 服务'})
@@ -2804,7 +5446,7 @@ def netease_daily_recommend():
             return jsonify({'success': False, 'error': '需要登录以获取每日推荐'})
         daily = (api_resp.get('data') or {}).get('dailySongs', []) if isinstance(api_resp, dict) else []
         songs = _format_netease_songs(daily)
-        return jsonify({'success': True, 'data': songs})
+        return list_response(songs)
     except Exception as e:
         logger.warning(f"获取每日推荐失败: {e}")
         return jsonify({'success': False, 'error': '获取每日推荐失败，请检查登录状态或 API 服务'})
@@ -3178,8 +5820,6 @@ def run_download_task(task_id, payload):
             # Cover
             if cover_bytes: 
                 embed_cover_to_file(file_path, cover_bytes)
-                if fname:
-                    save_cover_file(cover_bytes, os.path.splitext(fname)[0])
             
             # Lyrics
             lrc, _ = fetch_netease_lyrics(song_id)
@@ -3191,6 +5831,7 @@ def run_download_task(task_id, payload):
             
         # 5. Index
         index_single_file(file_path)
+        attach_cover_if_missing(file_path, store_cover(cover_bytes))
         
         DOWNLOAD_TASKS[task_id]['status'] = 'success'
         
@@ -3209,9 +5850,9 @@ def netease_resolve():
     try:
         if parsed_input['type'] == 'playlist':
             songs, name = _fetch_playlist_songs(parsed_input['id'])
-            return jsonify({'success': True, 'type': 'playlist', 'id': parsed_input['id'], 'name': name, 'data': songs})
+            return list_response(songs, {'type': 'playlist', 'id': parsed_input['id'], 'name': name})
         songs = _fetch_song_detail(parsed_input['id'])
-        return jsonify({'success': True, 'type': 'song', 'id': parsed_input['id'], 'data': songs})
+        return list_response(songs, {'type': 'song', 'id': parsed_input['id']})
     except Exception as e:
         logger.warning(f"解析网易云链接失败: {e}")
         return jsonify({'success': False, 'error': '解析失败，请确认歌曲或歌单链接有效'})
@@ -3225,7 +5866,7 @@ def netease_playlist_detail():
         return jsonify({'success': False, 'error': '缺少歌单链接或无法识别'})
     try:
         songs, name = _fetch_playlist_songs(parsed_input['id'])
-        return jsonify({'success': True, 'name': name, 'id': parsed_input['id'], 'data': songs})
+        return list_response(songs, {'name': name, 'id': parsed_input['id']})
     except Exception as e:
         logger.warning(f"歌单获取失败: {e}")
         return jsonify({'success': False, 'error': '获取歌单失败'})
@@ -3459,7 +6100,6 @@ def run_download_task(task_id, payload):
         base_name_for_cover = os.path.splitext(os.path.basename(target_path))[0]
         if cover_bytes:
             embed_cover_to_file(target_path, cover_bytes)
-            save_cover_file(cover_bytes, base_name_for_cover)
         # 保存并内嵌歌词（无需登录）
         lrc_text, yrc_text = fetch_netease_lyrics(song_id)
         if lrc_text:
@@ -3478,6 +6118,7 @@ def run_download_task(task_id, payload):
             except Exception as e:
                 logger.warning(f"保存逐字歌词失败: {e}")
         index_single_file(target_path)
+        attach_cover_if_missing(target_path, store_cover(cover_bytes))
         
         DOWNLOAD_TASKS[task_id]['status'] = 'success'
         DOWNLOAD_TASKS[task_id]['progress'] = 100
@@ -3508,16 +6149,15 @@ def get_external_meta():
     try:
         meta = get_metadata(path)
         song_id = generate_song_id(path)
-        album_art = None
-        base_name = os.path.splitext(os.path.basename(path))[0]
-        cached_cover = os.path.join(MUSIC_LIBRARY_PATH, 'covers', f"{base_name}.jpg")
-        cached_cover = os.path.join(MUSIC_LIBRARY_PATH, 'covers', f"{base_name}.jpg")
-        if os.path.exists(cached_cover): album_art = f"/api/music/covers/{quote(base_name)}.jpg?filename={quote(base_name)}"
         
         in_library = False
         with get_db() as conn:
-             if conn.execute("SELECT 1 FROM songs WHERE id=?", (song_id,)).fetchone():
+             row = conn.execute("SELECT id, cover_hash FROM songs WHERE path=?", (path,)).fetchone()
+             if row:
+                 song_id = row['id']
                  in_library = True
+        has_cover, cover_hash = song_cover_state(path, row['cover_hash'] if row else None)
+        album_art = hashed_cover_url(cover_hash) if has_cover else None
 
         return jsonify({'success': True, 'data': {'id': song_id, 'filename': path, 'title': meta['title'] or os.path.basename(path), 'artist': meta['artist'] or '未知艺术家', 'album': meta['album'] or '', 'album_art': album_art, 'in_library': in_library}})
     except Exception as e: return jsonify({'success': False, 'error': str(e)})
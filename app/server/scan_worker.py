@@ -0,0 +1,196 @@
+"""扫描提取子进程：解析音频标签与内容指纹。
+
+本模块不导入 app.py，主进程直接调用其中的函数（线程模式），
+或以独立解释器运行本文件作为常驻提取进程（进程模式），通过标准输入输出交换 pickle 消息。
+"""
+import base64
+import hashlib
+import logging
+import os
+import pickle
+import signal
+import sys
+import time
+
+if not getattr(sys, 'frozen', False):
+    # 单独运行时同样从 lib 加载依赖
+    _LIB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib')
+    if _LIB_DIR not in sys.path:
+        sys.path.insert(0, _LIB_DIR)
+
+from mutagen import File
+from mutagen.id3 import ID3
+from mutagen.flac import Picture
+
+logger = logging.getLogger(__name__)
+
+# 各标签格式中对应字段的键名：ID3 / Vorbis / MP4 / ASF / APEv2
+TAG_KEYS = {
+    'title': ('TIT2', 'title', '\xa9nam', 'Title'),
+    'artist': ('TPE1', 'artist', '\xa9ART', 'Author', 'Artist'),
+    'album': ('TALB', 'album', '\xa9alb', 'WM/AlbumTitle', 'Album'),
+    'lyrics': ('lyrics', 'unsyncedlyrics', '\xa9lyr', 'WM/Lyrics', 'Lyrics'),
+}
+
+def _tag_text(tags, keys):
+    for key in keys:
+        try:
+            val = tags.get(key)
+        except Exception:
+            continue
+        if val is None:
+            continue
+        # ID3 帧的值在 .text 中
+        if hasattr(val, 'text') and not isinstance(val, str):
+            val = val.text
+        if isinstance(val, (list, tuple)):
+            val = val[0] if val else None
+        # 确保返回值是字符串类型，处理ASFUnicodeAttribute等特殊类型
+        if val is not None:
+            val = str(val).strip()
+        if val:
+            return val
+    return None
+
+def _tag_cover(audio, tags):
+    # MP3 / ID3：优先封面类型的图片
+    if isinstance(tags, ID3):
+        pics = tags.getall('APIC')
+        front = [p for p in pics if p.type == 3 and p.data]
+        pics = front or [p for p in pics if p.data]
+        return pics[0].data if pics else None
+    # FLAC
+    pics = getattr(audio, 'pictures', None)
+    if pics:
+        return pics[0].data
+    if not tags:
+        return None
+    try:
+        # MP4
+        covr = tags.get('covr')
+        if covr:
+            return bytes(covr[0] if isinstance(covr, (list, tuple)) else covr)
+        # Ogg Vorbis / Opus
+        block = tags.get('metadata_block_picture')
+        if block:
+            return Picture(base64.b64decode(block[0])).data
+        # APEv2：文件名 + \0 + 图片数据
+        ape = tags.get('Cover Art (Front)')
+        if ape is not None and hasattr(ape, 'value'):
+            return ape.value.split(b'\x00', 1)[-1] or None
+    except Exception:
+        pass
+    return None
+
+def _tag_lyrics(tags):
+    if isinstance(tags, ID3):
+        for frame in tags.getall('USLT'):
+            if frame.text:
+                return frame.text
+        return None
+    return _tag_text(tags, TAG_KEYS['lyrics'])
+
+def read_audio_tags(file_path):
+    """单次解析音频文件，返回元数据、内嵌封面字节、内嵌歌词与音频流信息。"""
+    result = {'title': None, 'artist': None, 'album': None, 'cover': None, 'lyrics': None,
+              'duration': None, 'bitrate': None, 'sample_rate': None, 'codec': ''}
+    try:
+        audio = File(file_path)
+        # 无标签时 FileType 的布尔值为 False，需显式判断 None
+        if audio is not None:
+            tags = audio.tags
+            if tags:
+                for key in ('title', 'artist', 'album'):
+                    result[key] = _tag_text(tags, TAG_KEYS[key])
+                result['lyrics'] = _tag_lyrics(tags)
+            result['cover'] = _tag_cover(audio, tags)
+            info = getattr(audio, 'info', None)
+            if info:
+                result['duration'] = getattr(info, 'length', None)
+                result['bitrate'] = getattr(info, 'bitrate', None) or None
+                result['sample_rate'] = getattr(info, 'sample_rate', None)
+                result['codec'] = getattr(info, 'codec', None) or type(audio).__name__.lower()
+    except Exception as e:
+        logger.warning(f"文件 {file_path} 元数据解析异常: {e}")
+    filename = os.path.splitext(os.path.basename(file_path))[0]
+    if not result['title']:
+        if ' - ' in filename:
+            parts = filename.split(' - ', 1)
+            if not result['artist']: result['artist'] = parts[0].strip()
+            result['title'] = parts[1].strip()
+        else:
+            result['title'] = filename
+    if not result['artist']: result['artist'] = "未知艺术家"
+    return result
+
+FINGERPRINT_BLOCK = 64 * 1024
+
+def compute_fingerprint(file_path):
+    """内容指纹：文件大小 + 首尾各 64KB 的 MD5，用于识别移动与重复文件。"""
+    h = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        h.update(str(size).encode('ascii'))
+        h.update(f.read(FINGERPRINT_BLOCK))
+        if size > FINGERPRINT_BLOCK * 2:
+            f.seek(-FINGERPRINT_BLOCK, os.SEEK_END)
+        h.update(f.read(FINGERPRINT_BLOCK))
+    return h.hexdigest()
+
+def parse_batch(paths, thumb_dir=None):
+    """解析一批文件，返回 (结果列表, 统计)，统计格式与 ScanProfiler.export 一致。
+
+    结果为 (tags, fingerprint, cover_hash)，失败为 None；
+    内嵌封面已在 thumb_dir 登记过时不回传字节（tags['cover'] 置空），只回传哈希。
+    """
+    phases, counters = {}, {}
+
+    def timed(name, func, *a):
+        start = time.perf_counter()
+        try:
+            return func(*a)
+        finally:
+            entry = phases.setdefault(name, [0.0, 0])
+            entry[0] += time.perf_counter() - start
+            entry[1] += 1
+
+    def add(name, n=1):
+        counters[name] = counters.get(name, 0) + n
+
+    results = []
+    for path in paths:
+        try:
+            tags = timed('parse', read_audio_tags, path)
+            size = os.path.getsize(path)
+            add('files_parsed')
+            add('parsed_file_bytes', size)
+            cover_hash = None
+            if tags['cover']:
+                cover_hash = hashlib.sha1(tags['cover']).hexdigest()
+                if thumb_dir and all(os.path.exists(os.path.join(thumb_dir, cover_hash + ext)) for ext in ('.json', '.embedded')):
+                    tags['cover'] = None
+            fingerprint = timed('fingerprint', compute_fingerprint, path)
+            add('fingerprint_bytes', min(size, 2 * FINGERPRINT_BLOCK))
+            results.append((tags, fingerprint, cover_hash))
+        except Exception as e:
+            logger.warning(f"提取元数据失败: {path}, 错误: {e}")
+            add('files_failed')
+            results.append(None)
+    return results, {'phases': phases, 'counters': counters}
+
+def serve(inp, out):
+    """逐条读取 (paths, thumb_dir) 请求并回传 parse_batch 的结果，输入关闭时退出。"""
+    while True:
+        try:
+            paths, thumb_dir = pickle.load(inp)
+        except EOFError:
+            return
+        pickle.dump(parse_batch(paths, thumb_dir), out, protocol=pickle.HIGHEST_PROTOCOL)
+        out.flush()
+
+if __name__ == '__main__':
+    # 中断由主进程处理；标准输出留作消息通道，其余输出改到 stderr
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    channel = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    serve(sys.stdin.buffer, channel)
@@ -0,0 +1,41 @@
+import os
+import sqlite3
+import sys
+import tempfile
+
+# 从版本化迁移之前的旧库升级，收藏、挂载目录与设置必须保留（歌曲由启动扫描按磁盘重新核对，不在此检查）
+library = tempfile.mkdtemp(prefix='2fmusic-upgrade-')
+conn = sqlite3.connect(os.path.join(library, 'data.db'))
+conn.executescript('''
+    CREATE TABLE songs (id TEXT PRIMARY KEY, path TEXT UNIQUE, filename TEXT, title TEXT, artist TEXT,
+                        album TEXT, mtime REAL, size INTEGER, has_cover INTEGER DEFAULT 0);
+    CREATE TABLE favorite_playlists (id TEXT PRIMARY KEY, name TEXT NOT NULL, is_default INTEGER DEFAULT 0, created_at REAL);
+    CREATE TABLE favorites (song_id TEXT, playlist_id TEXT, title TEXT DEFAULT '', artist TEXT DEFAULT '',
+                            created_at REAL, PRIMARY KEY (song_id, playlist_id));
+    CREATE TABLE mount_points (path TEXT PRIMARY KEY, created_at REAL);
+    CREATE TABLE system_settings (key TEXT PRIMARY KEY, value TEXT);
+''')
+song = os.path.join(library, 'Artist - Song.mp3')
+conn.execute("INSERT INTO songs VALUES ('s1', ?, 'Artist - Song.mp3', 'Song', 'Artist', '', 1, 1, 0)", (song,))
+conn.execute("INSERT INTO favorite_playlists VALUES ('default', '默认收藏夹', 1, 1)")
+conn.execute("INSERT INTO favorites VALUES ('s1', 'default', 'Song', 'Artist', 1)")
+conn.execute("INSERT INTO mount_points VALUES ('/mnt/music', 1)")
+conn.execute("INSERT INTO system_settings VALUES ('theme', 'dark')")
+conn.commit()
+conn.close()
+
+sys.argv = ['app.py', '--music-library-path', library, '--log-path', os.path.join(library, 'app.log')]
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app
+
+app.init_db()
+with app.get_db() as conn:
+    version = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0]
+    counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for table in ('favorites', 'mount_points', 'system_settings')}
+
+print(f"\n[db_upgrade] 结构版本 v{version}，保留数据：{counts}")
+assert version == app.SCHEMA_MIGRATIONS[-1][0], version
+assert counts == {'favorites': 1, 'mount_points': 1, 'system_settings': 1}, counts
+print("[db_upgrade] 通过")
+os._exit(0)
@@ -235,6 +235,25 @@ export const api = {
         throw error;
       }
     },
+    async page({ sort = 'title', order = 'asc', limit = 100, cursor = '', fields = '' } = {}) {
+      const params = new URLSearchParams({ sort, order, limit });
+      if (cursor) params.set('cursor', cursor);
+      if (fields) params.set('fields', fields);
+      const res = await fetch(`/api/music?${params}`);
+      return jsonOrThrow(res);
+    },
+    async changes(since = 0) {
+      const res = await fetch(`/api/music/changes?since=${since}`);
+      return jsonOrThrow(res);
+    },
+    async search(q, limit = 50, offset = 0) {
+      const res = await fetch(`/api/music/search?q=${encodeURIComponent(q)}&limit=${limit}&offset=${offset}`);
+      return jsonOrThrow(res);
+    },
+    async duplicates(limit = 100, offset = 0) {
+      const res = await fetch(`/api/music/duplicates?limit=${limit}&offset=${offset}`);
+      return jsonOrThrow(res);
+    },
     async deleteFile(filename) {
       const encodedName = encodeURIComponent(filename);
       const res = await fetch(`/api/music/delete/${encodedName}`, { method: 'DELETE' });
@@ -339,6 +358,10 @@ export const api = {
       const res = await fetch('/api/system/status');
       return jsonOrThrow(res);
     },
+    async scanHistory(limit = 20) {
+      const res = await fetch(`/api/system/scan_history?limit=${limit}`);
+      return jsonOrThrow(res);
+    },
     async versionCheck(forceRefresh = true) {
       const res = await fetch(`/api/version_check?force_refresh=${forceRefresh}`);
       return jsonOrThrow(res);
@@ -380,6 +403,18 @@ export const api = {
         body: JSON.stringify({ path })
       });
       return jsonOrThrow(res);
+    },
+    async storage(path) {
+      const res = await fetch(`/api/mount_points/storage?path=${encodeURIComponent(path)}`);
+      return jsonOrThrow(res);
+    },
+    async setStorage(path, options = {}) {
+      const res = await fetch('/api/mount_points/storage', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ path, ...options })
+      });
+      return jsonOrThrow(res);
     }
   },
   netease: {
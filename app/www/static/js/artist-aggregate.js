@@ -1,5 +1,6 @@
 import { state } from './state.js';
 import { ui } from './ui.js';
+import { coverUrl } from './utils.js';
 
 // 歌手聚合视图 - 按歌手分组显示歌曲
 export function renderArtistAggregateView(songs, playTrack) {
@@ -40,7 +41,7 @@ export function renderArtistAggregateView(songs, playTrack) {
 
     artistCard.innerHTML = `
       <div class="artist-header">
-        <img src="${firstSongCover}" loading="lazy" class="artist-cover">
+        <img src="${coverUrl(firstSongCover, 256)}" loading="lazy" class="artist-cover">
         <div class="artist-info">
           <div class="artist-name">${artist}</div>
           <div class="artist-count">${artistSongs.length} 首歌曲</div>
@@ -79,7 +80,7 @@ function openArtistModal(artistName, artistSongs, playTrack) {
   modal.innerHTML = `
     <div class="artist-modal-header">
       <div class="artist-modal-cover">
-        <img src="${firstSongCover}" loading="lazy">
+        <img src="${coverUrl(firstSongCover, 256)}" loading="lazy">
       </div>
       <div class="artist-modal-info">
         <div class="artist-modal-name">${artistName}</div>
@@ -104,7 +105,7 @@ function openArtistModal(artistName, artistSongs, playTrack) {
     
     songItem.innerHTML = `
       <div class="artist-modal-song-cover">
-        <img src="${song.cover}" loading="lazy">
+        <img src="${coverUrl(song.cover, 64)}" loading="lazy">
       </div>
       <div class="artist-modal-song-info">
         <div class="artist-modal-song-title">${song.title}</div>
@@ -1,7 +1,7 @@
 import { state, persistState, saveFavorites, savePlaylist, saveCachedPlaylists, saveCachedPlaylistSongs, updateListenStats, getListenStats } from './state.js';
 import { ui } from './ui.js';
 import { api } from './api.js';
-import { showToast, showConfirmDialog, hideProgressToast, updateDetailFavButton, formatTime, renderNoLyrics, updateSliderFill, flyToElement, throttle, extractColorFromImage } from './utils.js';
+import { showToast, showConfirmDialog, hideProgressToast, updateDetailFavButton, formatTime, renderNoLyrics, updateSliderFill, flyToElement, throttle, extractColorFromImage, paletteColor, coverUrl, lqipStyle } from './utils.js';
 import { startScanPolling, loadMountPoints } from './mounts.js';
 import { showPlaylistSelectDialog, loadPlaylistFilter, handlePlaylistFilterChange, showCreatePlaylistDialog, clearPlaylistCache } from './favorites.js';
 import { batchManager } from './batch-manager.js';
@@ -209,7 +209,7 @@ export async function loadSongs(retry = true, initPlayer = true) {
 
     if (libJson.success && libJson.data) {
       console.log('[Player] 处理音乐列表数据，共 ' + libJson.data.length + ' 首歌曲');
-      // 2. 合并数据：保留本地缓存的封面和歌词
+      // 2. 合并数据：服务端有封面时以其为准（哈希地址随封面内容变化），否则保留本地缓存的封面；保留本地歌词
       const oldMap = new Map(state.fullPlaylist.map(s => [s.filename, s]));
       const newList = libJson.data.map(item => {
         const old = oldMap.get(item.filename);
@@ -219,7 +219,7 @@ export async function loadSongs(retry = true, initPlayer = true) {
           artist: item.artist || '未知艺术家',
           id: item.id,
           src: `/api/music/play/${encodeURIComponent(item.id)}`,
-          cover: (old && old.cover && !old.cover.includes('ICON_256')) ? old.cover : (item.album_art || '/static/images/ICON_256.PNG'),
+          cover: item.album_art || ((old && old.cover && !old.cover.includes('ICON_256')) ? old.cover : '/static/images/ICON_256.PNG'),
           lyrics: (old && old.lyrics) ? old.lyrics : item.lyrics
         };
       });
@@ -599,7 +599,7 @@ export function renderPlaylist() {
       if (song.isExternal) card.style.border = '1px dashed var(--primary)';
 
       // 卡片内容（不包含复选框和收藏按钮）
-      card.innerHTML = `<img src="${song.cover}" loading="lazy"><div class="card-info"><div class="title" title="${song.title}">${song.title}</div><div class="artist">${song.artist}</div></div>`;
+      card.innerHTML = `<img src="${coverUrl(song.cover, 256)}" loading="lazy" style="${lqipStyle(song.cover_lqip)}"><div class="card-info"><div class="title" title="${song.title}">${song.title}</div><div class="artist">${song.artist}</div></div>`;
 
       card.addEventListener('click', (e) => {
         // 防止点击复选框时触发播放
@@ -850,7 +850,7 @@ export async function renderFavoritesHome() {
 
       folderCard.innerHTML = `
         <div class="folder-header">
-          <img src="${folderCover}" loading="lazy" class="folder-cover">
+          <img src="${coverUrl(folderCover, 256)}" loading="lazy" class="folder-cover">
           <div class="folder-info">
             <div class="folder-name">${playlist.name} </div>
             <div class="folder-count">${playlist.song_count || 0} 首歌曲</div>
@@ -1206,7 +1206,7 @@ export function renderPlaylistSongs(songs, skipSort = false) {
     const playCountBadge = stats && stats.playCount >= 1 ? `<span class="play-count-badge" title="已播放${stats.playCount}次">${formatPlayCount(stats.playCount)}</span>` : '';
 
     // 卡片内容（不包含复选框和收藏按钮）
-    card.innerHTML = `<img src="${song.cover}" loading="lazy"><div class="card-info"><div class="title" title="${song.title}">${song.title}</div><div class="artist">${song.artist}</div></div>${playCountBadge}`;
+    card.innerHTML = `<img src="${coverUrl(song.cover, 256)}" loading="lazy" style="${lqipStyle(song.cover_lqip)}"><div class="card-info"><div class="title" title="${song.title}">${song.title}</div><div class="artist">${song.artist}</div></div>${playCountBadge}`;
 
     card.addEventListener('click', (e) => {
       // 防止点击复选框时触发播放
@@ -1517,8 +1517,10 @@ function loadTrackInfo(track) {
   ['current-title', 'fp-title'].forEach(id => { const el = document.getElementById(id); if (el) el.innerText = track.title; });
   ['current-artist', 'fp-artist'].forEach(id => { const el = document.getElementById(id); if (el) el.innerText = track.artist; });
   // 更健壮的封面处理，确保始终有封面显示
-  const coverSrc = track.cover && track.cover.trim() !== '' ? track.cover : '/static/images/ICON_256.PNG';
+  const coverSrc = track.cover && track.cover.trim() !== '' ? coverUrl(track.cover, 1024) : '/static/images/ICON_256.PNG';
   ['current-cover', 'fp-cover'].forEach(id => { const el = document.getElementById(id); if (el) el.src = coverSrc; });
+  // 服务端已算出封面配色时立即设置主题色，不必等封面加载后在浏览器里取色
+  applyCoverColor(paletteColor(track.cover_palette));
   updateDetailFavButton(state.favorites.has(track.id));
   document.title = `${track.title} - 2FMusic`;
   if (ui.lyricsContainer) ui.lyricsContainer.innerHTML = '';
@@ -2443,20 +2445,10 @@ export function bindUiControls() {
       if (fpCover.src.indexOf('ICON_256.PNG') !== -1) {
         if (ui.fullPlayerOverlay) ui.fullPlayerOverlay.style.background = 'rgba(0, 0, 0, 0.85)';
       } else {
-        const color = extractColorFromImage(fpCover);
-        if (color) {
-          // 移动端防止背景太透导致看到下面的列表 (透视问题)
-          const isMobile = window.innerWidth <= 768;
-          const alpha = isMobile ? 0.98 : 0.8;
-          const rgbaStr = `rgba(${color.r}, ${color.g}, ${color.b}, ${alpha})`;
-
-          // 1. 设置全屏背景渐变
-          ui.fullPlayerOverlay.style.background = `linear-gradient(to bottom, ${rgbaStr} 0%, #000 120%)`;
-
-          // 2. 设置动态菜单背景色 (使用提取的 RGB + 0.7 透明度)
-          // 这样 Action Menu 就有了跟随封面的半透明背景
-          document.documentElement.style.setProperty('--dynamic-glass-color', `rgba(${color.r}, ${color.g}, ${color.b}, 0.7)`);
-        }
+        // 有服务端配色的歌曲已在 loadTrackInfo 中设置，其余（如外部文件）在浏览器里取色
+        const track = state.playQueue[state.currentTrackIndex];
+        if (track && paletteColor(track.cover_palette)) return;
+        applyCoverColor(extractColorFromImage(fpCover));
       }
     };
 
@@ -2468,6 +2460,22 @@ export function bindUiControls() {
   }
 }
 
+// 按封面主色设置全屏播放页背景与菜单背景色
+function applyCoverColor(color) {
+  if (!color || !ui.fullPlayerOverlay) return;
+  // 移动端防止背景太透导致看到下面的列表 (透视问题)
+  const isMobile = window.innerWidth <= 768;
+  const alpha = isMobile ? 0.98 : 0.8;
+  const rgbaStr = `rgba(${color.r}, ${color.g}, ${color.b}, ${alpha})`;
+
+  // 1. 设置全屏背景渐变
+  ui.fullPlayerOverlay.style.background = `linear-gradient(to bottom, ${rgbaStr} 0%, #000 120%)`;
+
+  // 2. 设置动态菜单背景色 (使用提取的 RGB + 0.7 透明度)
+  // 这样 Action Menu 就有了跟随封面的半透明背景
+  document.documentElement.style.setProperty('--dynamic-glass-color', `rgba(${color.r}, ${color.g}, ${color.b}, 0.7)`);
+}
+
 export async function initPlayer() {
   bindUiControls();
   bindPlayerEvents();
@@ -216,6 +216,28 @@ export function saveFavoritesToStorage() {
   saveFavorites();
 }
 
+// 本地封面地址附加 size 参数，按显示尺寸取缩略图
+export function coverUrl(url, size) {
+  if (!url || !url.startsWith('/api/music/covers/')) return url;
+  return `${url}${url.includes('?') ? '&' : '?'}size=${size}`;
+}
+
+// 封面加载前的占位色块：服务端给出 3x3 颜色网格，用三行横向渐变绘制
+export function lqipStyle(lqip) {
+  if (!lqip || !/^[0-9a-f]{54}$/.test(lqip)) return '';
+  const c = i => `#${lqip.slice(i * 6, i * 6 + 6)}`;
+  const row = r => `linear-gradient(to right, ${c(r * 3)}, ${c(r * 3 + 1)}, ${c(r * 3 + 2)})`;
+  return `background: ${row(0)} top / 100% 34% no-repeat, ${row(1)} center / 100% 34% no-repeat, ${row(2)} bottom / 100% 34% no-repeat;`;
+}
+
+// 服务端预先算出的封面配色（逗号分隔的十六进制，第一个为主色），返回与 extractColorFromImage 相同结构的主色
+export function paletteColor(palette) {
+  const hex = palette ? palette.split(',')[0] : '';
+  if (!/^[0-9a-f]{6}$/.test(hex)) return null;
+  const [r, g, b] = [0, 2, 4].map(i => parseInt(hex.slice(i, i + 2), 16));
+  return { r, g, b, toString: () => `rgba(${r}, ${g}, ${b}, 0.8)` };
+}
+
 export function extractColorFromImage(imgEl) {
   try {
     // 优先使用 ColorThief 以获得更好的主色调